@@ -1,19 +1,73 @@
 """Asynchronous mesh discovery + sync prototype with security (ECDH + HMAC).
 
-Integrated with mesh.discovery: on peer discovery initiate key exchange and hello to sync.
+Integrated with mesh.discovery: a newly discovered peer (or one whose session expired) gets a key
+exchange and then a HELLO; a known peer gets a HELLO only when the store summary it announces changes.
+New object versions are pushed to a few random peers (GOSSIP), which fetch and forward them,
+and a background anti-entropy task says HELLO to a peer every so often to repair what gossip missed.
+
+Messages are JSON by default. Peers that advertise the `bin1` capability in HELLO/DIGESTS
+exchange compact binary frames instead (see mesh.wire).
 """
 
 import asyncio
+import glob
 import json
+import logging
 import base64
+import os
+import random
 import time
 import uuid
-from typing import Dict, Tuple
+from typing import Dict
 
-from .crypto import generate_keypair, derive_keys, b64, ub64, encrypt_and_mac, verify_and_decrypt
+from . import budget, compress, delta, fec, fetch, fragment, multicast, objectio, stream, wire
+from .crdt import Replica, VersionVector
+from .merkle import MerkleTree
+from .peers import PEER_TTL, SCORE_SIZE, SWEEP_INTERVAL, PeerQuality
+from .metrics import RATE_BUCKETS, Registry, Tracer, serve
+from .receiver import ReceivePipeline
+from .scheduler import LANE_BULK, LANE_CONTROL, WRITE_HIGH_WATER, SendScheduler, TokenBucket
+from .storage import MemoryStore
+from .transfer import (BLOCK_SIZE, DEFAULT_WINDOW, ENDGAME_CHUNKS, MAX_REQUEST_CHUNKS, MAX_RETRIES, RTO_MAX, IncomingTransfer,
+                       RttEstimator, chunk_checksum, chunk_count, clip_ranges, state_path)
+from .crypto import (MAC_SIZE, NONCE_SIZE, RESUME_NONCE_SIZE, SUITE_AEAD, SUITES, GroupKey, Session, Tickets,
+                     generate_keypair, resumed_secret, b64, ub64)
 from .discovery import DiscoveryService
 
 CHUNK_SIZE = 1024
+CAP_DELTA = 'delta1'
+CAP_CRDT = 'crdt1'
+CAP_SWARM = 'swarm1'
+CAP_GOSSIP = 'gossip1'
+CAPABILITIES = [wire.CAP_BINARY, CAP_DELTA, CAP_CRDT, CAP_SWARM, CAP_GOSSIP, fragment.CAP_FRAGMENT, fec.CAP_FEC,
+                multicast.CAP_MULTICAST]
+DELTA_MIN_SIZE = 8 * CHUNK_SIZE  # smaller objects are cheaper to refetch than to diff
+RECIPE_CACHE = 16
+DELTA_SCAN_RATE = 1024 * 1024  # bytes/s a sender is granted to segment an object before the recipe is given up on
+FULL_DIGEST_LIMIT = 32  # stores this small answer a differing HELLO with the full digest list
+HAVE_EVERY = 32  # chunks received between HAVE announcements to other swarm peers
+MAX_HAVE_RANGES = 128
+COMPRESS_CACHE = 64  # objects whose sample-check result is remembered
+GOSSIP_FANOUT = 4  # peers a new object version is pushed to, by its origin and by every node that fetches it
+GOSSIP_TTL = 8  # hops after which a rumor is no longer forwarded
+GOSSIP_BATCH = 16  # digest entries per GOSSIP message
+DIGEST_BYTES = 800  # JSON bytes of entries per DIGESTS message, so one fits fragment.MIN_MTU with headers and sealing
+TREE_ANSWER_DIGESTS = 256  # digest entries answering one TREE_REQUEST; the requester asks again for the rest
+TREE_BATCH = 3  # subtrees (16 child hashes each) per TREE message
+TREE_REQUEST_PREFIXES = 64  # prefixes per TREE_REQUEST
+TREE_ANSWER_TIMEOUT = 2.0  # seconds to wait for the DIGESTS answering a TREE_REQUEST before asking for the next buckets
+RUMOR_MEMORY = 1024  # (object_id, version) rumors remembered for forwarding
+ANTI_ENTROPY_INTERVAL = 10.0  # mean seconds between HELLOs to a chosen peer
+ANTI_ENTROPY_JITTER = 0.5  # each interval is drawn from mean * (1 +/- jitter)
+RECONCILE_CHOICES = 3  # random peers considered for each anti-entropy HELLO
+FILTER_CACHE = 8  # summary trees kept for peers' subscription filters
+SESSION_TTL = 3600.0  # seconds a session is used before discovery or anti-entropy re-keys it
+TICKET_TTL = 86400.0  # lifetime of the resumption tickets we issue
+TICKET_CACHE = 256  # tickets from peers kept for resuming
+KE_RETRIES = 5  # KEY_EXCHANGE resends (RTO backoff) before giving up until the next trigger
+SEAL, OPEN = ('seal',), ('open',)  # crypto histogram labels
+
+log = logging.getLogger(__name__)
 
 
 def now_ts():
@@ -28,38 +82,199 @@ class SyncNodeProtocol(asyncio.DatagramProtocol):
         self.transport = transport
         self.node._set_transport(transport)
 
+    def pause_writing(self):
+        self.node.scheduler.pause()
+
+    def resume_writing(self):
+        self.node.scheduler.resume()
+
     def datagram_received(self, data, addr):
-        try:
-            msg = json.loads(data.decode('utf-8'))
-        except Exception as e:
-            print(f"{self.node.node_id}: invalid message from {addr}: {e}")
-            return
-        asyncio.create_task(self.node.handle_message(msg, addr))
+        # decoding and handling happen in the node's receive workers
+        self.node.receiver.submit(data, addr)
+
+
+class GroupProtocol(asyncio.DatagramProtocol):
+    """Receives a multicast group's datagrams; they are handled like ones from the sender's address."""
+
+    def __init__(self, node):
+        self.node = node
+
+    def datagram_received(self, data, addr):
+        self.node.receiver.submit(data, addr)
 
 
 class SyncNode:
-    def __init__(self, host: str, port: int, node_id: str = None):
+    def __init__(self, host: str, port: int, node_id: str = None, window: int = DEFAULT_WINDOW, state_dir: str = None,
+                 storage=None, rate: float = None, peer_rate: float = None, trace_rate: float = 0.0, seed=None,
+                 codecs=None, fanout: int = GOSSIP_FANOUT, anti_entropy: float = ANTI_ENTROPY_INTERVAL,
+                 stream_port: int = None, peer_ttl: float = PEER_TTL, subscribe=None, priorities=None,
+                 max_fetches: int = fetch.MAX_FETCHES, max_reassembly: int = budget.MAX_REASSEMBLY,
+                 peer_reassembly: int = budget.PEER_REASSEMBLY, stall_timeout: float = budget.STALL_TIMEOUT,
+                 session_ttl: float = SESSION_TTL, mtu: int = fragment.DEFAULT_MTU, fec_repair: bool = True):
         self.host = host
         self.port = port
         self.node_id = node_id or str(uuid.uuid4())
-        # storage: object_id -> (bytes, version)
-        self.storage: Dict[str, Tuple[bytes, int]] = {}
+        # storage: object_id -> (bytes, version); MemoryStore by default, LogStore for persistence
+        self.storage = storage if storage is not None else MemoryStore()
         self.transport = None
         self._endpoint = None
-        self.peers = {}  # addr -> peer state: {id, session, sent_pub}
-        self.pending = {}  # object_id -> bytearray for incoming
-        # generate keypair
-        self.pub, self.priv = generate_keypair()
+        self.clock = time.monotonic  # the event loop's clock once started (virtual under mesh.simnet)
+        self.rng = random.Random(seed)
+        # outbound lanes and pacing; rate/peer_rate are bytes/s for the whole link and per peer
+        self.scheduler = SendScheduler(self._transmit, rate, peer_rate)
+        self.receiver = ReceivePipeline(self)
+        # datagrams over the path MTU go out as fragments (see mesh.fragment); `mtu` caps what we probe for
+        self.mtu = mtu
+        self.reassembly = fragment.Reassembler()
+        self.fec_repair = fec_repair  # ask lossy peers for repair symbols (mesh.fec); serving them is always on
+        self._frag_id = self.rng.getrandbits(32)
+        self.metrics = Registry()
+        self.tracer = Tracer(trace_rate)  # sampled spans per message type; set tracer.rates to pick types
+        self._labels = {}  # addr -> peer label
+        self._metrics_server = None
+        self._init_metrics()
+        self._handlers = {
+            'KEY_EXCHANGE': self._on_key_exchange,
+            'ENCRYPTED': self._on_encrypted,
+            'HELLO': self._on_hello,
+            'DIGESTS': self._on_digests,
+            'TREE': self._on_tree,
+            'TREE_REQUEST': self._on_tree_request,
+            'REQUEST': self._on_request,
+            'CHUNK': self._on_chunk,
+            'ACK': self._on_ack,
+            'DELTA_REQUEST': self._on_delta_request,
+            'RECIPE': self._on_recipe,
+            'CRDT_PULL': self._on_crdt_pull,
+            'CRDT_DELTA': self._on_crdt_delta,
+            'HAVE': self._on_have,
+            'GOSSIP': self._on_gossip,
+            'MCAST_OFFER': self._on_mcast_offer,
+            'MCAST_JOIN': self._on_mcast_join,
+            'MCAST_END': self._on_mcast_end,
+        }
+        self.peers = {}  # addr -> peer state: {id, session, caps, quality, ...}
+        self.peer_ttl = peer_ttl  # peers silent this long are evicted; 0/None keeps them
+        self._sweep_timer = None
+        self.pending: Dict[str, IncomingTransfer] = {}  # object_id -> incoming transfer
+        self._readers = {}  # object_id -> events of open ObjectReaders, set when there is more to read
+        # caps on in-memory reassembly buffers; in-memory transfers stalled this long are evicted (0/None keeps them)
+        self.budget = budget.ReassemblyBudget(max_reassembly, peer_reassembly)
+        self.stall_timeout = stall_timeout
+        self.window = window  # max chunks in flight per incoming transfer
+        self._delta_wait = {}  # object_id -> digest entry + peer while a RECIPE is outstanding
+        self._recipes = {}  # (object_id, version) -> task segmenting a locally held object for RECIPEs
+        self.crdts: Dict[str, Replica] = {}  # object_id -> replicated CRDT (kept apart from blob storage)
+        self.state_dir = state_dir  # where partial transfers are persisted; None keeps them in memory
+        self.tree = MerkleTree()  # summary of (object_id, version) for reconciliation
+        for oid, ver in self.storage.versions():
+            self.tree.update(oid, ver)
+        # namespaces (id prefixes) we fetch; None is all. Peers summarize only these for us
+        self.subscribe = fetch.normalize(subscribe)
+        self._filtered = {}  # subscription prefixes -> MerkleTree of the matching objects
+        self.fetches = fetch.FetchQueue(priorities)  # objects to fetch, most urgent first
+        self.max_fetches = max_fetches
+        self._fetch_drain = None
+        if state_dir:
+            os.makedirs(state_dir, exist_ok=True)
+            self._load_partials()
+        # sessions use fresh X25519 keys per exchange; tickets let a peer resume without one
+        self.suites = list(SUITES)  # session suites offered in KEY_EXCHANGE
+        self.session_ttl = session_ttl  # 0/None: sessions never expire
+        self.tickets = Tickets(TICKET_TTL)  # seals the tickets we hand out
+        self._tickets = {}  # addr -> {ticket, secret, expires} received from that peer
+        self._advertise = None  # pending update of the summary in our discovery announcements
+        self._loop = None
+        self.codecs = compress.available() if codecs is None else list(codecs)  # chunk codecs, in preference order
+        self._compressible = {}  # (object_id, version, codec) -> sample check passed
+        # push gossip of new versions, plus periodic HELLOs to catch whatever the rumors missed
+        self.fanout = fanout  # 0 disables push
+        self.anti_entropy = anti_entropy  # mean interval in seconds; 0/None disables
+        self._rumors = {}  # (object_id, version) -> {hops, seen: peers known to have heard of it}
+        self._gossip_out = {}  # addr -> digest entries waiting for the next flush
+        self._tree_more = {}  # addr -> {prefixes: leaf buckets still to ask for, asked: when the last ask went out}
+        self._gossip_flush = None
+        self._anti_entropy_task = None
+        # TCP bulk transport for large objects: None disables it, 0 picks a free port at start()
+        self.stream_port = stream_port
+        self.streams = stream.StreamPool()
+        self._stream_server = None
+        self._stream_conns = set()  # connections we are serving
         self.discovery = None
+        # one-to-many distribution over multicast groups (see mesh.multicast); mesh.simnet replaces listen_group
+        self.listen_group = multicast.listen
+        self._groups = {}  # group (ip, port) -> [transport, distributions using it]
+        self._mcast_in = {}  # (sender addr, key id) -> our membership in a distribution we receive
+        self._mcast_out = {}  # key id -> {offered, answers, answered} of a distribution we send
 
     async def start(self):
-        loop = asyncio.get_running_loop()
+        loop = self._loop = asyncio.get_running_loop()
+        self.clock = self.scheduler.clock = self.receiver.clock = loop.time
+        self.receiver.start()
         transport, protocol = await loop.create_datagram_endpoint(lambda: SyncNodeProtocol(self), local_addr=(self.host, self.port))
         self._endpoint = (transport, protocol)
+        transport.set_write_buffer_limits(high=WRITE_HIGH_WATER)
+        if self.anti_entropy:
+            self._anti_entropy_task = loop.create_task(self._anti_entropy_loop())
+        if self.peer_ttl or self.stall_timeout:
+            self._sweep_timer = loop.call_later(SWEEP_INTERVAL, self._sweep_peers)
+        if self.stream_port is not None:
+            self.streams.clock = loop.time
+            self._stream_server = await asyncio.start_server(self._on_stream_connection, self.host, self.stream_port)
+            self.stream_port = self._stream_server.sockets[0].getsockname()[1]
         # transport will also be set via protocol.connection_made
-        print(f"{self.node_id}: listening on {self.host}:{self.port}")
+        log.info('%s: listening on %s:%s', self.node_id, self.host, self.port)
 
     def stop(self):
+        if self._metrics_server:
+            self._metrics_server.close()
+            self._metrics_server = None
+        for w in self._delta_wait.values():
+            w['timer'].cancel()
+        for r in self._recipes.values():
+            r.cancel()
+        if self._anti_entropy_task:
+            self._anti_entropy_task.cancel()
+            self._anti_entropy_task = None
+        if self._gossip_flush:
+            self._gossip_flush.cancel()
+            self._gossip_flush = None
+        if self._sweep_timer:
+            self._sweep_timer.cancel()
+            self._sweep_timer = None
+        if self._fetch_drain:
+            self._fetch_drain.cancel()
+            self._fetch_drain = None
+        if self._advertise:
+            self._advertise.cancel()
+            self._advertise = None
+        for st in self.peers.values():
+            for timer in ('ke_timer', 'pmtu_timer'):
+                if st.get(timer):
+                    st[timer].cancel()
+        if self._stream_server:
+            self._stream_server.close()
+            self._stream_server = None
+        self.streams.close()
+        for conn in self._stream_conns:
+            conn.close()
+        self.scheduler.close()
+        self.receiver.stop()
+        for t in self.pending.values():
+            self._cancel_timers(t)
+            if t.multicast is not None and t.multicast['timer']:
+                t.multicast['timer'].cancel()
+            if t.stream:
+                t.stream.cancel()
+            if t.path:
+                t.save()
+        try:
+            self.storage.close()
+        except Exception:
+            pass
+        for transport, _ in self._groups.values():
+            transport.close()
+        self._groups.clear()
         try:
             if self._endpoint:
                 transport, _ = self._endpoint
@@ -73,267 +288,1845 @@ class SyncNode:
         except Exception:
             pass
 
-    def start_with_discovery(self, metadata: dict = None):
-        """Start discovery service and bind to discovery updates."""
+    def _init_metrics(self):
+        m = self.metrics
+        self._m_sent = m.counter('mesh_messages_sent_total', 'Messages sent', ('type', 'peer'))
+        self._m_sent_bytes = m.counter('mesh_bytes_sent_total', 'Datagram bytes sent', ('type', 'peer'))
+        self._m_recv = m.counter('mesh_messages_received_total', 'Messages received', ('type', 'peer'))
+        self._m_recv_bytes = m.counter('mesh_bytes_received_total', 'Datagram bytes received', ('type', 'peer'))
+        self._m_crypto = m.histogram('mesh_crypto_seconds', 'Time to seal or open one message', ('op',))
+        self._m_rtt = m.histogram('mesh_chunk_rtt_seconds', 'Chunk request round-trip time', ('peer',))
+        self._m_retransmits = m.counter('mesh_retransmits_total', 'Chunks requested again after a timeout', ('peer',))
+        self._m_transfers = m.counter('mesh_transfers_total', 'Incoming transfers finished', ('result',))
+        self._m_evicted = m.counter('mesh_peers_evicted_total', 'Peers dropped after PEER_TTL without a message')
+        self._m_sessions = m.counter('mesh_sessions_total', 'Sessions established, by key exchange or ticket', ('kind',))
+        self._m_discovery = m.counter('mesh_discovery_syncs_total', 'Discovery announcements that led to a key exchange or HELLO',
+                                      ('reason',))
+        self._m_evicted_transfers = m.counter('mesh_transfers_evicted_total', 'Incoming transfers dropped to bound memory',
+                                              ('reason',))
+        self._m_deferred = m.counter('mesh_fetches_deferred_total', 'Fetches put back in the queue for lack of reassembly memory')
+        self._m_transfer_bytes = m.counter('mesh_transfer_bytes_total', 'Object bytes received by transfer')
+        self._m_compressed = m.counter('mesh_chunks_compressed_total', 'Chunks sent compressed', ('codec',))
+        self._m_saved = m.counter('mesh_compression_saved_bytes_total', 'Chunk bytes saved by compression', ('codec',))
+        self._m_incompressible = m.counter('mesh_incompressible_objects_total', 'Objects sent raw after the sample check',
+                                           ('codec',))
+        self._m_throughput = m.histogram('mesh_transfer_throughput_bytes_per_second', 'Object size over transfer time',
+                                         buckets=RATE_BUCKETS)
+        sched, rx = self.scheduler, self.receiver
+        m.gauge('mesh_send_queue_datagrams', 'Bulk datagrams waiting in the send scheduler', fn=sched.queued)
+        m.counter('mesh_send_datagrams_total', 'Datagrams put on the wire', ('lane',),
+                  fn=lambda: {('control',): sched.sent[LANE_CONTROL], ('bulk',): sched.sent[LANE_BULK]})
+        m.gauge('mesh_receive_queue_datagrams', 'Datagrams waiting in the receive inboxes', fn=lambda: rx.total)
+        m.counter('mesh_receive_dropped_total', 'Datagrams shed by the receive pipeline', ('lane',),
+                  fn=lambda: {('control',): rx.dropped[LANE_CONTROL], ('bulk',): rx.dropped[LANE_BULK]})
+        m.gauge('mesh_transfers_active', 'Incoming transfers in progress or parked', fn=lambda: len(self.pending))
+        m.gauge('mesh_fetch_queue_objects', 'Objects waiting for a free fetch slot', fn=lambda: len(self.fetches))
+        m.gauge('mesh_reassembly_bytes', 'Bytes held by in-memory reassembly buffers',
+                fn=lambda: self.budget.usage(self.pending.values())[0])
+        if hasattr(self.storage, 'stats'):
+            m.gauge('mesh_cache_bytes', 'Object bytes by storage tier', ('tier',),
+                    fn=lambda: {('memory',): self.storage.stats()['hot_bytes'], ('disk',): self.storage.stats()['spilled_bytes']})
+        m.gauge('mesh_peers', 'Known peers', fn=lambda: len(self.peers))
+        self._m_repair_sent = m.counter('mesh_fec_repair_symbols_sent_total', 'FEC repair symbols sent with requested chunks')
+        self._m_recovered = m.counter('mesh_fec_recovered_chunks_total', 'Lost chunks rebuilt from repair symbols')
+        self._m_fragmented = m.counter('mesh_fragmented_datagrams_total', 'Datagrams sent as fragments over the path MTU')
+        m.counter('mesh_reassembly_dropped_total', 'Partially reassembled datagrams given up', ('reason',),
+                  fn=lambda: {(k,): v for k, v in self.reassembly.dropped.items()})
+        self._m_stream = m.counter('mesh_stream_bytes_total', 'Object bytes moved over stream connections', ('direction',))
+        m.gauge('mesh_stream_connections_idle', 'Pooled stream connections', fn=lambda: self.streams.idle_count())
+
+    def _peer_label(self, addr) -> str:
+        label = self._labels.get(addr)
+        if label is None:
+            label = self._labels[addr] = f'{addr[0]}:{addr[1]}' if isinstance(addr, tuple) else str(addr)
+        return label
+
+    def _count_out(self, mtype: str, addr, nbytes: int):
+        key = (mtype, self._peer_label(addr))
+        self._m_sent.inc(key)
+        self._m_sent_bytes.inc(key, nbytes)
+
+    def _count_in(self, mtype: str, addr, nbytes: int):
+        key = (mtype, self._peer_label(addr))
+        self._m_recv.inc(key)
+        if nbytes:
+            self._m_recv_bytes.inc(key, nbytes)
+
+    async def _traced(self, span, coro):
+        error = None
+        try:
+            await coro
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self.tracer.finish(span, error)
+
+    def metrics_snapshot(self) -> dict:
+        """Current metric values (see Registry.snapshot) and the most recent sampled trace spans."""
+        return {'node': self.node_id, 'metrics': self.metrics.snapshot(), 'spans': self.tracer.snapshot()}
+
+    async def serve_metrics(self, host: str = '127.0.0.1', port: int = 9464):
+        """Expose /metrics (Prometheus text), /metrics.json and /traces over HTTP until stop()."""
+        self._metrics_server = await serve(self.metrics, host, port, self.tracer)
+        return self._metrics_server
+
+    def start_with_discovery(self, metadata: dict = None, service=DiscoveryService):
+        """Start discovery service and bind to discovery updates.
+
+        `service` builds the discovery service from (node_id, metadata, on_update); mesh.simnet passes its own.
+        """
         if self.discovery:
             return
-        self.discovery = DiscoveryService(node_id=self.node_id, metadata=metadata or {'name': 'sync-node', 'sync_port': self.port}, on_update=self._on_discovered)
+        metadata = dict(metadata or {'name': 'sync-node', 'sync_port': self.port}, summary=self.tree.root())
+        self.discovery = service(node_id=self.node_id, metadata=metadata, on_update=self._on_discovered)
         self.discovery.start()
 
     def _on_discovered(self, msg, addr):
-        # discovery provides (msg, (ip, port)); assume peer listens on same port if provided in meta
+        # discovery provides (msg, (ip, port)), possibly from its own thread; assume the peer listens
+        # on our port unless its metadata says otherwise
         peer_meta = msg.get('meta', {})
-        peer_addr = addr[0]
-        peer_port = peer_meta.get('sync_port') or self.port  # fallback to same port
-        peer = (peer_addr, int(peer_port))
-        print(f"{self.node_id}: discovered peer {msg.get('node_id')} at {peer}")
-        # auto start key exchange and hello
+        peer_port = peer_meta.get('sync_port') or self.port
+        peer = (addr[0], int(peer_port))
         try:
-            loop = asyncio.get_event_loop()
-            loop.call_soon_threadsafe(self.send_key_exchange, peer)
-            loop.call_later(0.2, lambda: loop.call_soon_threadsafe(self.send_hello, peer))
+            loop = self._loop or asyncio.get_event_loop()
+            loop.call_soon_threadsafe(self._discovered, peer, msg.get('node_id'), peer_meta.get('summary'))
         except Exception as e:
-            print('Error scheduling key exchange/hello:', e)
+            log.warning('%s: error scheduling key exchange/hello: %s', self.node_id, e)
+
+    def _discovered(self, peer, node_id, summary):
+        """Key exchange for new peers and expired sessions, HELLO when the announced summary changed, else nothing."""
+        st = self.peers.get(peer)
+        if st is not None:
+            self._seen(peer)
+        if st is None or not self._session_fresh(st):
+            if st is not None and st.get('ke_timer'):
+                return  # exchange already under way
+            reason = 'new' if st is None or st.get('session') is None else 'expired'
+            if reason == 'expired':
+                self.scheduler.forget(peer)
+            st = self.peers.setdefault(peer, {'id': node_id, 'session': None})
+            st['summary'] = summary
+            st['hello_pending'] = True  # HELLO once the session is up
+            self.send_key_exchange(peer)
+        elif summary is not None and summary != st.get('summary'):
+            if st.get('summary') is not None and summary == self.tree.root():
+                st['summary'] = summary
+                return  # it caught up with us: nothing to reconcile
+            reason = 'changed'
+            st['summary'] = summary
+            self.send_hello(peer)
+        else:
+            return
+        log.info('%s: discovered %s at %s (%s)', self.node_id, node_id, peer, reason)
+        self._m_discovery.inc((reason,))
+
+    def _advertise_summary(self):
+        self._advertise = None
+        if self.discovery is not None:
+            root = self.tree.root()
+            if self.discovery.metadata.get('summary') != root:
+                self.discovery.metadata['summary'] = root
+                self.discovery.announce_now()  # peers sync at once instead of at the next periodic announcement
 
     def _set_transport(self, transport):
         self.transport = transport
 
     def add_object(self, object_id: str, data: bytes, version: int = 1):
-        self.storage[object_id] = (data, version)
+        self._store(object_id, data, version)
+        self._gossip(object_id, version, 0)
+
+    def add_object_from_file(self, object_id: str, path: str, version: int = 1, block_size: int = BLOCK_SIZE) -> int:
+        """Add an object from a file, read `block_size` bytes at a time; returns its size.
+
+        With a LogStore the object never sits in memory as a whole.
+        """
+        w = self.storage.writer(object_id, version)
+        try:
+            with open(path, 'rb') as f:
+                for data in iter(lambda: f.read(block_size), b''):
+                    w.write(data)
+        except BaseException:
+            w.abort()
+            raise
+        return self._add_written(w)
+
+    async def add_object_stream(self, object_id: str, pieces, version: int = 1) -> int:
+        """Add an object from an async (or plain) iterable of bytes-like pieces; returns its size."""
+        w = self.storage.writer(object_id, version)
+        try:
+            if hasattr(pieces, '__aiter__'):
+                async for data in pieces:
+                    w.write(data)
+            else:
+                for data in pieces:
+                    w.write(data)
+        except BaseException:
+            w.abort()
+            raise
+        return self._add_written(w)
+
+    def _add_written(self, w) -> int:
+        w.commit()
+        self._stored(w.oid, w.version)
+        self._gossip(w.oid, w.version, 0)
+        return w.size
+
+    def open_object(self, object_id: str, block_size: int = objectio.READ_BLOCK) -> objectio.ObjectReader:
+        """Async reader of a stored object, or of one still being fetched as its chunks arrive (see mesh.objectio).
+
+        Raises KeyError if the object is neither stored nor pending nor queued for fetching.
+        """
+        return objectio.ObjectReader(self, object_id, block_size)
 
-    def _send(self, msg: dict, addr):
+    def _wake_readers(self, oid: str):
+        for event in self._readers.get(oid, ()):
+            event.set()
+
+    def _store(self, oid: str, data: bytes, version: int, digest: str = None):
+        self.storage.put(oid, data, version, digest)
+        self._stored(oid, version)
+
+    def _stored(self, oid: str, version: int):
+        self._tree_update(oid, version)
+        self._wake_readers(oid)
+        needs_compaction = getattr(self.storage, 'needs_compaction', None)
+        if needs_compaction and needs_compaction():
+            try:
+                asyncio.get_running_loop().run_in_executor(None, self.storage.compact)
+            except RuntimeError:
+                self.storage.compact()
+
+    def add_crdt(self, object_id: str, kind: str) -> Replica:
+        """Create (or return) a CRDT object replicated by version vector, e.g. add_crdt('members', 'orset')."""
+        r = self.crdts.get(object_id)
+        if r is None:
+            r = Replica(kind, self.node_id, on_change=lambda rep, oid=object_id: self._tree_update(oid, 'vv:' + rep.vv.token()))
+            self.crdts[object_id] = r
+            self._tree_update(object_id, 'vv:')
+        return r
+
+    def _tree_update(self, oid: str, version):
+        self.tree.update(oid, version)
+        for prefixes, tree in self._filtered.items():
+            if oid.startswith(prefixes):
+                tree.update(oid, version)
+        if self.discovery is not None and self._advertise is None:
+            # one root recomputation per batch of updates
+            try:
+                self._advertise = asyncio.get_running_loop().call_soon(self._advertise_summary)
+            except RuntimeError:
+                self._advertise_summary()
+
+    def _tree_for(self, prefixes) -> MerkleTree:
+        """Summary tree of the objects in namespaces `prefixes` (all objects for None)."""
+        if prefixes is None:
+            return self.tree
+        tree = self._filtered.get(prefixes)
+        if tree is None:
+            tree = MerkleTree(self.tree.depth)
+            for oid, (ver, _) in self.tree.entries.items():
+                if oid.startswith(prefixes):
+                    tree.update(oid, ver)
+            self._filtered[prefixes] = tree
+            if len(self._filtered) > FILTER_CACHE:
+                self._filtered.pop(next(iter(self._filtered)))
+        return tree
+
+    def _peer_wants(self, addr, oid: str) -> bool:
+        return fetch.matches(oid, self.peers.get(addr, {}).get('subscribe'))
+
+    def _digest_entry(self, oid: str) -> dict:
+        r = self.crdts.get(oid)
+        if r is not None:
+            return {'id': oid, 'crdt': r.kind, 'vv': r.vv.to_dict()}
+        st = self.storage
+        return {'id': oid, 'version': st.version(oid), 'size': st.size(oid), 'hash': st.digest(oid)}
+
+    def _load_partials(self):
+        for meta in glob.glob(os.path.join(self.state_dir, '*.meta')):
+            try:
+                t = IncomingTransfer.load(meta[:-len('.meta')], self.window, self.rng)
+            except Exception as e:
+                log.warning('%s: ignoring unreadable partial transfer %s: %s', self.node_id, meta, e)
+                continue
+            self.pending[t.oid] = t
+            log.info('%s: resuming %s v%s at chunk %d (%d received)', self.node_id, t.oid, t.version, t.next_idx, t.nreceived)
+
+    def _transmit(self, data, addr):
+        self.transport.sendto(data, addr)
+
+    def _send(self, msg: dict, addr, lane: int = LANE_CONTROL, mtype: str = None):
         if not self.transport:
             raise RuntimeError('transport not ready')
         payload = json.dumps(msg).encode('utf-8')
-        self.transport.sendto(payload, addr)
+        self._count_out(mtype or msg.get('type'), addr, len(payload))
+        self._queue(payload, addr, lane)
+
+    def _send_frame(self, frame: bytes, addr, mtype: str, lane: int = LANE_CONTROL):
+        if not self.transport:
+            raise RuntimeError('transport not ready')
+        self._count_out(mtype, addr, len(frame))
+        self._queue(frame, addr, lane)
+
+    def _queue(self, data, addr, lane: int):
+        """Hand a datagram to the scheduler, as fragments if it exceeds the path MTU to a peer that reassembles."""
+        st = self.peers.get(addr, {})
+        pmtu = st.get('pmtu')
+        if pmtu is None or len(data) <= pmtu.mtu:
+            self.scheduler.send(data, addr, lane)
+            return
+        if st.get('pmtu_timer') is None:
+            self._probe_mtu(addr)  # first datagram over MIN_MTU to this peer: worth finding the path MTU now
+        self._frag_id = (self._frag_id + 1) & 0xFFFFFFFF
+        frags = fragment.split(data, pmtu.mtu, self._frag_id, wire.F_BULK if lane == LANE_BULK else 0)  # FragmentError
+        self._m_fragmented.inc()
+        for frag in frags:
+            self.scheduler.send(frag, addr, lane)
+
+    def _capability_fields(self) -> dict:
+        """What HELLO, DIGESTS and TREE advertise about this node."""
+        fields = {'capabilities': CAPABILITIES, 'codecs': self.codecs, 'mtu': self.mtu}
+        if self.stream_port is not None:
+            fields.update(capabilities=CAPABILITIES + [stream.CAP_STREAM], stream_port=self.stream_port)
+        if self.subscribe is not None:
+            fields['subscribe'] = list(self.subscribe)
+        return fields
+
+    def _uses_binary(self, addr) -> bool:
+        return wire.CAP_BINARY in self.peers.get(addr, {}).get('caps', ())
 
-    async def handle_message(self, msg: dict, addr):
+    def _note_capabilities(self, msg, addr):
+        caps = msg.get('capabilities')
+        if caps is None:
+            return
+        st = self.peers.get(addr, {'id': msg.get('from'), 'session': None})
+        st['caps'] = set(caps)
+        st['codec'] = compress.negotiate(self.codecs, msg.get('codecs'))  # None: send chunks raw
+        st['subscribe'] = fetch.normalize(msg.get('subscribe'))
+        port = msg.get('stream_port')
+        st['stream'] = int(port) if port and stream.CAP_STREAM in st['caps'] and self.stream_port is not None else None
+        self.peers[addr] = st
+        if fragment.CAP_FRAGMENT in st['caps'] and st.get('pmtu') is None:
+            st['pmtu'] = fragment.PathMtu(min(fragment.MIN_MTU, self.mtu), min(self.mtu, int(msg.get('mtu') or self.mtu)))
+
+    def _seal_frame(self, frame: bytes, session: Session, bulk: bool = False) -> bytearray:
+        # seal straight into the datagram buffer, after the ENCRYPTED header
+        flags = (wire.F_AEAD if session.aead else 0) | (wire.F_BULK if bulk else 0)
+        buf = wire.frame_buffer(wire.T_ENCRYPTED, len(frame) + session.overhead(), flags)
+        t0 = time.perf_counter()
+        session.seal_into(frame, buf, wire.HEADER_SIZE)
+        self._m_crypto.observe(time.perf_counter() - t0, SEAL)
+        return buf
+
+    def _send_msg(self, msg: dict, addr, lane: int = LANE_CONTROL):
+        """Send a message, encrypted if a session exists and binary framed if the peer supports it."""
+        session = self.peers.get(addr, {}).get('session')
+        if self._uses_binary(addr):
+            frame = wire.encode_message(msg)
+            if session:
+                frame = self._seal_frame(frame, session)
+            self._send_frame(frame, addr, msg['type'], lane)
+            return
+        mtype = msg['type']
+        if session:
+            pt = json.dumps(msg).encode('utf-8')
+            t0 = time.perf_counter()
+            sealed = session.seal(pt)
+            self._m_crypto.observe(time.perf_counter() - t0, SEAL)
+            if session.aead:
+                enc = {'aead': b64(sealed)}
+            else:
+                enc = {'n': b64(sealed[:NONCE_SIZE]), 'ct': b64(sealed[NONCE_SIZE:-MAC_SIZE]), 'mac': b64(sealed[-MAC_SIZE:])}
+            msg = {'type': 'ENCRYPTED', 'from': self.node_id, 'enc': enc}
+        self._send(msg, addr, lane, mtype)
+
+    def _chunk_codec(self, addr, oid: str, ver: int, sample):
+        """Codec for the chunks of (oid, ver) sent to `addr`, or None to send them raw.
+
+        `sample()` returns bytes of the object; it is compressed once per object and codec, and
+        objects that do not compress well are sent raw from then on.
+        """
+        codec = self.peers.get(addr, {}).get('codec')
+        if codec is None:
+            return None
+        key = (oid, ver, codec.name)
+        ok = self._compressible.get(key)
+        if ok is None:
+            ok = self._compressible[key] = compress.worth_compressing(sample(), codec)
+            if len(self._compressible) > COMPRESS_CACHE:
+                self._compressible.pop(next(iter(self._compressible)))
+            if not ok:
+                self._m_incompressible.inc((codec.name,))
+        return codec if ok else None
+
+    def _send_chunk(self, addr, oid: str, chunk_idx: int, chunk, more: int, ver: int, codec=None):
+        checksum = chunk_checksum(chunk)
+        raw_len = len(chunk)
+        if codec is not None:
+            packed = codec.compress(chunk)
+            if len(packed) < raw_len:
+                self._m_compressed.inc((codec.name,))
+                self._m_saved.inc((codec.name,), raw_len - len(packed))
+                chunk = packed
+            else:
+                codec = None
+        if self._uses_binary(addr):
+            frame = wire.encode_chunk(oid, chunk_idx, ver, chunk, bool(more), checksum, codec.cid if codec else 0)
+            session = self.peers.get(addr, {}).get('session')
+            if session:
+                frame = self._seal_frame(frame, session, bulk=True)
+            self._send_frame(frame, addr, 'CHUNK', LANE_BULK)
+            return
+        msg_out = {
+            'type': 'CHUNK',
+            'from': self.node_id,
+            'id': oid,
+            'chunk': chunk_idx,
+            'data': base64.b64encode(chunk).decode('ascii'),
+            'more': more,
+            'version': ver,
+            'checksum': checksum,
+        }
+        if codec is not None:
+            msg_out['codec'] = codec.name
+        self._send_msg(msg_out, addr, LANE_BULK)
+
+    def _send_request(self, addr, oid: str, ranges, repair: int = 0):
+        if self._uses_binary(addr):
+            session = self.peers.get(addr, {}).get('session')
+            # with FEC on, the link is lossy: a lost REQUEST would cost its whole batch an RTO, so send it twice
+            for flags in (0, wire.F_COPY) if repair else (0,):
+                frame = wire.encode_request(oid, ranges, repair, flags)
+                if session:
+                    frame = self._seal_frame(frame, session)
+                self._send_frame(frame, addr, 'REQUEST')
+            return
+        req = {'type': 'REQUEST', 'from': self.node_id, 'id': oid, 'chunk': ranges[0][0]}
+        if len(ranges) > 1 or ranges[0][1] > 1:
+            req['ranges'] = [list(r) for r in ranges]
+        if repair:
+            req['fec'] = repair
+        self._send_msg(req, addr)
+
+    async def handle_frame(self, frame: wire.Frame, addr):
+        """Handle a binary frame; CHUNK and REQUEST are served straight from the header fields."""
+        nbytes = wire.HEADER_SIZE + len(frame.oid) + len(frame.payload)
+        if frame.type == wire.T_ENCRYPTED:
+            if not self.peers.get(addr, {}).get('session'):
+                self._no_session(addr)
+                return
+            try:
+                frame = wire.decode_frame(self._open_sealed(addr, frame.payload, bool(frame.flags & wire.F_AEAD)))
+            except Exception as e:
+                log.warning('%s: decryption failed from %s: %s', self.node_id, addr, e)
+                return
+        if frame.type == wire.T_GROUP:
+            m = self._mcast_in.get((addr, frame.index))
+            if m is None:
+                return  # not a member, or that distribution is over for us
+            try:
+                frame = wire.decode_frame(m['key'].open(frame.payload))
+            except Exception as e:
+                log.warning('%s: cannot open group frame from %s: %s', self.node_id, addr, e)
+                return
+            if frame.type == wire.T_MCAST_END:
+                pass  # JSON frame; the key names the distribution
+            elif frame.type not in (wire.T_CHUNK, wire.T_REPAIR) or frame.oid != m['oid']:
+                return
+            m['heard'] = self.clock()
+        if frame.type == wire.T_FRAGMENT:
+            self._seen(addr)
+            data = self.reassembly.add(addr, frame, self.clock())
+            if data is None:
+                return
+            try:
+                if wire.is_binary(data):
+                    inner = wire.decode_frame(data)
+                    if inner.type != wire.T_FRAGMENT:
+                        await self.handle_frame(inner, addr)
+                else:
+                    await self.handle_message(json.loads(data.decode('utf-8')), addr, len(data))
+            except (ValueError, UnicodeDecodeError) as e:
+                log.warning('%s: invalid reassembled datagram from %s: %s', self.node_id, addr, e)
+            return
+        if frame.type == wire.T_PROBE:
+            self.scheduler.send(fragment.probe_ack(frame), addr, LANE_CONTROL)
+            return
+        if frame.type == wire.T_PROBE_ACK:
+            self._on_probe_ack(frame, addr)
+            return
+        if frame.type == wire.T_CHUNK:
+            self._seen(addr)
+            self._count_in('CHUNK', addr, nbytes)
+            try:
+                data, checksum = frame.chunk(CHUNK_SIZE)
+            except wire.WireError as e:
+                log.warning('%s: dropping chunk %d of %s from %s: %s', self.node_id, frame.index, frame.oid, addr, e)
+                return
+            coro = self._accept_chunk(addr, frame.oid, frame.index, data, frame.more, frame.version, checksum)
+        elif frame.type == wire.T_REQUEST:
+            self._seen(addr)
+            self._count_in('REQUEST', addr, nbytes)
+            st = self.peers.get(addr, {})
+            key = (frame.oid, bytes(frame.payload), frame.version)
+            if frame.flags & wire.F_COPY and st.get('last_request') == key:
+                return  # the original arrived
+            st['last_request'] = key
+            coro = self._serve_ranges(addr, frame.oid, frame.ranges(), frame.version)
+        elif frame.type == wire.T_REPAIR:
+            self._seen(addr)
+            self._count_in('REPAIR', addr, nbytes)
+            try:
+                row, k, symbol = frame.repair()
+            except wire.WireError as e:
+                log.warning('%s: dropping repair symbol for %s from %s: %s', self.node_id, frame.oid, addr, e)
+                return
+            coro = self._accept_repair(addr, frame.oid, frame.index, frame.version, row, k, symbol)
+        else:
+            await self.handle_message(frame.to_message(self.peers.get(addr, {}).get('id')), addr, nbytes)
+            return
+        span = self.tracer.start(wire.TYPE_NAMES[frame.type], self._peer_label(addr))
+        await (coro if span is None else self._traced(span, coro))
+
+    async def handle_message(self, msg: dict, addr, nbytes: int = 0):
+        """Dispatch a decoded message; `nbytes` is the size of the datagram it arrived in, for metrics."""
         mtype = msg.get('type')
         sender = msg.get('from')
         if sender:
             # initialize peer state if needed
-            st = self.peers.get(addr, {'id': sender, 'session': None, 'sent_pub': False})
+            st = self.peers.get(addr, {'id': sender, 'session': None})
             st['id'] = sender
             self.peers[addr] = st
-        # Dispatch
-        if mtype == 'KEY_EXCHANGE':
-            await self._on_key_exchange(msg, addr)
-        elif mtype == 'HELLO' or mtype == 'ENCRYPTED':
-            # ENCRYPTED envelope handled in lower-level handlers
-            await self._on_hello(msg, addr)
-        elif mtype == 'DIGESTS':
-            await self._on_digests(msg, addr)
-        elif mtype == 'REQUEST':
-            await self._on_request(msg, addr)
-        elif mtype == 'CHUNK':
-            await self._on_chunk(msg, addr)
-        elif mtype == 'ACK':
-            await self._on_ack(msg, addr)
+            self._seen(addr)
+        handler = self._handlers.get(mtype)
+        if handler is None:
+            log.warning('%s: unknown message type %s from %s', self.node_id, mtype, addr)
+            return
+        if mtype == 'ENCRYPTED':
+            await self._on_encrypted(msg, addr, nbytes)  # counted and traced as the inner message
+            return
+        self._count_in(mtype, addr, nbytes)
+        span = self.tracer.start(mtype, self._peer_label(addr))
+        if span is None:
+            await handler(msg, addr)
         else:
-            print(f"{self.node_id}: unknown message type {mtype} from {addr}")
+            await self._traced(span, handler(msg, addr))
 
-    async def _on_key_exchange(self, msg, addr):
-        their_pub_b64 = msg.get('pub')
-        if not their_pub_b64:
+    # Sessions
+    #
+    # KEY_EXCHANGE {pub, peer?, suites, new_ticket?}: `pub` is the sender's X25519 key for this exchange,
+    # `peer` the key of ours it derived the session from. A side that receives a key it has no session
+    # for derives one and answers with its own key unless `peer` shows the sender already has it. The
+    # initiator resends until it gets that answer. KEY_EXCHANGE {ticket, nonce} asks to resume from a
+    # ticket we issued; the answer is {resumed: their nonce, nonce: ours}, or a full exchange if the
+    # ticket is no good. Answers to full exchanges carry a ticket for resuming later.
+
+    def _session_fresh(self, st: dict) -> bool:
+        if st.get('session') is None:
+            return False
+        return not self.session_ttl or self.clock() - st.get('session_at', 0) < self.session_ttl
+
+    def send_key_exchange(self, peer_addr, resume: bool = True):
+        """Start a key exchange, from a ticket the peer gave us if we hold a valid one; resent until answered."""
+        st = self.peers.setdefault(peer_addr, {'id': None, 'session': None})
+        msg = {'type': 'KEY_EXCHANGE', 'from': self.node_id, 'suites': self.suites}
+        ticket = self._tickets.get(peer_addr)
+        if ticket is not None and ticket['expires'] <= self.clock():
+            del self._tickets[peer_addr]
+            ticket = None
+        if resume and ticket is not None:
+            st['resume'] = os.urandom(RESUME_NONCE_SIZE)
+            msg.update(ticket=b64(ticket['ticket']), nonce=b64(st['resume']))
+        else:
+            st['resume'] = None
+            st['eph'] = generate_keypair()
+            msg['pub'] = b64(st['eph'][0])
+        st['ke_msg'] = msg
+        st['ke_tries'] = 0
+        if st.get('ke_timer'):
+            st['ke_timer'].cancel()
+        st['ke_timer'] = asyncio.get_running_loop().call_later(self._quality(peer_addr).rtt.rto, self._key_exchange_timeout,
+                                                               peer_addr)
+        self._send(msg, peer_addr)
+        log.debug('%s: sent KEY_EXCHANGE to %s', self.node_id, peer_addr)
+
+    def _key_exchange_timeout(self, addr):
+        st = self.peers.get(addr)
+        if st is None or st.get('ke_msg') is None:
             return
-        their_pub = ub64(their_pub_b64)
-        enc_key, mac_key = derive_keys(self.priv, their_pub)
-        st = self.peers.get(addr, {'id': msg.get('from'), 'session': None, 'sent_pub': False})
-        st['session'] = {'enc': enc_key, 'mac': mac_key}
-        self.peers[addr] = st
-        # respond with our public key only if we haven't already sent ours
-        if not st.get('sent_pub'):
-            resp = {'type': 'KEY_EXCHANGE', 'from': self.node_id, 'pub': b64(self.pub)}
-            st['sent_pub'] = True
-            self.peers[addr] = st
+        st['ke_timer'] = None
+        if st['ke_tries'] >= KE_RETRIES:
+            log.info('%s: no answer to KEY_EXCHANGE from %s', self.node_id, addr)
+            st['ke_msg'] = None
+            return
+        st['ke_tries'] += 1
+        self._send(st['ke_msg'], addr)
+        rto = min(RTO_MAX, self._quality(addr).rtt.rto * 2 ** st['ke_tries'])
+        st['ke_timer'] = asyncio.get_running_loop().call_later(rto, self._key_exchange_timeout, addr)
+
+    def _set_session(self, addr, st: dict, session: Session, kind: str):
+        st['prev_session'] = st.get('session')  # still opens what the peer sealed before it switched
+        st['session'] = session
+        st['session_at'] = self.clock()
+        st['ke_msg'] = None
+        if st.get('ke_timer'):
+            st['ke_timer'].cancel()
+            st['ke_timer'] = None
+        self.streams.discard(addr)  # pooled connections are sealed with the old keys
+        self._m_sessions.inc((kind,))
+        log.info('%s: key exchange completed with %s (%s)', self.node_id, addr, kind)
+        if st.pop('hello_pending', False):
+            self.send_hello(addr)
+
+    async def _on_key_exchange(self, msg, addr):
+        # AEAD-only when both sides list it; peers that predate suites get the GCM+HMAC format
+        aead = SUITE_AEAD in msg.get('suites', ()) and SUITE_AEAD in self.suites
+        st = self.peers.setdefault(addr, {'id': msg.get('from'), 'session': None})
+        try:
+            if msg.get('ticket'):
+                self._on_resume(msg, addr, st, aead)
+            elif msg.get('resumed'):
+                self._on_resumed(msg, addr, st, aead)
+            elif msg.get('pub'):
+                self._on_full_exchange(msg, addr, st, aead)
+        except ValueError as e:  # bad base64 or key
+            log.warning('%s: malformed KEY_EXCHANGE from %s: %s', self.node_id, addr, e)
+
+    def _on_full_exchange(self, msg, addr, st: dict, aead: bool):
+        their_pub = ub64(msg['pub'])
+        session = st.get('session')
+        if session is not None and session.peer_pub == their_pub and msg.get('peer') in (None, b64(session.my_pub)):
+            session.aead = aead  # a resend: keep the ciphers and the nonce counter
+        else:
+            # answer with the key we sent if our own full exchange is under way, else with a fresh one
+            eph = st.get('eph') if st.get('ke_msg') and st.get('resume') is None else None
+            if st.get('resume') is not None:
+                st['resume'] = None  # they answered our ticket with a full exchange: it is no good
+                self._tickets.pop(addr, None)
+            eph = eph or generate_keypair()
+            st['eph'] = eph
+            self._set_session(addr, st, Session(eph[1], eph[0], their_pub, aead), 'full')
+            ticket = msg.get('new_ticket')
+            if ticket:
+                self._tickets.pop(addr, None)
+                self._tickets[addr] = {'ticket': ub64(ticket), 'secret': st['session'].resumption,
+                                       'expires': self.clock() + TICKET_TTL}
+                if len(self._tickets) > TICKET_CACHE:
+                    self._tickets.pop(next(iter(self._tickets)))
+        mine = b64(st['session'].my_pub)
+        if msg.get('peer') != mine:  # they do not have our key yet
+            resp = {'type': 'KEY_EXCHANGE', 'from': self.node_id, 'pub': mine, 'peer': msg['pub'], 'suites': self.suites}
+            if msg.get('from'):
+                resp['new_ticket'] = b64(self.tickets.issue(msg['from'], st['session'].resumption, self.clock()))
             self._send(resp, addr)
-        print(f"{self.node_id}: key exchange completed with {addr}")
+
+    def _on_resume(self, msg, addr, st: dict, aead: bool):
+        their_nonce = ub64(msg['nonce'])
+        session = st.get('session')
+        if session is None or session.peer_pub != their_nonce:
+            secret = self.tickets.redeem(ub64(msg['ticket']), msg.get('from'), self.clock())
+            if secret is None:
+                log.info('%s: cannot resume from the ticket of %s, doing a full key exchange', self.node_id, addr)
+                self.send_key_exchange(addr, resume=False)
+                return
+            nonce = os.urandom(RESUME_NONCE_SIZE)
+            shared = resumed_secret(secret, their_nonce, nonce)
+            self._set_session(addr, st, Session(None, nonce, their_nonce, aead, shared), 'resumed')
+        session = st['session']
+        session.aead = aead
+        self._send({'type': 'KEY_EXCHANGE', 'from': self.node_id, 'resumed': msg['nonce'], 'nonce': b64(session.my_pub),
+                    'suites': self.suites}, addr)
+
+    def _on_resumed(self, msg, addr, st: dict, aead: bool):
+        mine, ticket = st.get('resume'), self._tickets.get(addr)
+        if mine is None or ticket is None or ub64(msg['resumed']) != mine:
+            return  # a late answer to an earlier attempt
+        st['resume'] = None
+        their_nonce = ub64(msg['nonce'])
+        shared = resumed_secret(ticket['secret'], mine, their_nonce)
+        self._set_session(addr, st, Session(None, mine, their_nonce, aead, shared), 'resumed')
+
+    def _no_session(self, addr):
+        """A sealed message from a peer we have no keys for (we restarted, or our answer got lost): re-key."""
+        st = self.peers.get(addr)
+        if st is None or not st.get('ke_timer'):
+            log.info('%s: sealed message from %s but no session, starting a key exchange', self.node_id, addr)
+            self.send_key_exchange(addr)
+
+    def _open_sealed(self, addr, payload, aead: bool) -> bytearray:
+        """Open with the peer's session, or with the one it replaced while the peer may not have switched yet."""
+        st = self.peers[addr]
+        t0 = time.perf_counter()
+        try:
+            pt = st['session'].open(payload, aead)
+        except Exception:
+            prev = st.get('prev_session')
+            if prev is None:
+                raise
+            pt = prev.open(payload, aead)
+        self._m_crypto.observe(time.perf_counter() - t0, OPEN)
+        return pt
+
+    async def _on_encrypted(self, msg, addr, nbytes: int = 0):
+        if not self.peers.get(addr, {}).get('session'):
+            self._no_session(addr)
+            return
+        enc = msg.get('enc', {})
+        try:
+            if 'aead' in enc:
+                pt = self._open_sealed(addr, ub64(enc['aead']), True)
+            else:
+                pt = self._open_sealed(addr, ub64(enc.get('n')) + ub64(enc.get('ct')) + ub64(enc.get('mac')), False)
+            inner = json.loads(pt.decode('utf-8'))
+        except Exception as e:
+            log.warning('%s: failed to decrypt ENCRYPTED message from %s: %s', self.node_id, addr, e)
+            return
+        await self.handle_message(inner, addr, nbytes)
 
     async def _on_hello(self, msg, addr):
-        # handle encrypted envelope first
-        if msg.get('type') == 'ENCRYPTED':
-            session = self.peers.get(addr, {}).get('session')
-            if session:
-                enc = msg.get('enc', {})
-                try:
-                    n = ub64(enc.get('n'))
-                    ct = ub64(enc.get('ct'))
-                    mac = ub64(enc.get('mac'))
-                    pt = verify_and_decrypt(n, ct, mac, session['enc'], session['mac'])
-                    inner = json.loads(pt.decode('utf-8'))
-                    # dispatch inner
-                    await self.handle_message(inner, addr)
-                    return
-                except Exception as e:
-                    print(f"{self.node_id}: failed to decrypt ENCRYPTED message from {addr}: {e}")
-        # respond with DIGESTS (encrypted if session exists)
-        digests = [{'id': oid, 'version': ver} for oid, (_, ver) in self.storage.items()]
-        payload = {'type': 'DIGESTS', 'from': self.node_id, 'digests': digests}
-        session = self.peers.get(addr, {}).get('session')
-        if session:
-            n, ct, mac = encrypt_and_mac(json.dumps(payload).encode('utf-8'), session['enc'], session['mac'])
-            env = {'type': 'ENCRYPTED', 'from': self.node_id, 'enc': {'n': b64(n), 'ct': b64(ct), 'mac': b64(mac)}}
-            self._send(env, addr)
-            print(f"{self.node_id}: HELLO from {msg.get('from')} -> sent ENCRYPTED DIGESTS to {addr}")
-        else:
-            self._send(payload, addr)
-            print(f"{self.node_id}: HELLO from {msg.get('from')} -> sent DIGESTS ({len(digests)}) to {addr}")
+        self._note_capabilities(msg, addr)
+        theirs = msg.get('summary_hash')
+        tree = self._tree_for(self.peers.get(addr, {}).get('subscribe'))  # only what the peer subscribed to
+        root = tree.root()
+        if theirs == root:
+            # already in sync: one small round trip
+            payload = {'type': 'DIGESTS', 'from': self.node_id, **self._capability_fields(), 'summary_hash': root, 'digests': []}
+            self._send_msg(payload, addr)
+            log.debug('%s: HELLO from %s -> in sync (%s)', self.node_id, msg.get('from'), root)
+            return
+        if theirs is None or len(tree) <= FULL_DIGEST_LIMIT:
+            # legacy peer (no summary) or tiny store: respond with the full digest list
+            crdts = CAP_CRDT in self.peers.get(addr, {}).get('caps', ())
+            digests = [self._digest_entry(oid) for oid in tree.entries if crdts or oid not in self.crdts]
+            self._send_digests(addr, digests, head={**self._capability_fields(), 'summary_hash': root})
+            log.debug('%s: HELLO from %s -> sent DIGESTS (%d) to %s', self.node_id, msg.get('from'), len(digests), addr)
+            return
+        payload = {'type': 'TREE', 'from': self.node_id, **self._capability_fields(), 'nodes': {'': tree.children('')}}
+        self._send_msg(payload, addr)
+        log.debug('%s: HELLO from %s -> summaries differ, sent TREE root to %s', self.node_id, msg.get('from'), addr)
+
+    async def _on_tree(self, msg, addr):
+        self._note_capabilities(msg, addr)
+        self._probe_answered(addr)
+        want = []
+        tree = self._tree_for(self.subscribe)
+        for prefix, hashes in (msg.get('nodes') or {}).items():
+            if len(hashes) == len(tree.children(prefix)):
+                want.extend(tree.diff_children(prefix, hashes))
+        interior = [p for p in want if not tree.is_leaf(p)]
+        for i in range(0, len(interior), TREE_REQUEST_PREFIXES):
+            self._send_msg({'type': 'TREE_REQUEST', 'from': self.node_id, 'prefixes': interior[i:i + TREE_REQUEST_PREFIXES]}, addr)
+        leaves = [p for p in want if tree.is_leaf(p)]
+        if leaves:
+            q = self._tree_more.setdefault(addr, {'prefixes': [], 'asked': None})
+            q['prefixes'].extend(p for p in leaves if p not in q['prefixes'])
+            self._ask_buckets(addr)
+
+    def _ask_buckets(self, addr):
+        """Ask `addr` for the digests of differing leaf buckets, one TREE_REQUEST answer at a time."""
+        q = self._tree_more.get(addr)
+        if q is None:
+            return
+        if not q['prefixes']:
+            del self._tree_more[addr]
+            return
+        if q['asked'] is not None and self.clock() - q['asked'] < TREE_ANSWER_TIMEOUT:
+            return
+        if len(self.fetches) + TREE_ANSWER_DIGESTS > self.fetches.limit:
+            return  # asked again as fetches drain
+        prefixes, q['prefixes'] = q['prefixes'][:TREE_REQUEST_PREFIXES], q['prefixes'][TREE_REQUEST_PREFIXES:]
+        q['asked'] = self.clock()
+        self._send_msg({'type': 'TREE_REQUEST', 'from': self.node_id, 'prefixes': prefixes}, addr)
+
+    async def _on_tree_request(self, msg, addr):
+        tree = self._tree_for(self.peers.get(addr, {}).get('subscribe'))
+        prefixes = [str(p) for p in (msg.get('prefixes') or [])][:TREE_REQUEST_PREFIXES]
+        interior = [p for p in prefixes if not tree.is_leaf(p)]
+        leaves = [p for p in prefixes if tree.is_leaf(p)]
+        for i in range(0, len(interior), TREE_BATCH):
+            nodes = {p: tree.children(p) for p in interior[i:i + TREE_BATCH]}
+            self._send_msg({'type': 'TREE', 'from': self.node_id, 'nodes': nodes}, addr)
+        if leaves:
+            # answer buckets up to TREE_ANSWER_DIGESTS entries and name the rest in `more` (empty when all
+            # are answered), so a large difference arrives one round trip at a time instead of in one burst
+            digests = []
+            answered = 0
+            for p in leaves:
+                if digests and len(digests) + len(tree.objects_under(p)) > TREE_ANSWER_DIGESTS:
+                    break
+                digests.extend(self._digest_entry(oid) for oid in tree.objects_under(p))
+                answered += 1
+            more = leaves[answered:]
+            self._send_digests(addr, digests, tail={'more': more})
+            log.debug('%s: sent DIGESTS (%d) for %d of %d differing bucket(s) to %s', self.node_id, len(digests),
+                      answered, len(leaves), addr)
+
+    def _send_digests(self, addr, digests, head=None, tail=None):
+        """Send `digests` as DIGESTS messages of up to DIGEST_BYTES of entries; `head` fields go in the first, `tail` in the last."""
+        batches, batch, nbytes = [], [], 0
+        for entry in digests:
+            n = len(json.dumps(entry)) + 2
+            if batch and nbytes + n > DIGEST_BYTES:
+                batches.append(batch)
+                batch, nbytes = [], 0
+            batch.append(entry)
+            nbytes += n
+        batches.append(batch)
+        for i, batch in enumerate(batches):
+            msg = {'type': 'DIGESTS', 'from': self.node_id, **(head if i == 0 and head else {}), 'digests': batch}
+            if i == len(batches) - 1 and tail:
+                msg.update(tail)
+            self._send_msg(msg, addr)
 
     async def _on_digests(self, msg, addr):
-        # handle possibly encrypted message
-        if msg.get('type') == 'ENCRYPTED':
-            session = self.peers.get(addr, {}).get('session')
-            if not session:
-                print(f"{self.node_id}: received ENCRYPTED but no session with {addr}")
-                return
-            enc = msg.get('enc', {})
-            n = ub64(enc.get('n'))
-            ct = ub64(enc.get('ct'))
-            mac = ub64(enc.get('mac'))
-            try:
-                pt = verify_and_decrypt(n, ct, mac, session['enc'], session['mac'])
-                inner = json.loads(pt.decode('utf-8'))
-                msg = inner
-            except Exception as e:
-                print(f"{self.node_id}: decryption failed from {addr}: {e}")
-                return
-        # now plain digests
+        self._note_capabilities(msg, addr)
+        self._probe_answered(addr)
         digests = msg.get('digests', [])
         for entry in digests:
             oid = entry.get('id')
+            if not isinstance(oid, str) or not fetch.matches(oid, self.subscribe):
+                continue  # peers without subscription support advertise everything
+            if 'crdt' in entry:
+                self._on_crdt_digest(entry, addr)
+                continue
             ver = entry.get('version', 0)
-            local = self.storage.get(oid)
-            if not local or local[1] < ver:
-                req = {'type': 'REQUEST', 'from': self.node_id, 'id': oid, 'chunk': 0}
-                session = self.peers.get(addr, {}).get('session')
-                if session:
-                    n, ct, mac = encrypt_and_mac(json.dumps(req).encode('utf-8'), session['enc'], session['mac'])
-                    env = {'type': 'ENCRYPTED', 'from': self.node_id, 'enc': {'n': b64(n), 'ct': b64(ct), 'mac': b64(mac)}}
-                    self._send(env, addr)
+            if oid in self.storage and self.storage.version(oid) >= ver:
+                continue
+            size = entry.get('size')
+            size = int(size) if size is not None else None
+            digest = entry.get('hash')
+            current = self.pending.get(oid)
+            if current and current.version == ver and current.size == size and current.digest == digest:
+                if addr in current.sources or (current.sources and size is None):
+                    continue
+                if not current.sources:
+                    # parked (restart or peer loss): resume from the first missing chunk
+                    log.info('%s: resuming %s from %s at chunk %d', self.node_id, oid, addr, current.next_idx)
                 else:
-                    self._send(req, addr)
-                print(f"{self.node_id}: requesting {oid} from {addr}")
+                    log.debug('%s: adding %s as a source for %s', self.node_id, addr, oid)
+                self._add_source(current, addr)
+                self._pump(current)
+                continue
+            if current and current.version > ver:
+                continue
+            waiting = self._delta_wait.get(oid)
+            if waiting and waiting['version'] >= ver:
+                continue
+            self.fetches.push(entry, addr)
+        if 'more' in msg:  # the end of an answer to our TREE_REQUEST
+            q = self._tree_more.setdefault(addr, {'prefixes': [], 'asked': None})
+            q['prefixes'][:0] = [str(p) for p in msg['more'] or ()]
+            q['asked'] = None
+        self._drain_fetches()
 
-    async def _on_request(self, msg, addr):
-        # handle possibly encrypted
-        if msg.get('type') == 'ENCRYPTED':
-            session = self.peers.get(addr, {}).get('session')
-            if not session:
-                print(f"{self.node_id}: received ENCRYPTED request but no session with {addr}")
-                return
-            enc = msg.get('enc', {})
-            n = ub64(enc.get('n'))
-            ct = ub64(enc.get('ct'))
-            mac = ub64(enc.get('mac'))
+    def _schedule_fetches(self):
+        if self._fetch_drain is None and (self.fetches or self._tree_more):
+            self._fetch_drain = asyncio.get_running_loop().call_soon(self._drain_fetches)
+
+    def _drain_fetches(self):
+        """Start queued fetches, most urgent first, while fewer than `max_fetches` are running."""
+        self._fetch_drain = None
+        deferred = []
+        while self.fetches:
+            running = sum(1 for t in self.pending.values() if t.sources) + len(self._delta_wait)
+            if running >= self.max_fetches:
+                break
+            item = self.fetches.pop()
+            if self._fetch(item):
+                deferred.append(item)
+        for item in deferred:  # retried when a transfer ends and frees memory
+            for addr in item['peers']:
+                self.fetches.push(item['entry'], addr)
+        for addr in list(self._tree_more):
+            self._ask_buckets(addr)
+
+    def _fetch(self, item: dict) -> bool:
+        """Start fetching a queued object. Returns True when the reassembly budget has no room for it yet."""
+        entry = item['entry']
+        oid, ver, digest = entry['id'], item['version'], entry.get('hash')
+        size = entry.get('size')
+        size = int(size) if size is not None else None
+        # the queue may be stale by now: re-check what we hold and who is still around
+        if oid in self.storage and self.storage.version(oid) >= ver:
+            return False
+        current = self.pending.get(oid)
+        if current and current.version >= ver:
+            return False
+        peers = [a for a in item['peers'] if a in self.peers]
+        if not peers:
+            return False
+        if current:
+            self._drop_transfer(current)
+        peers = self.rank_peers(peers, size or SCORE_SIZE)
+        need = 0 if self.state_dir else size or 0  # file-backed transfers hold no reassembly memory
+        if need:
+            if not self.budget.fits(need):
+                log.warning('%s: %s (%d bytes) exceeds the reassembly budget; it needs a state_dir', self.node_id, oid, need)
+                return False
+            peers = self._room_for(peers, need)
+            if not peers:
+                self._m_deferred.inc()
+                return True
+        addr = peers[0]
+        if (oid in self.storage and size is not None and size >= DELTA_MIN_SIZE
+                and CAP_DELTA in self.peers[addr].get('caps', ())):
+            self._request_delta(addr, oid, ver, size, digest)
+            return False
+        self._start_transfer(addr, oid, ver, size, digest)
+        t = self.pending.get(oid)
+        if t is not None and size is not None and len(peers) > 1 and t.stream is None:
+            for other in peers[1:]:
+                self._add_source(t, other)
+            self._pump(t)
+        return False
+
+    def _room_for(self, peers, need: int) -> list:
+        """The `peers` whose reassembly budget has room for `need` more bytes; stalled transfers make way."""
+        total, by_peer = self.budget.usage(self.pending.values())
+        if total + need > self.budget.limit:
+            for t in self.budget.stalled(self.pending.values(), self.clock(), budget.STALL_GRACE):
+                n = t.memory
+                total -= n
+                by_peer[t.owner] -= n
+                self._evict_transfer(t, 'pressure')
+                if total + need <= self.budget.limit:
+                    break
+            else:
+                return []
+        return [a for a in peers if by_peer.get(a, 0) + need <= self.budget.peer_limit]
+
+    def _evict_transfer(self, t: IncomingTransfer, reason: str):
+        log.info('%s: evicting transfer of %s (%d/%s chunks, %s)', self.node_id, t.oid, t.nreceived, t.nchunks or '?', reason)
+        self._m_evicted_transfers.inc((reason,))
+        self._drop_transfer(t)
+
+    def memory_stats(self) -> dict:
+        """Reassembly memory use against its limits, evictions and deferrals, and storage cache statistics."""
+        total, by_peer = self.budget.usage(self.pending.values())
+        stats = {
+            'reassembly_bytes': total,
+            'reassembly_limit': self.budget.limit,
+            'peer_reassembly_limit': self.budget.peer_limit,
+            'reassembly_by_peer': {self._peer_label(a): n for a, n in by_peer.items()},
+            'transfers': len(self.pending),
+            'fetch_queue': len(self.fetches),
+            'fetch_queue_dropped': self.fetches.dropped,
+            'fetches_deferred': self._m_deferred.values.get((), 0),
+            'transfers_evicted': {k[0]: v for k, v in self._m_evicted_transfers.values.items()},
+        }
+        if hasattr(self.storage, 'stats'):
+            stats['storage'] = self.storage.stats()
+        return stats
+
+    def _on_crdt_digest(self, entry: dict, addr):
+        oid = entry['id']
+        local = self.crdts.get(oid)
+        if local and local.vv.dominates(VersionVector(entry.get('vv'))):
+            return
+        vv = local.vv.to_dict() if local else {}
+        self._send_msg({'type': 'CRDT_PULL', 'from': self.node_id, 'id': oid, 'crdt': entry.get('crdt'), 'vv': vv}, addr)
+
+    async def _on_crdt_pull(self, msg, addr):
+        oid = msg.get('id')
+        r = self.crdts.get(oid)
+        if r is None:
+            return
+        out = {'type': 'CRDT_DELTA', 'from': self.node_id, 'id': oid, 'crdt': r.kind}
+        deltas = r.deltas_since(VersionVector(msg.get('vv')))
+        if deltas is None:
+            out.update(state=r.crdt.state(), vv=r.vv.to_dict())
+        elif deltas:
+            out['deltas'] = deltas
+        else:
+            return
+        self._send_msg(out, addr)
+        log.debug('%s: sent %s for CRDT %s to %s', self.node_id, 'state' if deltas is None else f'{len(deltas)} delta(s)', oid, addr)
+
+    async def _on_crdt_delta(self, msg, addr):
+        oid = msg.get('id')
+        r = self.crdts.get(oid)
+        if r is None:
             try:
-                pt = verify_and_decrypt(n, ct, mac, session['enc'], session['mac'])
-                inner = json.loads(pt.decode('utf-8'))
-                msg = inner
-            except Exception as e:
-                print(f"{self.node_id}: decryption failed from {addr}: {e}")
+                r = self.add_crdt(oid, msg.get('crdt'))
+            except ValueError as e:
+                log.warning('%s: ignoring CRDT %s from %s: %s', self.node_id, oid, addr, e)
                 return
+        elif r.kind != msg.get('crdt'):
+            return
+        if 'state' in msg:
+            r.apply_state(msg['state'], msg.get('vv') or {})
+        else:
+            r.apply_deltas(msg.get('deltas') or [])
+
+    def _start_transfer(self, addr, oid: str, ver: int, size, digest, reuse=None, group=None):
+        path = state_path(self.state_dir, oid) if self.state_dir else None
+        t = IncomingTransfer(oid, ver, addr, size, self.window, CHUNK_SIZE, digest, path, self.rng)
+        t.started = t.progress = self.clock()
+        t.multicast = group
+        t.multicast_from = addr if group is not None else None
+        self.pending[oid] = t
+        reused = t.prefill(reuse) if reuse else 0
+        log.info('%s: requesting %s (%s chunks, %d reused) from %s', self.node_id, oid, (t.nchunks or 0) - reused or '?', reused, addr)
+        if t.complete():
+            self._finish_transfer(t, addr)
+            return
+        if group is None and size is not None and size >= stream.STREAM_MIN_SIZE and self.peers.get(addr, {}).get('stream'):
+            t.stream = asyncio.get_running_loop().create_task(self._stream_transfer(t, addr))
+            return
+        self._pump(t)
+
+    def _request_delta(self, addr, oid: str, ver: int, size: int, digest):
+        loop = asyncio.get_running_loop()
+        # the sender segments the whole object first
+        timer = loop.call_later(2 * self._peer_rtt(addr).rto + size / DELTA_SCAN_RATE, self._on_delta_timeout, oid, ver)
+        self._delta_wait[oid] = {'peer': addr, 'version': ver, 'size': size, 'hash': digest, 'timer': timer}
+        self._send_msg({'type': 'DELTA_REQUEST', 'from': self.node_id, 'id': oid, 'version': ver}, addr)
+        log.debug('%s: requesting delta recipe for %s v%s from %s', self.node_id, oid, ver, addr)
+
+    def _on_delta_timeout(self, oid: str, ver: int):
+        w = self._delta_wait.get(oid)
+        if not w or w['version'] != ver:
+            return
+        del self._delta_wait[oid]
+        log.info('%s: no recipe for %s from %s, falling back to full transfer', self.node_id, oid, w['peer'])
+        self._start_transfer(w['peer'], oid, ver, w['size'], w['hash'])
+
+    async def _on_delta_request(self, msg, addr):
         oid = msg.get('id')
-        chunk_idx = int(msg.get('chunk', 0))
-        entry = self.storage.get(oid)
-        if not entry:
-            print(f"{self.node_id}: received request for unknown object {oid}")
-            return
-        data, ver = entry
-        start = chunk_idx * CHUNK_SIZE
-        chunk = data[start:start + CHUNK_SIZE]
-        b64data = base64.b64encode(chunk).decode('ascii')
-        more = 1 if (start + CHUNK_SIZE) < len(data) else 0
-        msg_out = {
-            'type': 'CHUNK',
-            'from': self.node_id,
-            'id': oid,
-            'chunk': chunk_idx,
-            'data': b64data,
-            'more': more,
-            'version': ver,
-        }
+        ver = int(msg.get('version', 0))
+        if oid not in self.storage or self.storage.version(oid) != ver:
+            return
+        key = (oid, ver)
+        task = self._recipes.get(key)
+        if task is None:
+            task = self._recipes[key] = asyncio.ensure_future(self._segment(oid, ver))
+            if len(self._recipes) > RECIPE_CACHE:
+                self._recipes.pop(next(iter(self._recipes)))
+        found = await task
+        if found is None:
+            self._recipes.pop(key, None)
+            return
+        avg, segs = found
+        out = {'type': 'RECIPE', 'from': self.node_id, 'id': oid, 'version': ver, 'avg': avg,
+               'segments': [[length, h] for _, length, h in segs]}
+        self._send_msg(out, addr)
+
+    async def _segment(self, oid: str, ver: int, avg: int = None):
+        """(avg, delta segments) of a stored object, hashed block by block off the event loop; None if it changed."""
+        loop = asyncio.get_running_loop()
+        size = self.storage.size(oid)
+        avg = avg or delta.average_for(size)
+        seg = delta.Segmenter(avg)
+        found = []
+        for offset in range(0, size, BLOCK_SIZE):
+            if oid not in self.storage or self.storage.version(oid) != ver:
+                return None
+            found += await loop.run_in_executor(None, seg.feed, self.storage.read(oid, offset, BLOCK_SIZE))
+        found += await loop.run_in_executor(None, seg.finish)
+        return avg, found
+
+    async def _on_recipe(self, msg, addr):
+        oid = msg.get('id')
+        w = self._delta_wait.get(oid)
+        if not w or w['version'] != int(msg.get('version', 0)) or w['peer'] != addr or w.get('recipe'):
+            return
+        w['timer'].cancel()
+        w['recipe'] = True  # stays in _delta_wait, so the object is not fetched twice meanwhile
+        reuse = {}
+        avg = int(msg.get('avg') or 0)
+        if oid in self.storage and delta.MIN_AVG <= avg <= delta.MAX_AVG:
+            old_ver = self.storage.version(oid)
+            found = await self._segment(oid, old_ver, avg)
+            if self._delta_wait.get(oid) is not w:
+                return
+            if found is not None:
+                ranges = delta.reusable_ranges(found[1], msg, w['size'], CHUNK_SIZE)
+                if oid in self.storage and self.storage.version(oid) == old_ver:
+                    read = self.storage.read
+                    reuse = {idx: b''.join(read(oid, off, n) for off, n in parts) for idx, parts in ranges.items()}
+        del self._delta_wait[oid]
+        self._start_transfer(addr, oid, w['version'], w['size'], w['hash'], reuse)
+
+    def _peer_rtt(self, addr) -> RttEstimator:
+        return self._quality(addr).rtt
+
+    def _pump(self, t: IncomingTransfer, addr=None):
+        """Fill each source's window with new chunk requests and make sure its retransmit timer runs.
+
+        With `addr`, only that source's: a chunk or HAVE from it changes what it can be asked for, not the others,
+        until the last ENDGAME_CHUNKS are missing and idle sources may duplicate requests.
+        """
+        if t.stream is not None:
+            return  # fetched over a stream connection; datagrams take over if that fails
+        if t.multicast is not None:
+            return  # chunks come from the group stream; what it misses is requested once it ends
+        now = self.clock()
+        if addr is not None and (t.nchunks is None or t.nchunks - t.nreceived > ENDGAME_CHUNKS):
+            addrs = [addr] if addr in t.sources else []
+        else:
+            # partial holders first, so full sources are left with the chunks nobody else has; then best link first
+            addrs = sorted(t.sources, key=lambda a: (t.sources[a].have is None, -self._quality(a).score()))
+        for addr in addrs:
+            repair = self._repair_count(t, addr)
+            ranges = t.next_batch(now, addr, fec.GROUP if repair else 1)  # whole groups, so repairs follow at once
+            if ranges:
+                self._send_request(addr, t.oid, ranges, repair)
+            self._arm_timer(t, addr)
+
+    def _arm_timer(self, t: IncomingTransfer, addr):
+        src = t.sources.get(addr)
+        if not src or src.timer or not src.inflight:
+            return
+        loop = asyncio.get_running_loop()
+        src.timer = loop.call_later(self._peer_rtt(addr).rto, self._on_transfer_timeout, t, addr)
+
+    def _on_transfer_timeout(self, t: IncomingTransfer, addr):
+        src = t.sources.get(addr)
+        if self.pending.get(t.oid) is not t or src is None:
+            return
+        src.timer = None
+        rtt = self._peer_rtt(addr)
+        lost = t.expired(self.clock(), rtt.rto, addr)
+        if lost:
+            nlost = sum(count for _, count in lost)
+            self._quality(addr).lost(nlost)
+            self._m_retransmits.inc((self._peer_label(addr),), nlost)
+            src.retries += 1
+            rtt.backoff()
+            if src.retries > MAX_RETRIES:
+                t.remove_source(addr)
+                if not t.sources:
+                    log.warning('%s: parking %s from %s after %d retries', self.node_id, t.oid, addr, MAX_RETRIES)
+                    self._m_transfers.inc(('parked',))
+                    self._park_transfer(t)
+                    return
+                log.warning('%s: dropping source %s for %s after %d retries', self.node_id, addr, t.oid, MAX_RETRIES)
+                self._pump(t)
+                return
+            if len(t.sources) > 1:
+                # hand the chunks to whichever source has room; this one is down to a probing window
+                t.release(addr, lost)
+                self._pump(t)
+            else:
+                self._send_request(addr, t.oid, lost)
+            log.debug('%s: retransmit request for %s: %s (rto=%.2fs)', self.node_id, t.oid, lost, rtt.rto)
+        self._arm_timer(t, addr)
+
+    def _cancel_timers(self, t: IncomingTransfer):
+        for src in t.sources.values():
+            if src.timer:
+                src.timer.cancel()
+                src.timer = None
+
+    def _park_transfer(self, t: IncomingTransfer):
+        self._schedule_fetches()
+        self._cancel_timers(t)
+        if t.multicast is not None:
+            self._end_multicast(t)
+        t.park()
+
+    def _drop_transfer(self, t: IncomingTransfer):
+        self._schedule_fetches()
+        self._cancel_timers(t)
+        if t.multicast is not None:
+            self._end_multicast(t)
+        if t.stream is not None:
+            t.stream.cancel()
+            t.stream = None
+        t.remove()
+        if self.pending.get(t.oid) is t:
+            self.pending.pop(t.oid, None)
+        self._wake_readers(t.oid)
+
+    async def _on_request(self, msg, addr):
+        ranges = msg.get('ranges') or [(int(msg.get('chunk', 0)), 1)]
+        await self._serve_ranges(addr, msg.get('id'), ranges, int(msg.get('fec', 0)))
+
+    async def _serve_ranges(self, addr, oid: str, ranges, repair: int = 0):
+        """Send the requested chunks, and `repair` FEC symbols after each one that ends a coding group."""
+        t = self.pending.get(oid)
+        if t and t.size is not None and (oid not in self.storage or self.storage.version(oid) < t.version):
+            await self._serve_partial(addr, t, ranges)
+            return
+        if oid not in self.storage:
+            log.debug('%s: received request for unknown object %s', self.node_id, oid)
+            return
+        ver = self.storage.version(oid)
+        size = self.storage.size(oid)
+        codec = self._chunk_codec(addr, oid, ver, lambda: compress.sample(lambda o, n: self.storage.read(oid, o, n), size))
+        budget = MAX_REQUEST_CHUNKS
+        sent = 0
+        nchunks = chunk_count(size, CHUNK_SIZE)
+        repair = min(repair, fec.MAX_REPAIR)
+        for first, count in clip_ranges(ranges, nchunks):
+            for chunk_idx in range(first, first + min(count, budget - sent)):
+                start = chunk_idx * CHUNK_SIZE
+                if self.scheduler.congested(addr):
+                    await self.scheduler.writable(addr)
+                    if oid not in self.storage or self.storage.version(oid) != ver:
+                        return  # replaced while we waited; the requester will see the new digest
+                chunk = self.storage.read(oid, start, CHUNK_SIZE)
+                more = 1 if (start + CHUNK_SIZE) < size else 0
+                self._send_chunk(addr, oid, chunk_idx, chunk, more, ver, codec)
+                sent += 1
+                if repair:
+                    # the rest of the group was requested before: windows advance in order
+                    group, pos = divmod(chunk_idx, fec.GROUP)
+                    k = min(fec.GROUP, nchunks - group * fec.GROUP)
+                    if pos == k - 1:
+                        self._send_repairs(addr, oid, ver, group, k, repair)
+            if sent >= budget:
+                break
+        log.debug('%s: sent %d CHUNK(s) %s for %s to %s', self.node_id, sent, ranges[:4], oid, addr)
+
+    def _send_repairs(self, addr, oid: str, ver: int, group: int, k: int, count: int):
+        first = group * fec.GROUP
+        chunks = [self.storage.read(oid, (first + i) * CHUNK_SIZE, CHUNK_SIZE) for i in range(k)]
         session = self.peers.get(addr, {}).get('session')
-        if session:
-            n, ct, mac = encrypt_and_mac(json.dumps(msg_out).encode('utf-8'), session['enc'], session['mac'])
-            env = {'type': 'ENCRYPTED', 'from': self.node_id, 'enc': {'n': b64(n), 'ct': b64(ct), 'mac': b64(mac)}}
-            self._send(env, addr)
+        for row, symbol in enumerate(fec.encode(chunks, range(count), CHUNK_SIZE)):
+            frame = wire.encode_repair(oid, group, ver, row, k, symbol)
+            if session:
+                frame = self._seal_frame(frame, session, bulk=True)
+            self._send_frame(frame, addr, 'REPAIR', LANE_BULK)
+        self._m_repair_sent.inc((), count)
+
+    async def _serve_partial(self, addr, t: IncomingTransfer, ranges):
+        """Serve the chunks of an object we are still pulling; missing ones are left to the requester's timer."""
+        sent = 0
+        codec = False  # decided on the first chunk we serve
+        for first, count in clip_ranges(ranges, t.nchunks):
+            for idx in range(first, first + count):
+                if sent >= MAX_REQUEST_CHUNKS:
+                    return
+                if self.scheduler.congested(addr):
+                    await self.scheduler.writable(addr)
+                    if self.pending.get(t.oid) is not t:
+                        return
+                if t.has(idx):
+                    chunk = t.read_chunk(idx)
+                    if codec is False:
+                        codec = self._chunk_codec(addr, t.oid, t.version, lambda: bytes(chunk))
+                    self._send_chunk(addr, t.oid, idx, chunk, int(idx < t.nchunks - 1), t.version, codec)
+                    sent += 1
+
+    def _swarm_peers(self):
+        return [a for a, st in self.peers.items() if CAP_SWARM in st.get('caps', ())]
+
+    def _announce_have(self, t: IncomingTransfer, complete: bool = False):
+        """Tell swarm-capable peers which chunks of `t` we can serve, so they can pull from us too."""
+        if t.size is None or not t.digest:
+            return
+        t.announced = t.nreceived
+        msg = {'type': 'HAVE', 'from': self.node_id, 'id': t.oid, 'version': t.version, 'size': t.size, 'hash': t.digest}
+        if complete:
+            msg['complete'] = 1
         else:
-            self._send(msg_out, addr)
-        print(f"{self.node_id}: sent CHUNK {chunk_idx} (more={more}) for {oid} to {addr}")
+            msg['ranges'] = [list(r) for r in t.have_ranges(MAX_HAVE_RANGES)]
+        for addr in self._swarm_peers():
+            if (addr not in t.sources or t.sources[addr].have is not None) and self._peer_wants(addr, t.oid):
+                self._send_msg(msg, addr)
+
+    async def _on_have(self, msg, addr):
+        t = self.pending.get(msg.get('id'))
+        if (not t or t.size is None or t.version != int(msg.get('version', 0))
+                or t.size != msg.get('size') or t.digest != msg.get('hash')):
+            return
+        ranges = None if msg.get('complete') else [tuple(r) for r in msg.get('ranges') or []]
+        self._add_source(t, addr, ranges)
+        self._pump(t, addr)
+
+    def _gossip(self, oid: str, ver: int, hops: int, exclude=()):
+        """Push a new object version to `fanout` random gossip-capable peers that have not heard of it yet."""
+        if not self.fanout or hops >= GOSSIP_TTL or not self.transport:
+            return
+        targets = [a for a, st in self.peers.items()
+                   if CAP_GOSSIP in st.get('caps', ()) and a not in exclude and fetch.matches(oid, st.get('subscribe'))]
+        if not targets:
+            return
+        entry = dict(self._digest_entry(oid), hops=hops)
+        for addr in self.rng.sample(targets, min(self.fanout, len(targets))):
+            self._gossip_out.setdefault(addr, []).append(entry)
+        if self._gossip_flush is None:
+            # objects added in one go share GOSSIP messages
+            self._gossip_flush = asyncio.get_running_loop().call_soon(self._flush_gossip)
+
+    def _flush_gossip(self):
+        self._gossip_flush = None
+        out, self._gossip_out = self._gossip_out, {}
+        for addr, entries in out.items():
+            for i in range(0, len(entries), GOSSIP_BATCH):
+                self._send_msg({'type': 'GOSSIP', 'from': self.node_id, 'digests': entries[i:i + GOSSIP_BATCH]}, addr)
+
+    async def _on_gossip(self, msg, addr):
+        # remember who told us and how far the rumor has come, then fetch like a DIGESTS answer;
+        # the version is pushed on (see _finish_transfer) once we hold it
+        for entry in msg.get('digests') or []:
+            key = (entry.get('id'), entry.get('version', 0))
+            rumor = self._rumors.get(key)
+            if rumor is None:
+                rumor = self._rumors[key] = {'hops': int(entry.get('hops', 0)) + 1, 'seen': set()}
+                if len(self._rumors) > RUMOR_MEMORY:
+                    self._rumors.pop(next(iter(self._rumors)))
+            rumor['seen'].add(addr)
+        await self._on_digests(msg, addr)
 
     async def _on_chunk(self, msg, addr):
-        # handle encrypted
-        if msg.get('type') == 'ENCRYPTED':
-            session = self.peers.get(addr, {}).get('session')
-            if not session:
-                print(f"{self.node_id}: received ENCRYPTED chunk but no session with {addr}")
-                return
-            enc = msg.get('enc', {})
-            n = ub64(enc.get('n'))
-            ct = ub64(enc.get('ct'))
-            mac = ub64(enc.get('mac'))
+        chunk = base64.b64decode(msg.get('data', '').encode('ascii'))
+        if msg.get('codec'):
             try:
-                pt = verify_and_decrypt(n, ct, mac, session['enc'], session['mac'])
-                inner = json.loads(pt.decode('utf-8'))
-                msg = inner
-            except Exception as e:
-                print(f"{self.node_id}: decryption failed from {addr}: {e}")
+                chunk = compress.decompress(msg['codec'], chunk, CHUNK_SIZE)
+            except compress.CompressionError as e:
+                log.warning('%s: dropping chunk %s of %s from %s: %s', self.node_id, msg.get('chunk'), msg.get('id'), addr, e)
                 return
-        oid = msg.get('id')
-        chunk_idx = int(msg.get('chunk', 0))
-        b64data = msg.get('data', '')
-        more = int(msg.get('more', 0))
-        ver = int(msg.get('version', 0))
-        chunk = base64.b64decode(b64data.encode('ascii'))
-        buf = self.pending.setdefault(oid, bytearray())
-        buf.extend(chunk)
-        print(f"{self.node_id}: received CHUNK {chunk_idx} for {oid} (more={more}) from {addr}")
-        if not more:
-            self.storage[oid] = (bytes(buf), ver)
-            self.pending.pop(oid, None)
-            ack = {'type': 'ACK', 'from': self.node_id, 'id': oid, 'version': ver}
-            session = self.peers.get(addr, {}).get('session')
-            if session:
-                n, ct, mac = encrypt_and_mac(json.dumps(ack).encode('utf-8'), session['enc'], session['mac'])
-                env = {'type': 'ENCRYPTED', 'from': self.node_id, 'enc': {'n': b64(n), 'ct': b64(ct), 'mac': b64(mac)}}
-                self._send(env, addr)
-            else:
-                self._send(ack, addr)
-            print(f"{self.node_id}: assembled object {oid} (len={len(self.storage[oid][0])}), sent ACK to {addr}")
+        await self._accept_chunk(addr, msg.get('id'), int(msg.get('chunk', 0)), chunk, int(msg.get('more', 0)),
+                                 int(msg.get('version', 0)), msg.get('checksum'))
+
+    async def _accept_chunk(self, addr, oid: str, chunk_idx: int, chunk, more, ver: int, checksum: int = None):
+        t = self.pending.get(oid)
+        if not t or t.version != ver or addr not in t.sources:
+            return  # only sources we asked, or the multicast sender, may fill in chunks
+        if t.size is None and t.path is None and (chunk_idx + 1) * t.chunk_size > self.budget.peer_limit:
+            # the buffer would grow to reach this chunk before it is stored
+            if chunk_idx in t.inflight:
+                log.warning('%s: unsized object %s from %s outgrew the reassembly budget', self.node_id, oid, addr)
+                self._evict_transfer(t, 'oversize')
+            return
+        now, before = self.clock(), t.nreceived
+        sample = t.on_chunk(chunk_idx, chunk, bool(more), now, checksum, addr)
+        if t.nreceived > before:
+            t.progress = now
+        q = self._quality(addr)
+        q.delivered()
+        if sample is not None:
+            q.rtt.sample(sample)
+            self._m_rtt.observe(sample, (self._peer_label(addr),))
+        src = t.sources.get(addr)
+        if src:
+            src.retries = 0
+        if t.repairs is not None and t.nreceived > before:
+            self._recover_group(t, chunk_idx // fec.GROUP, addr)
+        self._after_chunks(t, addr)
+
+    def _after_chunks(self, t: IncomingTransfer, addr):
+        self._wake_readers(t.oid)
+        if not t.complete():
+            if t.nreceived - t.announced >= HAVE_EVERY:
+                self._announce_have(t)
+            self._pump(t, addr)
+            return
+        self._finish_transfer(t, addr)
+
+    def _repair_count(self, t: IncomingTransfer, addr) -> int:
+        """FEC repair symbols per group to ask `addr` for, from the loss measured on its link."""
+        if not self.fec_repair or t.nchunks is None or t.nchunks < 2:
+            return 0
+        src = t.sources.get(addr)
+        if (src is not None and src.have is not None) or fec.CAP_FEC not in self.peers.get(addr, {}).get('caps', ()):
+            return 0  # partial holders cannot code over chunks they lack
+        if not self._uses_binary(addr):
+            return 0
+        return fec.repair_count(self._quality(addr).loss)
+
+    async def _accept_repair(self, addr, oid: str, group: int, ver: int, row: int, k: int, symbol):
+        t = self.pending.get(oid)
+        if not t or t.version != ver or t.nchunks is None or addr not in t.sources:
+            return
+        first = group * fec.GROUP
+        if first >= t.nchunks or k != min(fec.GROUP, t.nchunks - first) or len(symbol) != t.chunk_size:
+            return
+        if not 0 <= row < fec.MAX_REPAIR:
+            return  # no such repair symbol; it would spoil the group's recovery
+        self._quality(addr).delivered()
+        if t.received.count(1, first, first + k) == k:
+            return  # the group is complete already
+        if t.repairs is None:
+            t.repairs = fec.RepairSet()
+        t.repairs.add(group, row, bytes(symbol))
+        if self._recover_group(t, group, addr):
+            self._after_chunks(t, addr)
+
+    def _recover_group(self, t: IncomingTransfer, group: int, addr) -> bool:
+        """Rebuild the missing chunks of `group` once enough chunks and repair symbols are in."""
+        repairs = t.repairs.get(group)
+        if not repairs:
+            return False
+        first = group * fec.GROUP
+        k = min(fec.GROUP, t.nchunks - first)
+        have = {i: t.read_chunk(first + i) for i in range(k) if t.has(first + i)}
+        if len(have) + len(repairs) < k:
+            return False
+        t.repairs.discard(group)
+        lost = fec.recover(k, have, repairs, t.chunk_size)
+        now = self.clock()
+        for i, chunk in lost.items():
+            idx = first + i
+            t.on_chunk(idx, chunk[:t.size - idx * t.chunk_size], idx < t.nchunks - 1, now)
+        if lost:
+            t.progress = now
+            self._quality(addr).lost(len(lost))  # lost on the wire all the same; keeps the redundancy up
+            self._m_recovered.inc((), len(lost))
+        return bool(lost)
+
+    def _finish_transfer(self, t: IncomingTransfer, addr):
+        oid, ver = t.oid, t.version
+        # copy into storage piece by piece; the hash is checked on the way, not over one assembled buffer
+        w = self.storage.writer(oid, ver)
+        for block in t.blocks():
+            w.write(block)
+        self._drop_transfer(t)
+        if not w.commit(t.digest):
+            log.warning('%s: object %s failed hash verification, discarded', self.node_id, oid)
+            self._m_transfers.inc(('corrupt',))
+            if t.multicast_from is not None and t.size is not None:
+                # another group member may have written into the stream; the sender's session is ours alone
+                self._start_transfer(t.multicast_from, oid, ver, t.size, t.digest)
+            return
+        size = w.size
+        rumor = self._rumors.get((oid, ver))
+        self._m_transfers.inc(('complete',))
+        rate = size / max(self.clock() - t.started, 1e-6)
+        # per-source rates where measured; short and stream transfers only have the overall rate
+        for src_addr, src_rate in ({a: s.rate for a, s in t.sources.items() if s.rate} or {addr: rate}).items():
+            self._quality(src_addr).rate_sample(src_rate)
+        self._m_transfer_bytes.inc((), size)
+        self._m_throughput.observe(rate)
+        self._stored(oid, ver)
+        if rumor is not None:
+            self._gossip(oid, ver, rumor['hops'], rumor['seen'] | set(t.sources) | {addr})
+        if t.announced:
+            self._announce_have(t, complete=True)  # peers pulling from us can treat us as a full source now
+        ack = {'type': 'ACK', 'from': self.node_id, 'id': oid, 'version': ver}
+        self._send_msg(ack, addr)
+        log.info('%s: assembled object %s (len=%d), sent ACK to %s', self.node_id, oid, size, addr)
 
     async def _on_ack(self, msg, addr):
-        # handle encrypted ack
-        if msg.get('type') == 'ENCRYPTED':
-            session = self.peers.get(addr, {}).get('session')
-            if not session:
-                print(f"{self.node_id}: received ENCRYPTED ack but no session with {addr}")
-                return
-            enc = msg.get('enc', {})
-            n = ub64(enc.get('n'))
-            ct = ub64(enc.get('ct'))
-            mac = ub64(enc.get('mac'))
+        log.debug('%s: received ACK for %s from %s version=%s', self.node_id, msg.get('id'), msg.get('from'), msg.get('version'))
+
+    # Stream transport (see mesh.stream)
+
+    async def _stream_transfer(self, t: IncomingTransfer, addr):
+        """Fetch a sized object over a pooled stream connection; on any failure, fall back to chunk requests."""
+        st = self.peers.get(addr, {})
+        port, session = st.get('stream'), st.get('session')
+        idx = t.first_missing()
+        try:
+            conn = await self.streams.acquire(
+                addr, lambda: stream.connect(addr[0], port, self.node_id, self.port, session))
+            done = False
             try:
-                pt = verify_and_decrypt(n, ct, mac, session['enc'], session['mac'])
-                inner = json.loads(pt.decode('utf-8'))
-                msg = inner
-            except Exception as e:
-                print(f"{self.node_id}: decryption failed from {addr}: {e}")
+                await conn.send_json(stream.R_GET, {'id': t.oid, 'version': t.version, 'offset': idx * CHUNK_SIZE})
+                while not done:
+                    rtype, payload = await asyncio.wait_for(conn.recv(), stream.READ_TIMEOUT)
+                    if rtype == stream.R_DATA:
+                        idx += t.write_range(idx, payload)
+                        t.progress = self.clock()
+                        self._m_stream.inc(('received',), len(payload))
+                        self._wake_readers(t.oid)
+                    elif rtype == stream.R_END:
+                        done = True
+                    elif rtype == stream.R_ERROR:
+                        raise stream.StreamError(json.loads(payload).get('error'))
+                    else:
+                        raise stream.StreamError(f'unexpected record type {rtype}')
+            finally:
+                self.streams.release(addr, conn, reusable=done)
+        except (OSError, EOFError, asyncio.TimeoutError, stream.StreamError, ValueError) as e:
+            log.info('%s: stream fetch of %s from %s failed (%s), using datagrams', self.node_id, t.oid, addr, e)
+        if self.pending.get(t.oid) is not t:
+            return
+        t.stream = None
+        if t.complete():
+            self._finish_transfer(t, addr)
+        else:
+            self._pump(t)
+
+    async def _on_stream_connection(self, reader, writer):
+        conn = stream.StreamConnection(reader, writer)
+        self._stream_conns.add(conn)
+        try:
+            rtype, payload = await asyncio.wait_for(conn.recv(), stream.READ_TIMEOUT)
+            if rtype != stream.R_OPEN:
                 return
-        print(f"{self.node_id}: received ACK for {msg.get('id')} from {msg.get('from')} version={msg.get('version')}" )
+            # the OPEN record names the peer by its UDP port; later records must be sealed with its session
+            addr = (writer.get_extra_info('peername')[0], int(json.loads(payload)['port']))
+            conn.session = self.peers.get(addr, {}).get('session')
+            while True:
+                rtype, payload = await asyncio.wait_for(conn.recv(), 2 * stream.IDLE_TIMEOUT)
+                if rtype != stream.R_GET:
+                    raise stream.StreamError(f'unexpected record type {rtype}')
+                await self._stream_object(conn, addr, json.loads(payload))
+        except (OSError, EOFError, asyncio.TimeoutError, stream.StreamError, ValueError, KeyError) as e:
+            log.debug('%s: stream connection closed: %r', self.node_id, e)
+        finally:
+            self._stream_conns.discard(conn)
+            conn.close()
 
-    # Active operations
-    def send_key_exchange(self, peer_addr):
-        st = self.peers.get(peer_addr, {'id': None, 'session': None, 'sent_pub': False})
-        st['sent_pub'] = True
-        self.peers[peer_addr] = st
-        msg = {'type': 'KEY_EXCHANGE', 'from': self.node_id, 'pub': b64(self.pub)}
-        self._send(msg, peer_addr)
-        print(f"{self.node_id}: sent KEY_EXCHANGE to {peer_addr}")
+    async def _stream_object(self, conn: stream.StreamConnection, addr, req: dict):
+        oid, ver, offset = req.get('id'), int(req.get('version', 0)), int(req.get('offset', 0))
+        if oid not in self.storage or self.storage.version(oid) != ver or offset % CHUNK_SIZE:
+            # partial objects are served chunk by chunk over datagrams
+            await conn.send_json(stream.R_ERROR, {'error': f'{oid} v{ver} not available'})
+            return
+        size = self.storage.size(oid)
+        if offset < 0 or offset > size:
+            await conn.send_json(stream.R_ERROR, {'error': f'offset {offset} outside {oid} v{ver}'})
+            return
+        while offset < size:
+            n = min(stream.RECORD_SIZE, size - offset)
+            await conn.send(stream.R_DATA, self.storage.read(oid, offset, n))
+            self._m_stream.inc(('sent',), n)
+            offset += n
+            if oid not in self.storage or self.storage.version(oid) != ver:
+                await conn.send_json(stream.R_ERROR, {'error': f'{oid} replaced'})
+                return
+        await conn.send_json(stream.R_END, {'size': size})
+        log.debug('%s: streamed %s v%s to %s', self.node_id, oid, ver, addr)
+
+    # Multicast distribution (see mesh.multicast)
+
+    async def distribute(self, object_id: str, peers=None, group=multicast.DEFAULT_GROUP, rate: float = multicast.RATE) -> list:
+        """Send a stored object once to multicast `group` for every peer that lacks it; returns the peers that joined.
+
+        `peers` defaults to all peers we share a session with that list `mcast1`. Members fetch
+        whatever the stream missed from us by unicast, as with any transfer.
+        """
+        if object_id not in self.storage:
+            raise KeyError(object_id)
+        ver, size, digest = self.storage.version(object_id), self.storage.size(object_id), self.storage.digest(object_id)
+        group = (group[0], int(group[1]))
+        targets = [a for a in (list(self.peers) if peers is None else peers)
+                   if multicast.CAP_MULTICAST in self.peers.get(a, {}).get('caps', ()) and self._session_fresh(self.peers[a])]
+        if not targets:
+            return []
+        key = GroupKey()
+        d = self._mcast_out[key.key_id] = {'offered': set(targets), 'answers': {}, 'answered': self._loop.create_future()}
+        offer = {'type': 'MCAST_OFFER', 'from': self.node_id, 'id': object_id, 'version': ver, 'size': size, 'hash': digest,
+                 'group': list(group), 'key_id': key.key_id, 'key': b64(key.key)}
+        try:
+            for _ in range(multicast.OFFER_TRIES):
+                for addr in d['offered'].difference(d['answers']):
+                    self._send_msg(offer, addr)
+                await asyncio.wait([d['answered']], timeout=multicast.JOIN_WAIT / multicast.OFFER_TRIES)
+                if d['answered'].done():
+                    break
+            members = [a for a, loss in d['answers'].items() if loss is not None]
+            if not members:
+                return []
+            repair = multicast.repair_count(max(d['answers'][a] for a in members), len(members))
+            log.info('%s: multicasting %s v%s to %s for %d peer(s), %d repair symbol(s) per group',
+                     self.node_id, object_id, ver, group, len(members), repair)
+            multicast.set_ttl(self.transport)
+            if await self._stream_to_group(group, key, object_id, ver, size, repair, rate):
+                # on the group it follows the data; members that miss it there get it from their session
+                end = {'type': 'MCAST_END', 'from': self.node_id, 'id': object_id, 'version': ver, 'key_id': key.key_id}
+                await self._send_group(group, key, wire.encode_message(end), 'MCAST_END', None)
+                while self.scheduler.queued(group):
+                    await asyncio.sleep(multicast.DRAIN_POLL)
+                for addr in members:
+                    self._send_msg(end, addr)
+            return members
+        finally:
+            del self._mcast_out[key.key_id]
+
+    async def _stream_to_group(self, group, key: GroupKey, oid: str, ver: int, size: int, repair: int, rate) -> bool:
+        """Send each chunk once to `group`, each coding group followed by `repair` symbols; False if the object was replaced."""
+        bucket = TokenBucket(rate, multicast.BURST, self.clock()) if rate else None
+        nchunks = chunk_count(size, CHUNK_SIZE)
+        for first in range(0, nchunks, fec.GROUP):
+            chunks = []
+            for idx in range(first, min(first + fec.GROUP, nchunks)):
+                if oid not in self.storage or self.storage.version(oid) != ver:
+                    return False
+                chunk = self.storage.read(oid, idx * CHUNK_SIZE, CHUNK_SIZE)
+                chunks.append(chunk)
+                frame = wire.encode_chunk(oid, idx, ver, chunk, idx < nchunks - 1, chunk_checksum(chunk))
+                await self._send_group(group, key, frame, 'CHUNK', bucket)
+            for row, symbol in enumerate(fec.encode(chunks, range(repair), CHUNK_SIZE)):
+                frame = wire.encode_repair(oid, first // fec.GROUP, ver, row, len(chunks), symbol)
+                await self._send_group(group, key, frame, 'REPAIR', bucket)
+            self._m_repair_sent.inc((), repair)
+        return True
+
+    async def _send_group(self, group, key: GroupKey, frame: bytes, mtype: str, bucket):
+        buf = wire.frame_buffer(wire.T_GROUP, len(frame) + key.overhead(), wire.F_BULK, key.key_id)
+        t0 = time.perf_counter()
+        key.seal_into(frame, buf, wire.HEADER_SIZE)
+        self._m_crypto.observe(time.perf_counter() - t0, SEAL)
+        if bucket is not None:
+            delay = bucket.delay(len(buf), self.clock())
+            if delay:
+                await asyncio.sleep(delay)
+            bucket.take(len(buf), self.clock())
+        if self.scheduler.congested(group):
+            await self.scheduler.writable(group)
+        self._send_frame(buf, group, mtype, LANE_BULK)
+
+    async def _on_mcast_offer(self, msg, addr):
+        if not self.peers.get(addr, {}).get('session'):
+            return  # the group key must not travel in the clear
+        try:
+            oid, ver, size, digest = msg['id'], int(msg['version']), int(msg['size']), msg.get('hash')
+            group = (str(msg['group'][0]), int(msg['group'][1]))
+            key = GroupKey(ub64(msg['key']), int(msg['key_id']))
+        except (KeyError, IndexError, TypeError, ValueError) as e:
+            log.warning('%s: malformed MCAST_OFFER from %s: %s', self.node_id, addr, e)
+            return
+        joined = (addr, key.key_id) in self._mcast_in  # a repeated offer
+        if not joined and fetch.matches(oid, self.subscribe) and not (oid in self.storage and self.storage.version(oid) >= ver):
+            joined = await self._join_distribution(addr, oid, ver, size, digest, group, key)
+        answer = {'type': 'MCAST_JOIN', 'from': self.node_id, 'id': oid, 'version': ver, 'key_id': key.key_id, 'join': joined}
+        if joined:
+            answer['loss'] = round(self._quality(addr).loss, 4)
+        self._send_msg(answer, addr)
+
+    async def _join_distribution(self, addr, oid: str, ver: int, size: int, digest, group, key: GroupKey) -> bool:
+        """Join `group` and receive (oid, ver) from its stream, in a new transfer or one already pulling that version."""
+        try:
+            await self._join_group(group)
+        except OSError as e:
+            log.warning('%s: cannot join multicast group %s: %s', self.node_id, group, e)
+            return False
+        t = self.pending.get(oid)
+        if t is not None and t.version < ver:
+            self._drop_transfer(t)
+            t = None
+        if t is not None:
+            ok = (t.version, t.size, t.digest) == (ver, size, digest) and t.multicast is None
+        else:
+            need = 0 if self.state_dir else size
+            ok = not need or (self.budget.fits(need) and bool(self._room_for([addr], need)))
+        if not ok:
+            self._leave_group(group)
+            return False
+        m = {'addr': addr, 'oid': oid, 'group': group, 'key': key, 'heard': self.clock(), 'timer': None}
+        self._mcast_in[(addr, key.key_id)] = m
+        if t is None:
+            self._start_transfer(addr, oid, ver, size, digest, group=m)
+            t = self.pending.get(oid)
+        else:
+            if addr not in t.sources:
+                self._add_source(t, addr)
+            t.multicast = m
+        if t is None or t.multicast is not m:
+            return True  # complete already (an empty object)
+        m['timer'] = self._loop.call_later(multicast.IDLE_TIMEOUT, self._multicast_idle, t)
+        log.info('%s: joined multicast of %s v%s from %s on %s', self.node_id, oid, ver, addr, group)
+        return True
 
+    async def _join_group(self, group):
+        g = self._groups.get(group)
+        if g is None:
+            transport, _ = await self.listen_group(self._loop, group, self.host, lambda: GroupProtocol(self))
+            g = self._groups.get(group)
+            if g is None:
+                g = self._groups[group] = [transport, 0]
+            else:
+                transport.close()  # another offer joined while we waited
+        g[1] += 1
+
+    def _leave_group(self, group):
+        g = self._groups.get(group)
+        if g is None:
+            return
+        g[1] -= 1
+        if g[1] <= 0:
+            del self._groups[group]
+            g[0].close()
+
+    def _end_multicast(self, t: IncomingTransfer):
+        """Stop waiting for the group stream of `t`; what it missed is requested from the sender as usual."""
+        m, t.multicast = t.multicast, None
+        if m['timer']:
+            m['timer'].cancel()
+        self._mcast_in.pop((m['addr'], m['key'].key_id), None)
+        self._leave_group(m['group'])
+
+    def _multicast_idle(self, t: IncomingTransfer):
+        m = t.multicast
+        if m is None or self.pending.get(t.oid) is not t:
+            return
+        quiet = self.clock() - m['heard']
+        if quiet < multicast.IDLE_TIMEOUT:
+            m['timer'] = self._loop.call_later(multicast.IDLE_TIMEOUT - quiet, self._multicast_idle, t)
+            return
+        m['timer'] = None
+        log.info('%s: multicast of %s from %s went quiet, requesting the rest', self.node_id, t.oid, m['addr'])
+        self._end_multicast(t)
+        self._pump(t)
+
+    async def _on_mcast_join(self, msg, addr):
+        d = self._mcast_out.get(msg.get('key_id'))
+        if d is None or addr not in d['offered'] or addr in d['answers']:
+            return
+        d['answers'][addr] = float(msg.get('loss') or 0.0) if msg.get('join') else None
+        if len(d['answers']) == len(d['offered']) and not d['answered'].done():
+            d['answered'].set_result(None)
+
+    async def _on_mcast_end(self, msg, addr):
+        m = self._mcast_in.get((addr, msg.get('key_id')))
+        t = self.pending.get(m['oid']) if m else None
+        if t is None or t.multicast is not m:
+            return
+        self._end_multicast(t)
+        log.debug('%s: multicast of %s ended with %d/%d chunks', self.node_id, t.oid, t.nreceived, t.nchunks)
+        self._pump(t)
+
+    # Active operations
     def send_hello(self, peer_addr):
-        msg = {'type': 'HELLO', 'from': self.node_id, 'ts': now_ts()}
+        st = self.peers.get(peer_addr)
+        if st is not None:
+            st['reconciled'] = self.clock()
+            if st.get('probe') is not None:
+                self._quality(peer_addr).lost()  # the previous HELLO got no answer
+                st['probe'] = None  # an answer now could be to either HELLO: no RTT sample (Karn)
+            else:
+                st['probe'] = self.clock()
+        msg = {'type': 'HELLO', 'from': self.node_id, 'ts': now_ts(), **self._capability_fields(),
+               'summary_hash': self._tree_for(self.subscribe).root()}
         self._send(msg, peer_addr)
-        print(f"{self.node_id}: sent HELLO to {peer_addr}")
+        log.debug('%s: sent HELLO to %s', self.node_id, peer_addr)
+
+    async def _anti_entropy_loop(self):
+        """Every `anti_entropy` seconds (jittered, so nodes do not fall into step) reconcile with one peer."""
+        while True:
+            await asyncio.sleep(self.anti_entropy * self.rng.uniform(1 - ANTI_ENTROPY_JITTER, 1 + ANTI_ENTROPY_JITTER))
+            addr = self._reconcile_target()
+            if addr is None:
+                continue
+            st = self.peers[addr]
+            if st.get('session') is not None and not self._session_fresh(st) and not st.get('ke_timer'):
+                st['hello_pending'] = True  # expired: re-key first
+                self.scheduler.forget(addr)
+                self.send_key_exchange(addr)
+            else:
+                self.send_hello(addr)
+
+    def _reconcile_target(self):
+        # of a few random peers that have answered a HELLO, weigh link quality against time since the last HELLO
+        known = [a for a, st in self.peers.items() if 'caps' in st]
+        if not known:
+            return None
+        now = self.clock()
+
+        def value(a):
+            since = now - self.peers[a].get('reconciled', now - 10 * self.anti_entropy)
+            return self._quality(a).score() * (1 + since / self.anti_entropy)
+
+        return max(self.rng.sample(known, min(RECONCILE_CHOICES, len(known))), key=value)
+
+    # Peer quality (see mesh.peers)
+
+    def _quality(self, addr) -> PeerQuality:
+        st = self.peers.setdefault(addr, {'id': None, 'session': None})
+        q = st.get('quality')
+        if q is None:
+            q = st['quality'] = PeerQuality(self.clock())
+        return q
+
+    def _seen(self, addr):
+        st = self.peers.get(addr)
+        if st is not None:
+            (st.get('quality') or self._quality(addr)).last_seen = self.clock()
+
+    def _probe_answered(self, addr):
+        st = self.peers.get(addr, {})
+        sent = st.get('probe')
+        if sent is not None:
+            st['probe'] = None
+            q = self._quality(addr)
+            q.rtt.sample(self.clock() - sent)
+            q.delivered()
+
+    def _probe_mtu(self, addr):
+        """Send the next path MTU probe to `addr`, or plan the next search once this one is over."""
+        st = self.peers.get(addr)
+        if st is None or not self.transport:
+            return
+        pmtu, loop = st['pmtu'], asyncio.get_running_loop()
+        if st.get('pmtu_timer'):
+            st['pmtu_timer'].cancel()
+        size = pmtu.next_probe()
+        if size is None:
+            log.debug('%s: path MTU to %s is %d', self.node_id, addr, pmtu.mtu)
+            st['pmtu_timer'] = loop.call_later(fragment.PROBE_INTERVAL, self._reprobe_mtu, addr)
+            return
+        self.scheduler.send(fragment.probe(size), addr, LANE_CONTROL)
+        st['pmtu_timer'] = loop.call_later(self._quality(addr).rtt.rto, self._probe_lost, addr, size)
+
+    def _probe_lost(self, addr, size: int):
+        st = self.peers.get(addr)
+        if st is not None:
+            st['pmtu_timer'] = None
+            st['pmtu'].lost(size)
+            self._probe_mtu(addr)
+
+    def _reprobe_mtu(self, addr):
+        st = self.peers.get(addr)
+        if st is not None:
+            st['pmtu_timer'] = None
+            st['pmtu'].restart()
+            self._probe_mtu(addr)
+
+    def _on_probe_ack(self, frame: wire.Frame, addr):
+        pmtu = self.peers.get(addr, {}).get('pmtu')
+        if pmtu is not None and frame.index == pmtu.probing:
+            pmtu.acked(frame.index)
+            self._probe_mtu(addr)
+
+    def _add_source(self, t: IncomingTransfer, addr, ranges=None):
+        src = t.add_source(addr, ranges)
+        if src.rate is None:
+            src.rate = self._quality(addr).throughput  # start from the link's history, not the swarm average
+        return src
+
+    def peer_table(self) -> dict:
+        """{peer label: {id, srtt, rttvar, rto, loss, throughput, last_seen, idle, score, mtu}} of known peers."""
+        now = self.clock()
+        return {self._peer_label(a): dict(self._quality(a).to_dict(now), id=st.get('id'), mtu=st['pmtu'].mtu if st.get('pmtu') else None)
+                for a, st in list(self.peers.items())}
+
+    def rank_peers(self, addrs=None, size: int = SCORE_SIZE) -> list:
+        """`addrs` (default: all known peers) ordered best first for fetching `size` bytes."""
+        addrs = list(self.peers) if addrs is None else list(addrs)
+        return sorted(addrs, key=lambda a: self._quality(a).estimate(size))
+
+    def _sweep_peers(self):
+        now = self.clock()
+        if self.peer_ttl:
+            for addr in [a for a, st in self.peers.items() if now - self._quality(a).last_seen > self.peer_ttl]:
+                self._evict_peer(addr)
+        if self.stall_timeout:
+            for t in self.budget.stalled(self.pending.values(), now, self.stall_timeout):
+                self._evict_transfer(t, 'stalled')
+        self._sweep_timer = asyncio.get_running_loop().call_later(SWEEP_INTERVAL, self._sweep_peers)
+
+    def _evict_peer(self, addr):
+        st = self.peers.pop(addr, None)
+        if st is None:
+            return
+        self._m_evicted.inc()
+        self._tree_more.pop(addr, None)
+        self.scheduler.forget(addr, drop=True)
+        for timer in ('ke_timer', 'pmtu_timer'):
+            if st.get(timer):
+                st[timer].cancel()
+        self.streams.discard(addr)
+        for t in list(self.pending.values()):
+            src = t.sources.get(addr)
+            if src is None:
+                continue
+            if src.timer:
+                src.timer.cancel()
+            t.remove_source(addr)
+            if t.stream is not None and not t.sources:
+                t.stream.cancel()
+                t.stream = None
+            if not t.sources:
+                self._park_transfer(t)
+            else:
+                self._pump(t)
+        log.info('%s: evicted peer %s (%s), silent for over %.0fs', self.node_id, st.get('id'), addr, self.peer_ttl)
 
 
 async def demo_two_nodes():
@@ -369,4 +2162,5 @@ async def demo_two_nodes():
 
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
     asyncio.run(demo_two_nodes())
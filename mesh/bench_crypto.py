@@ -0,0 +1,66 @@
+"""Microbenchmark: session crypto throughput in messages per second on one core.
+
+Run with `python -m mesh.bench_crypto`. Compares the per-message helpers
+(`encrypt_and_mac` / `verify_and_decrypt`, a new AESGCM and HMAC per call) with a cached
+`Session` in the legacy gcm-hmac suite and in the aead1 suite, for a control-sized message
+and a full binary CHUNK frame.
+"""
+
+import os
+import time
+
+from .crypto import Session, encrypt_and_mac, generate_keypair, verify_and_decrypt
+
+ROUNDS = 20000
+SIZES = (64, 1044)  # small control message; 1 KiB chunk plus binary header and CRC
+
+
+def _pair(aead: bool):
+    pub_a, priv_a = generate_keypair()
+    pub_b, priv_b = generate_keypair()
+    return Session(priv_a, pub_a, pub_b, aead), Session(priv_b, pub_b, pub_a, aead)
+
+
+def _rate(fn) -> float:
+    """Messages per second of CPU time."""
+    t0 = time.process_time()
+    for _ in range(ROUNDS):
+        fn()
+    return ROUNDS / (time.process_time() - t0)
+
+
+def bench_helpers(msg: bytes):
+    a, _ = _pair(False)
+    enc, mac = a.enc_key, a.mac_key
+    n, ct, tag = encrypt_and_mac(msg, enc, mac)
+    return (_rate(lambda: encrypt_and_mac(msg, enc, mac)),
+            _rate(lambda: verify_and_decrypt(n, ct, tag, enc, mac)))
+
+
+def bench_session(msg: bytes, aead: bool):
+    a, b = _pair(aead)
+    out = bytearray(len(msg) + a.overhead())
+    plain = bytearray(len(msg))
+    a.seal_into(msg, out)
+    sealed = bytes(out)
+    assert b.open(sealed, aead) == msg
+    return (_rate(lambda: a.seal_into(msg, out)),
+            _rate(lambda: b.open_into(sealed, plain, aead)))
+
+
+def run():
+    results = []
+    for size in SIZES:
+        msg = os.urandom(size)
+        for mode, fn in (('helpers', lambda: bench_helpers(msg)),
+                         ('session-legacy', lambda: bench_session(msg, False)),
+                         ('session-aead1', lambda: bench_session(msg, True))):
+            seal, opened = fn()
+            results.append({'mode': mode, 'size': size, 'seal_per_s': round(seal), 'open_per_s': round(opened)})
+    return results
+
+
+if __name__ == '__main__':
+    print(f"{'mode':16} {'bytes':>6} {'seal msg/s':>12} {'open msg/s':>12}")
+    for r in run():
+        print(f"{r['mode']:16} {r['size']:6d} {r['seal_per_s']:12d} {r['open_per_s']:12d}")
@@ -0,0 +1,112 @@
+"""Synthetic flood of the receive path: per-datagram tasks vs the bounded worker pipeline.
+
+Run with `python -m mesh.bench_receive`. A node pulling one large object is fed CHUNK frames
+with a control frame (ACK) mixed in every CONTROL_EVERY datagrams, without sockets, in bursts
+of BURSTS[...] datagrams per event-loop turn: a moderate load and a flood that exceeds the
+per-peer queue. Reports handling latency (queued -> handled) p50/p99 per lane, drops, the
+peak number of datagrams held at once, and handled datagrams per second.
+"""
+
+import asyncio
+import time
+
+from . import wire
+from .async_sync import SyncNode
+from .receiver import classify, percentile
+from .transfer import IncomingTransfer, chunk_checksum
+
+CHUNKS = 20000
+BURSTS = (64, 4096)
+CONTROL_EVERY = 50
+PEER = ('10.0.0.2', 9000)
+
+
+class NullTransport:
+    def sendto(self, data, addr):
+        pass
+
+
+def _datagrams():
+    chunk = bytes(1024)
+    crc = chunk_checksum(chunk)
+    ack = wire.encode_message({'type': 'ACK', 'id': 'other', 'version': 1})
+    out = []
+    for i in range(CHUNKS):
+        out.append(wire.encode_chunk('flood', i, 1, chunk, i < CHUNKS - 1, crc))
+        if i % CONTROL_EVERY == 0:
+            out.append(ack)
+    return out
+
+
+def _node() -> SyncNode:
+    node = SyncNode('127.0.0.1', 0, node_id='bench')
+    node.transport = NullTransport()
+    node.pending['flood'] = IncomingTransfer('flood', 1, PEER, size=CHUNKS * 1024, window=256)
+    return node
+
+
+async def run_tasks(datagrams, burst: int) -> dict:
+    """The previous receive path: decode inline and spawn a task per datagram."""
+    node = _node()
+    lat = ([], [])
+    live = [0, 0]
+
+    async def handle(frame, lane, queued):
+        await node.handle_frame(frame, PEER)
+        lat[lane].append(time.monotonic() - queued)
+        live[0] -= 1
+
+    tasks = []
+    t0 = time.perf_counter()
+    for start in range(0, len(datagrams), burst):
+        for data in datagrams[start:start + burst]:
+            live[0] += 1
+            live[1] = max(live[1], live[0])
+            tasks.append(asyncio.create_task(handle(wire.decode_frame(data), classify(data), time.monotonic())))
+        await asyncio.sleep(0)
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - t0
+    node.stop()
+    return {'path': 'task-per-datagram', 'burst': burst, 'per_s': round(len(datagrams) / elapsed),
+            'peak_held': live[1], 'dropped': 0,
+            'control_p50_ms': round(percentile(lat[0], 0.5) * 1000, 3), 'control_p99_ms': round(percentile(lat[0], 0.99) * 1000, 3),
+            'bulk_p50_ms': round(percentile(lat[1], 0.5) * 1000, 3), 'bulk_p99_ms': round(percentile(lat[1], 0.99) * 1000, 3)}
+
+
+async def run_pipeline(datagrams, burst: int) -> dict:
+    node = _node()
+    rx = node.receiver
+    rx.latency = ([], [])  # keep every sample for the report
+    rx.start()
+    peak = 0
+    t0 = time.perf_counter()
+    for start in range(0, len(datagrams), burst):
+        for data in datagrams[start:start + burst]:
+            rx.submit(data, PEER)
+        peak = max(peak, rx.total)
+        await asyncio.sleep(0)
+    while rx.total or any(i.scheduled for i in rx.inboxes.values()):
+        await asyncio.sleep(0.001)
+    elapsed = time.perf_counter() - t0
+    s = rx.stats()
+    node.stop()
+    return {'path': 'pipeline', 'burst': burst, 'per_s': round(rx.handled / elapsed),
+            'peak_held': peak, 'dropped': s['bulk']['dropped'] + s['control']['dropped'],
+            'control_p50_ms': s['control']['p50_ms'], 'control_p99_ms': s['control']['p99_ms'],
+            'bulk_p50_ms': s['bulk']['p50_ms'], 'bulk_p99_ms': s['bulk']['p99_ms']}
+
+
+def run():
+    datagrams = _datagrams()
+    results = []
+    for burst in BURSTS:
+        results.append(asyncio.run(run_tasks(datagrams, burst)))
+        results.append(asyncio.run(run_pipeline(datagrams, burst)))
+    return results
+
+
+if __name__ == '__main__':
+    print(f"{'path':18} {'burst':>5} {'msg/s':>7} {'peak':>6} {'drop':>6} {'ctl p50':>8} {'ctl p99':>8} {'bulk p50':>9} {'bulk p99':>9}  (ms)")
+    for r in run():
+        print(f"{r['path']:18} {r['burst']:5d} {r['per_s']:7d} {r['peak_held']:6d} {r['dropped']:6d} {r['control_p50_ms']:8.2f} "
+              f"{r['control_p99_ms']:8.2f} {r['bulk_p50_ms']:9.2f} {r['bulk_p99_ms']:9.2f}")
@@ -0,0 +1,227 @@
+"""End-to-end sync benchmark: N SyncNodes converging over loopback UDP.
+
+Run with `python -m mesh.bench_sync` for the default scenarios, or pass parameters for one
+run, e.g. `python -m mesh.bench_sync --nodes 8 --objects 50 --sizes uniform:4096:262144 --loss 0.01`.
+Results are printed as JSON (or written with `--out`) so runs can be diffed.
+
+Each object is seeded on one random node. Every node then says HELLO to every other node, and
+the run ends when all nodes hold every object. Key exchange (with `--encrypt`) happens before
+the clock starts and with loss switched off: a lost KEY_EXCHANGE reply is not retried by the
+protocol. During sync, unconverged nodes repeat HELLO every HELLO_INTERVAL so that lost
+control messages do not stall the run.
+
+Reported per run:
+  - converge_s: first HELLO until every node holds every object
+  - transfer_mb_s: mean and p50 of per-transfer throughput (object size / transfer time)
+  - goodput_mb_s: object bytes delivered across all nodes / converge_s
+  - cpu_s_per_mb: process CPU time during sync / MB delivered (all nodes share this process)
+  - datagrams sent, dropped by injected loss, lost in the kernel (sent - dropped - received,
+    mostly socket receive buffer overflow), and retransmitted chunks
+
+Object data and sizes, the seeding and the loss pattern come from `--seed`. Timing is from a
+real event loop, so expect some run-to-run noise.
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import sys
+import time
+
+from .async_sync import SyncNode
+from .metrics import RATE_BUCKETS, Histogram
+
+BASE_PORT = 13000
+HELLO_INTERVAL = 0.5
+POLL = 0.01
+TIMEOUT = 120.0
+MAX_OBJECT = 16 * 1024 * 1024
+MB = 1024 * 1024
+
+SCENARIOS = [
+    {'name': 'baseline', 'nodes': 4, 'objects': 20, 'sizes': 'fixed:65536', 'encrypt': True, 'loss': 0.0},
+    {'name': 'plaintext', 'nodes': 4, 'objects': 20, 'sizes': 'fixed:65536', 'encrypt': False, 'loss': 0.0},
+    {'name': 'mixed-sizes', 'nodes': 4, 'objects': 40, 'sizes': 'lognormal:16384:1.5', 'encrypt': True, 'loss': 0.0},
+    {'name': 'lossy', 'nodes': 4, 'objects': 20, 'sizes': 'fixed:65536', 'encrypt': True, 'loss': 0.02},
+    {'name': 'wide', 'nodes': 12, 'objects': 12, 'sizes': 'fixed:262144', 'encrypt': True, 'loss': 0.0},
+]
+
+
+def parse_sizes(spec: str):
+    """`fixed:N`, `uniform:LO:HI` or `lognormal:MEDIAN:SIGMA` -> function(rng) returning a size in bytes."""
+    kind, _, args = spec.partition(':')
+    vals = [float(a) for a in args.split(':') if a]
+    if kind == 'fixed' and len(vals) == 1:
+        return lambda rng: int(vals[0])
+    if kind == 'uniform' and len(vals) == 2:
+        return lambda rng: rng.randint(int(vals[0]), int(vals[1]))
+    if kind == 'lognormal' and len(vals) == 2:
+        mu = math.log(vals[0])
+        return lambda rng: max(1, min(MAX_OBJECT, int(rng.lognormvariate(mu, vals[1]))))
+    raise ValueError(f'bad size distribution {spec!r}')
+
+
+class LossyTransport:
+    """Drops outgoing datagrams with probability `loss` once `enabled`."""
+
+    def __init__(self, transport, loss: float, rng: random.Random):
+        self.transport = transport
+        self.loss = loss
+        self.rng = rng
+        self.enabled = False
+        self.sent = 0
+        self.dropped = 0
+
+    def sendto(self, data, addr):
+        self.sent += 1
+        if self.enabled and self.rng.random() < self.loss:
+            self.dropped += 1
+            return
+        self.transport.sendto(data, addr)
+
+
+def _merged(nodes, name: str, buckets) -> Histogram:
+    """One histogram holding the observations of `name` from every node."""
+    out = Histogram(name, buckets=buckets)
+    for n in nodes:
+        for key, (counts, total, count) in n.metrics.metrics[name].values.items():
+            h = out.values.setdefault(key, [[0] * len(counts), 0.0, 0])
+            h[0] = [a + b for a, b in zip(h[0], counts)]
+            h[1] += total
+            h[2] += count
+    return out
+
+
+def _counter_total(nodes, name: str) -> float:
+    return sum(v for n in nodes for v in n.metrics.metrics[name].samples().values())
+
+
+def _converged(node: SyncNode, want) -> bool:
+    st = node.storage
+    return all(oid in st and st.version(oid) == ver for oid, ver in want.items())
+
+
+async def run_once(nodes: int = 4, objects: int = 20, sizes: str = 'fixed:65536', encrypt: bool = True,
+                   loss: float = 0.0, seed: int = 1, base_port: int = BASE_PORT, timeout: float = TIMEOUT,
+                   name: str = None) -> dict:
+    rng = random.Random(seed)
+    size_of = parse_sizes(sizes)
+    addrs = [('127.0.0.1', base_port + i) for i in range(nodes)]
+    group = [SyncNode(host, port, node_id=f'bench{i}') for i, (host, port) in enumerate(addrs)]
+    want = {}
+    total = 0
+    for i in range(objects):
+        size = size_of(rng)
+        oid = f'obj{i:05d}'
+        group[rng.randrange(nodes)].add_object(oid, rng.randbytes(size), version=1)
+        want[oid] = 1
+        total += size
+    lossy = []
+    try:
+        for n in group:
+            await n.start()
+            n.transport = LossyTransport(n.transport, loss, random.Random(rng.random()))
+            lossy.append(n.transport)
+
+        t0 = time.monotonic()
+        if encrypt:
+            for i, n in enumerate(group):
+                for a in addrs[i + 1:]:
+                    n.send_key_exchange(a)
+            while any(n.peers.get(a, {}).get('session') is None for n in group for a in addrs if a != (n.host, n.port)):
+                if time.monotonic() - t0 > timeout:
+                    raise TimeoutError('key exchange did not complete')
+                await asyncio.sleep(POLL)
+        handshake = time.monotonic() - t0
+
+        for t in lossy:
+            t.enabled = True
+        cpu0 = time.process_time()
+        t0 = time.monotonic()
+        hello_at = t0
+        pending = group
+        while pending:
+            now = time.monotonic()
+            if now - t0 > timeout:
+                raise TimeoutError(f'no convergence after {timeout}s')
+            if now >= hello_at:
+                hello_at = now + HELLO_INTERVAL
+                for n in pending:
+                    for a in addrs:
+                        if a != (n.host, n.port):
+                            n.send_hello(a)
+            await asyncio.sleep(POLL)
+            pending = [n for n in group if not _converged(n, want)]
+        converge = time.monotonic() - t0
+        cpu = time.process_time() - cpu0
+    finally:
+        for n in group:
+            n.stop()
+
+    delivered = sum(n.metrics.metrics['mesh_transfer_bytes_total'].values.get((), 0) for n in group)
+    rates = _merged(group, 'mesh_transfer_throughput_bytes_per_second', RATE_BUCKETS)
+    h = rates.values.get((), [[], 0.0, 0])
+    mb = delivered / MB
+    received = sum(sum(n.receiver.received) for n in group)
+    return {
+        'name': name,
+        'params': {'nodes': nodes, 'objects': objects, 'sizes': sizes, 'encrypt': encrypt, 'loss': loss, 'seed': seed},
+        'object_bytes': total,
+        'delivered_bytes': delivered,
+        'handshake_s': round(handshake, 4),
+        'converge_s': round(converge, 4),
+        'transfers': h[2],
+        'transfer_mb_s': {'mean': round(h[1] / h[2] / MB, 3) if h[2] else 0.0,
+                          'p50': round(rates.quantile(0.5) / MB, 3)},
+        'goodput_mb_s': round(mb / converge, 3) if converge else 0.0,
+        'cpu_s': round(cpu, 4),
+        'cpu_s_per_mb': round(cpu / mb, 4) if mb else 0.0,
+        'datagrams': sum(t.sent for t in lossy),
+        'dropped': sum(t.dropped for t in lossy),
+        'socket_drops': sum(t.sent - t.dropped for t in lossy) - received,
+        'retransmitted_chunks': int(_counter_total(group, 'mesh_retransmits_total')),
+    }
+
+
+def run(scenarios=SCENARIOS, seed: int = 1, base_port: int = BASE_PORT) -> dict:
+    results = []
+    for i, sc in enumerate(scenarios):
+        # fresh ports per scenario, so late datagrams from the previous run cannot leak in
+        results.append(asyncio.run(run_once(seed=seed, base_port=base_port + 100 * i, **sc)))
+    return {
+        'benchmark': 'mesh.bench_sync',
+        'env': {'python': sys.version.split()[0], 'platform': platform.platform(), 'cpus': os.cpu_count()},
+        'results': results,
+    }
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument('--nodes', type=int)
+    p.add_argument('--objects', type=int, default=20)
+    p.add_argument('--sizes', default='fixed:65536', help='fixed:N | uniform:LO:HI | lognormal:MEDIAN:SIGMA')
+    p.add_argument('--encrypt', action=argparse.BooleanOptionalAction, default=True)
+    p.add_argument('--loss', type=float, default=0.0, help='fraction of datagrams dropped during sync')
+    p.add_argument('--seed', type=int, default=1)
+    p.add_argument('--base-port', type=int, default=BASE_PORT)
+    p.add_argument('--out', help='write JSON here instead of stdout')
+    args = p.parse_args(argv)
+    scenarios = SCENARIOS
+    if args.nodes:
+        scenarios = [{'name': 'custom', 'nodes': args.nodes, 'objects': args.objects, 'sizes': args.sizes,
+                      'encrypt': args.encrypt, 'loss': args.loss}]
+    report = run(scenarios, args.seed, args.base_port)
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
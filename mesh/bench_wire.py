@@ -0,0 +1,82 @@
+"""Microbenchmark: legacy JSON+base64 chunk path vs binary framing.
+
+Run with `python -m mesh.bench_wire`. Reports bytes on the wire per CHUNK and the
+encode/decode cost in microseconds, both with and without session encryption.
+"""
+
+import base64
+import json
+import os
+import time
+
+from . import wire
+from .crypto import b64, ub64, encrypt_and_mac, verify_and_decrypt
+
+ROUNDS = 2000
+CHUNK = os.urandom(1024)
+ENC_KEY = os.urandom(32)
+MAC_KEY = os.urandom(32)
+
+
+def json_encode(encrypted: bool) -> bytes:
+    msg = {'type': 'CHUNK', 'from': 'nodeA', 'id': 'object1', 'chunk': 7,
+           'data': base64.b64encode(CHUNK).decode('ascii'), 'more': 1, 'version': 1}
+    if encrypted:
+        n, ct, mac = encrypt_and_mac(json.dumps(msg).encode('utf-8'), ENC_KEY, MAC_KEY)
+        msg = {'type': 'ENCRYPTED', 'from': 'nodeA', 'enc': {'n': b64(n), 'ct': b64(ct), 'mac': b64(mac)}}
+    return json.dumps(msg).encode('utf-8')
+
+
+def json_decode(data: bytes, encrypted: bool) -> bytes:
+    msg = json.loads(data.decode('utf-8'))
+    if encrypted:
+        enc = msg['enc']
+        pt = verify_and_decrypt(ub64(enc['n']), ub64(enc['ct']), ub64(enc['mac']), ENC_KEY, MAC_KEY)
+        msg = json.loads(pt.decode('utf-8'))
+    return base64.b64decode(msg['data'].encode('ascii'))
+
+
+def binary_encode(encrypted: bool) -> bytes:
+    frame = wire.encode_chunk('object1', 7, 1, CHUNK, more=True)
+    if encrypted:
+        n, ct, mac = encrypt_and_mac(frame, ENC_KEY, MAC_KEY)
+        frame = wire.encode_frame(wire.T_ENCRYPTED, payload=b''.join((n, ct, mac)))
+    return frame
+
+
+def binary_decode(data: bytes, encrypted: bool):
+    frame = wire.decode_frame(data)
+    if encrypted:
+        p = frame.payload
+        pt = verify_and_decrypt(bytes(p[:12]), bytes(p[12:-32]), bytes(p[-32:]), ENC_KEY, MAC_KEY)
+        frame = wire.decode_frame(pt)
+    return frame.payload
+
+
+def _time_us(fn, *args) -> float:
+    t0 = time.perf_counter()
+    for _ in range(ROUNDS):
+        fn(*args)
+    return (time.perf_counter() - t0) / ROUNDS * 1e6
+
+
+def run():
+    results = []
+    for encrypted in (False, True):
+        for name, enc, dec in (('json', json_encode, json_decode), ('binary', binary_encode, binary_decode)):
+            data = enc(encrypted)
+            assert bytes(dec(data, encrypted)) == CHUNK
+            results.append({
+                'codec': name,
+                'encrypted': encrypted,
+                'bytes_per_chunk': len(data),
+                'encode_us': round(_time_us(enc, encrypted), 2),
+                'decode_us': round(_time_us(dec, data, encrypted), 2),
+            })
+    return results
+
+
+if __name__ == '__main__':
+    print(f"{'codec':8} {'enc':5} {'bytes':>7} {'encode us':>10} {'decode us':>10}")
+    for r in run():
+        print(f"{r['codec']:8} {str(r['encrypted']):5} {r['bytes_per_chunk']:7d} {r['encode_us']:10.2f} {r['decode_us']:10.2f}")
@@ -0,0 +1,46 @@
+"""Memory limits for incoming transfers.
+
+An in-memory transfer (no `state_dir`) preallocates a reassembly buffer of the object's size.
+`ReassemblyBudget` caps the bytes held by those buffers overall and per peer. The peer charged
+is the one the transfer was first fetched from (`IncomingTransfer.owner`). Usage is summed over
+the live transfers whenever it is needed, so there are no reservations to leak.
+
+A fetch that does not fit waits in the fetch queue until a transfer ends. Before it is deferred,
+transfers that have received nothing for STALL_GRACE seconds are evicted, oldest first. The
+periodic peer sweep evicts in-memory transfers stalled for `stall_timeout` whether or not
+memory is short. File-backed transfers use no reassembly memory; they are never charged or
+evicted, so they can resume after a restart.
+"""
+
+from typing import Dict, Iterable, List, Tuple
+
+MAX_REASSEMBLY = 128 * 1024 * 1024  # bytes of in-memory reassembly buffers, all transfers
+PEER_REASSEMBLY = 32 * 1024 * 1024  # ... charged to one peer
+STALL_TIMEOUT = 120.0  # seconds without a chunk before the sweep evicts an in-memory transfer
+STALL_GRACE = 5.0  # transfers idle this long may be evicted to make room for a new fetch
+
+
+class ReassemblyBudget:
+    def __init__(self, limit: int = MAX_REASSEMBLY, peer_limit: int = PEER_REASSEMBLY):
+        self.limit = limit
+        self.peer_limit = peer_limit
+
+    def usage(self, transfers: Iterable) -> Tuple[int, Dict[object, int]]:
+        """(total bytes, {owner: bytes}) held by the in-memory buffers of `transfers`."""
+        total, by_peer = 0, {}
+        for t in transfers:
+            n = t.memory
+            if n:
+                total += n
+                by_peer[t.owner] = by_peer.get(t.owner, 0) + n
+        return total, by_peer
+
+    def fits(self, need: int) -> bool:
+        """Whether a transfer needing `need` bytes can ever be admitted."""
+        return need <= min(self.limit, self.peer_limit)
+
+    def stalled(self, transfers: Iterable, now: float, idle: float) -> List:
+        """In-memory transfers that received nothing for `idle` seconds, longest idle first."""
+        out = [t for t in transfers if t.memory and now - t.progress >= idle]
+        out.sort(key=lambda t: t.progress)
+        return out
@@ -0,0 +1,153 @@
+"""Chunk compression codecs for mesh sync.
+
+Peers list the codecs they can decode in HELLO/DIGESTS (`codecs`). A sender uses the first codec in
+its own preference order that the receiver also listed. Compression is then decided per object
+and per chunk:
+
+  - Per object: a sample of the object (a few windows spread over it) is compressed once. If it
+    does not shrink to at most MIN_RATIO of its size, the object's chunks are sent raw without
+    trying to compress them, so incompressible data (media, archives, ciphertext) pays only for
+    the sample.
+  - Per chunk: a chunk is sent compressed only if that saves bytes; otherwise it goes out raw.
+
+Codecs produce raw streams without container headers, since a 1 KiB chunk cannot carry them.
+zlib is always available; lzma needs the stdlib module; zstd needs `compression.zstd` (Python
+3.14+) or the `zstandard` package. Decompression is bounded to `max_size` output bytes.
+"""
+
+import zlib
+from typing import Callable, Dict, List, Optional
+
+try:
+    import lzma
+except ImportError:  # Python built without liblzma
+    lzma = None
+
+try:
+    from compression import zstd as _zstd  # Python 3.14+
+except ImportError:
+    _zstd = None
+try:
+    import zstandard as _zstandard
+except ImportError:
+    _zstandard = None
+
+MIN_RATIO = 0.9  # compressed/raw of the sample must be at most this for an object to be compressed
+SAMPLE_WINDOW = 4096
+SAMPLE_WINDOWS = 3
+
+
+class CompressionError(ValueError):
+    pass
+
+
+class Codec:
+    def __init__(self, name: str, cid: int, compress: Callable, decompress: Callable):
+        self.name = name
+        self.cid = cid  # id carried in binary CHUNK frames
+        self.compress = compress
+        self.decompress = decompress  # (data, max_size) -> bytes
+
+
+def _zlib_compress(data) -> bytes:
+    c = zlib.compressobj(6, zlib.DEFLATED, -15)
+    return c.compress(data) + c.flush()
+
+
+def _zlib_decompress(data, max_size: int) -> bytes:
+    d = zlib.decompressobj(-15)
+    out = d.decompress(data, max_size)
+    if d.unconsumed_tail or not d.eof:
+        raise CompressionError('zlib stream truncated or larger than the chunk limit')
+    return out
+
+
+_codecs: List[Codec] = []
+if _zstd is not None:
+    def _zstd_compress(data) -> bytes:
+        return _zstd.compress(data, 3)
+
+    def _zstd_decompress(data, max_size: int) -> bytes:
+        d = _zstd.ZstdDecompressor()
+        try:
+            out = d.decompress(data, max_size)
+        except _zstd.ZstdError as e:
+            raise CompressionError(str(e)) from None
+        if not d.eof:
+            raise CompressionError('zstd stream truncated or larger than the chunk limit')
+        return out
+
+    _codecs.append(Codec('zstd', 3, _zstd_compress, _zstd_decompress))
+elif _zstandard is not None:
+    _zc = _zstandard.ZstdCompressor(level=3, write_content_size=False, write_checksum=False)
+
+    def _zstd_compress(data) -> bytes:
+        return _zc.compress(bytes(data))
+
+    def _zstd_decompress(data, max_size: int) -> bytes:
+        try:
+            return _zstandard.ZstdDecompressor().decompress(bytes(data), max_output_size=max_size)
+        except _zstandard.ZstdError as e:
+            raise CompressionError(str(e)) from None
+
+    _codecs.append(Codec('zstd', 3, _zstd_compress, _zstd_decompress))
+_codecs.append(Codec('zlib', 1, _zlib_compress, _zlib_decompress))
+if lzma is not None:
+    _LZMA_FILTERS = [{'id': lzma.FILTER_LZMA2, 'preset': 6}]
+
+    def _lzma_compress(data) -> bytes:
+        return lzma.compress(data, format=lzma.FORMAT_RAW, filters=_LZMA_FILTERS)
+
+    def _lzma_decompress(data, max_size: int) -> bytes:
+        d = lzma.LZMADecompressor(lzma.FORMAT_RAW, filters=_LZMA_FILTERS)
+        try:
+            out = d.decompress(bytes(data), max_size)
+        except lzma.LZMAError as e:
+            raise CompressionError(str(e)) from None
+        if not d.eof:
+            raise CompressionError('lzma stream truncated or larger than the chunk limit')
+        return out
+
+    _codecs.append(Codec('lzma', 2, _lzma_compress, _lzma_decompress))
+
+CODECS: Dict[str, Codec] = {c.name: c for c in _codecs}
+BY_ID: Dict[int, Codec] = {c.cid: c for c in _codecs}
+
+
+def available() -> List[str]:
+    """Codec names this build can use, in default preference order."""
+    return [c.name for c in _codecs]
+
+
+def negotiate(mine, theirs) -> Optional[Codec]:
+    """First codec in our preference order that the peer can decode."""
+    theirs = set(theirs or ())
+    for name in mine or ():
+        if name in theirs and name in CODECS:
+            return CODECS[name]
+    return None
+
+
+def decompress(codec, data, max_size: int) -> bytes:
+    """Decode a chunk; `codec` is a name or a frame codec id."""
+    c = BY_ID.get(codec) if isinstance(codec, int) else CODECS.get(codec)
+    if c is None:
+        raise CompressionError(f'unknown codec {codec!r}')
+    try:
+        return c.decompress(data, max_size)
+    except zlib.error as e:
+        raise CompressionError(str(e)) from None
+
+
+def sample(read: Callable, size: int) -> bytes:
+    """Up to SAMPLE_WINDOWS windows spread over an object; `read(offset, length)` reads from it."""
+    if size <= SAMPLE_WINDOW * SAMPLE_WINDOWS:
+        return bytes(read(0, size))
+    step = (size - SAMPLE_WINDOW) // (SAMPLE_WINDOWS - 1)
+    return b''.join(bytes(read(i * step, SAMPLE_WINDOW)) for i in range(SAMPLE_WINDOWS))
+
+
+def worth_compressing(data, codec: Codec, ratio: float = MIN_RATIO) -> bool:
+    if not data:
+        return False
+    return len(codec.compress(data)) <= ratio * len(data)
@@ -0,0 +1,212 @@
+"""Delta-state CRDTs replicated by version vector.
+
+Every replicated object is a `Replica`: a CRDT plus a version vector (node_id -> counter)
+and a per-origin log of the deltas produced by each mutation. A peer that is behind sends
+its version vector; the holder answers with just the deltas that vector has not seen, or
+with the full state when its log no longer reaches back that far.
+
+CRDT states and deltas are JSON-compatible so they travel inside normal sync messages.
+Deltas are themselves states, so applying one is a join and is idempotent.
+"""
+
+import time
+from typing import Dict, List, Optional
+
+MAX_DELTA_LOG = 1024  # deltas kept per origin before peers that far behind get full state
+
+
+class VersionVector:
+    def __init__(self, counters: Optional[Dict[str, int]] = None):
+        self.counters: Dict[str, int] = {k: int(v) for k, v in (counters or {}).items() if v}
+
+    def get(self, node_id: str) -> int:
+        return self.counters.get(node_id, 0)
+
+    def bump(self, node_id: str) -> int:
+        n = self.counters.get(node_id, 0) + 1
+        self.counters[node_id] = n
+        return n
+
+    def merge(self, other: 'VersionVector'):
+        for k, v in other.counters.items():
+            if v > self.counters.get(k, 0):
+                self.counters[k] = v
+
+    def dominates(self, other: 'VersionVector') -> bool:
+        """True if every event in `other` is already included here."""
+        return all(self.counters.get(k, 0) >= v for k, v in other.counters.items())
+
+    def to_dict(self) -> Dict[str, int]:
+        return dict(self.counters)
+
+    def token(self) -> str:
+        """Canonical string form, used as the version in the Merkle summary."""
+        return ','.join(f'{k}:{v}' for k, v in sorted(self.counters.items()))
+
+    def __eq__(self, other):
+        return isinstance(other, VersionVector) and self.counters == other.counters
+
+    def __repr__(self):
+        return f'VersionVector({self.counters})'
+
+
+class GCounter:
+    """Grow-only counter: one monotonically increasing count per replica."""
+
+    kind = 'gcounter'
+
+    def __init__(self):
+        self.counts: Dict[str, int] = {}
+
+    def increment(self, rid: str, dot: str, n: int = 1) -> dict:
+        if n < 0:
+            raise ValueError('GCounter only grows')
+        return {rid: self.counts.get(rid, 0) + n}
+
+    def join(self, delta: dict):
+        for k, v in delta.items():
+            if v > self.counts.get(k, 0):
+                self.counts[k] = v
+
+    def state(self) -> dict:
+        return dict(self.counts)
+
+    def value(self) -> int:
+        return sum(self.counts.values())
+
+
+class ORSet:
+    """Observed-remove set (add wins). Each add is tagged with a unique dot; removes tombstone the observed dots."""
+
+    kind = 'orset'
+
+    def __init__(self):
+        self.adds: Dict[str, set] = {}
+        self.removed: set = set()
+
+    def add(self, rid: str, dot: str, element: str) -> dict:
+        return {'adds': {element: [dot]}, 'rms': []}
+
+    def remove(self, rid: str, dot: str, element: str) -> dict:
+        return {'adds': {}, 'rms': sorted(self.adds.get(element, set()) - self.removed)}
+
+    def join(self, delta: dict):
+        for element, dots in delta.get('adds', {}).items():
+            self.adds.setdefault(element, set()).update(dots)
+        self.removed.update(delta.get('rms', ()))
+
+    def state(self) -> dict:
+        return {'adds': {e: sorted(d) for e, d in self.adds.items()}, 'rms': sorted(self.removed)}
+
+    def value(self) -> set:
+        return {e for e, dots in self.adds.items() if dots - self.removed}
+
+
+class LWWMap:
+    """Last-writer-wins map; ties on the timestamp are broken by replica id. Deletes store None."""
+
+    kind = 'lwwmap'
+
+    def __init__(self):
+        self.entries: Dict[str, list] = {}  # key -> [timestamp, replica id, value]
+
+    def set(self, rid: str, dot: str, key: str, value, ts: float = None) -> dict:
+        return {key: [time.time() if ts is None else ts, rid, value]}
+
+    def delete(self, rid: str, dot: str, key: str, ts: float = None) -> dict:
+        return self.set(rid, dot, key, None, ts)
+
+    def join(self, delta: dict):
+        for key, entry in delta.items():
+            cur = self.entries.get(key)
+            if cur is None or (entry[0], entry[1]) > (cur[0], cur[1]):
+                self.entries[key] = list(entry)
+
+    def state(self) -> dict:
+        return {k: list(v) for k, v in self.entries.items()}
+
+    def value(self) -> dict:
+        return {k: v[2] for k, v in self.entries.items() if v[2] is not None}
+
+
+TYPES = {cls.kind: cls for cls in (GCounter, ORSet, LWWMap)}
+
+
+class Replica:
+    """A CRDT object replicated by delta-state exchange."""
+
+    def __init__(self, kind: str, replica_id: str, on_change=None):
+        if kind not in TYPES:
+            raise ValueError(f'unknown CRDT type {kind}')
+        self.kind = kind
+        self.replica_id = replica_id
+        self.crdt = TYPES[kind]()
+        self.vv = VersionVector()
+        self.log: Dict[str, Dict[int, dict]] = {}  # origin -> counter -> delta
+        self.on_change = on_change
+
+    def update(self, op: str, *args, **kwargs):
+        """Apply a local mutation, e.g. update('increment', 3) or update('set', 'k', 'v')."""
+        counter = self.vv.get(self.replica_id) + 1
+        delta = getattr(self.crdt, op)(self.replica_id, f'{self.replica_id}:{counter}', *args, **kwargs)
+        self.vv.bump(self.replica_id)
+        self._record(self.replica_id, counter, delta)
+        self.crdt.join(delta)
+        if self.on_change:
+            self.on_change(self)
+        return delta
+
+    def value(self):
+        return self.crdt.value()
+
+    def _record(self, origin: str, counter: int, delta: dict):
+        log = self.log.setdefault(origin, {})
+        log[counter] = delta
+        while len(log) > MAX_DELTA_LOG:
+            del log[min(log)]
+
+    def deltas_since(self, remote: VersionVector) -> Optional[List[list]]:
+        """[origin, counter, delta] entries `remote` is missing, or None if the log no longer covers them."""
+        out = []
+        for origin, counter in self.vv.counters.items():
+            have = remote.get(origin)
+            if have >= counter:
+                continue
+            log = self.log.get(origin, {})
+            needed = range(have + 1, counter + 1)
+            if any(c not in log for c in needed):
+                return None
+            out.extend([origin, c, log[c]] for c in needed)
+        return out
+
+    def apply_deltas(self, deltas: List[list]) -> bool:
+        """Join deltas from a peer; returns True if anything new was learned."""
+        changed = False
+        for origin, counter, delta in sorted(deltas, key=lambda d: (d[0], d[1])):
+            counter = int(counter)
+            if counter <= self.vv.get(origin):
+                continue
+            if counter != self.vv.get(origin) + 1:
+                # a gap would break the per-origin prefix the version vector promises
+                continue
+            self.crdt.join(delta)
+            self.vv.counters[origin] = counter
+            self._record(origin, counter, delta)
+            changed = True
+        if changed and self.on_change:
+            self.on_change(self)
+        return changed
+
+    def apply_state(self, state: dict, vv: Dict[str, int]) -> bool:
+        """Join a full state snapshot (sent when our version vector predates the peer's delta log)."""
+        remote = VersionVector(vv)
+        if self.vv.dominates(remote):
+            return False
+        self.crdt.join(state)
+        self.vv.merge(remote)
+        # deltas for the gap are unknown: drop logs we can no longer serve contiguously
+        for origin in remote.counters:
+            self.log.pop(origin, None)
+        if self.on_change:
+            self.on_change(self)
+        return True
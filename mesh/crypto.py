@@ -2,9 +2,27 @@
 
 Provides ECDH (X25519) key agreement, HKDF key derivation, AES-GCM encryption and HMAC-SHA256.
 Requires the `cryptography` package.
+
+`Session` is the per-peer fast path: cipher objects are built once at key exchange and reused.
+Two suites are negotiated in KEY_EXCHANGE:
+  - `gcm-hmac` (legacy): random 12-byte nonce, AES-GCM, then HMAC-SHA256 over nonce + ct.
+    Payload is nonce | ct+tag | mac. Both directions share one key.
+  - `aead1`: AES-GCM only, one key per direction; the nonce is a random per-session prefix
+    followed by a 64-bit message counter. Payload is nonce | ct+tag, 32 bytes shorter per
+    message than the legacy suite.
+
+Keys are agreed from fresh (per-exchange) X25519 keys, so no two sessions share keys and the
+aead1 counters can safely restart at 0 in each. A session can also be derived without X25519
+from a resumption ticket (`Tickets`): the ticket's issuer sealed the previous session's
+resumption secret under a key only it knows, and both sides mix in fresh nonces.
+
+`GroupKey` seals what a multicast distribution sends to its group (see mesh.multicast).
 """
-from typing import Tuple
+from typing import Optional, Tuple
 import base64
+import hmac as std_hmac
+import json
+import struct
 
 try:
     from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey, X25519PublicKey
@@ -29,13 +47,16 @@ def derive_keys(priv: X25519PrivateKey, peer_pub_bytes: bytes) -> Tuple[bytes, b
     peer_pub = X25519PublicKey.from_public_bytes(peer_pub_bytes)
     shared = priv.exchange(peer_pub)
     # derive two 32-byte keys: enc_key and mac_key
-    hkdf = HKDF(algorithm=hashes.SHA256(), length=64, salt=None, info=b'rechain mesh v1', backend=default_backend())
-    out = hkdf.derive(shared)
+    out = _hkdf(shared, b'rechain mesh v1')
     enc_key = out[:32]
     mac_key = out[32:]
     return enc_key, mac_key
 
 
+def _hkdf(shared: bytes, info: bytes) -> bytes:
+    return HKDF(algorithm=hashes.SHA256(), length=64, salt=None, info=info, backend=default_backend()).derive(shared)
+
+
 def encrypt_and_mac(plaintext: bytes, enc_key: bytes, mac_key: bytes) -> Tuple[bytes, bytes, bytes]:
     # AES-GCM for encryption
     aes = AESGCM(enc_key)
@@ -57,6 +78,171 @@ def verify_and_decrypt(nonce: bytes, ct: bytes, mac: bytes, enc_key: bytes, mac_
     return pt
 
 
+SUITE_LEGACY = 'gcm-hmac'
+SUITE_AEAD = 'aead1'
+SUITES = [SUITE_AEAD, SUITE_LEGACY]
+
+NONCE_SIZE = 12
+MAC_SIZE = 32
+TAG_SIZE = 16
+COUNTER = struct.Struct('!Q')
+
+
+class Session:
+    """Crypto state for one peer, derived once per key exchange.
+
+    `seal_into`/`open_into` work on caller-owned buffers; `seal`/`open` allocate the result.
+    """
+
+    def __init__(self, priv: Optional[X25519PrivateKey], my_pub: bytes, peer_pub: bytes, aead: bool = False,
+                 shared: Optional[bytes] = None):
+        """Keys from X25519 (`priv` with `peer_pub`), or from `shared` for a resumed session.
+
+        `my_pub`/`peer_pub` pick which directional key each side sends with; a resumed session
+        passes the two resumption nonces instead of public keys.
+        """
+        if shared is None:
+            shared = priv.exchange(X25519PublicKey.from_public_bytes(peer_pub))
+        legacy = _hkdf(shared, b'rechain mesh v1')
+        self.my_pub = my_pub
+        self.peer_pub = peer_pub
+        self.enc_key, self.mac_key = legacy[:32], legacy[32:]
+        self._gcm = AESGCM(self.enc_key)
+        # directional keys: counters start at 0 on both sides, so each direction needs its own key
+        keys = _hkdf(shared, b'rechain mesh v1 aead1')
+        low, high = keys[:32], keys[32:]
+        tx, rx = (low, high) if my_pub < peer_pub else (high, low)
+        self._tx = AESGCM(tx)
+        self._rx = AESGCM(rx)
+        self.aead = aead
+        self.sent = 0
+        self._prefix = os.urandom(NONCE_SIZE - COUNTER.size)
+        self.resumption = _hkdf(shared, b'rechain mesh v1 resume')[:32]  # what a ticket for this session carries
+
+    def overhead(self, aead: Optional[bool] = None) -> int:
+        aead = self.aead if aead is None else aead
+        return NONCE_SIZE + TAG_SIZE if aead else NONCE_SIZE + TAG_SIZE + MAC_SIZE
+
+    def seal_into(self, plaintext, buf, offset: int = 0) -> int:
+        """Encrypt `plaintext` into `buf[offset:]` with the negotiated suite; returns bytes written."""
+        n = len(plaintext)
+        view = memoryview(buf)
+        if self.aead:
+            nonce = self._prefix + COUNTER.pack(self.sent)
+            self.sent += 1
+            view[offset:offset + NONCE_SIZE] = nonce
+            start = offset + NONCE_SIZE
+            self._tx.encrypt_into(nonce, plaintext, None, view[start:start + n + TAG_SIZE])
+            return NONCE_SIZE + n + TAG_SIZE
+        nonce = os.urandom(NONCE_SIZE)
+        view[offset:offset + NONCE_SIZE] = nonce
+        start = offset + NONCE_SIZE
+        end = start + n + TAG_SIZE
+        self._gcm.encrypt_into(nonce, plaintext, None, view[start:end])
+        view[end:end + MAC_SIZE] = std_hmac.digest(self.mac_key, view[offset:end], 'sha256')
+        return end + MAC_SIZE - offset
+
+    def seal(self, plaintext) -> bytearray:
+        buf = bytearray(len(plaintext) + self.overhead())
+        self.seal_into(plaintext, buf)
+        return buf
+
+    def open_into(self, payload, buf, aead: bool) -> int:
+        """Verify and decrypt a sealed payload into `buf`; `aead` says which suite sealed it.
+
+        Raises InvalidTag (or ValueError for a bad legacy MAC) when authentication fails.
+        """
+        payload = memoryview(payload)
+        plain = len(payload) - self.overhead(aead)
+        if plain < 0:
+            raise ValueError('sealed payload too short')
+        out = memoryview(buf)[:plain]
+        if aead:
+            return self._rx.decrypt_into(bytes(payload[:NONCE_SIZE]), payload[NONCE_SIZE:], None, out)
+        body = payload[:-MAC_SIZE]
+        if not std_hmac.compare_digest(std_hmac.digest(self.mac_key, body, 'sha256'), payload[-MAC_SIZE:]):
+            raise ValueError('bad MAC')
+        return self._gcm.decrypt_into(bytes(body[:NONCE_SIZE]), body[NONCE_SIZE:], None, out)
+
+    def open(self, payload, aead: bool) -> bytearray:
+        buf = bytearray(max(0, len(payload) - self.overhead(aead)))
+        self.open_into(payload, buf, aead)
+        return buf
+
+
+class GroupKey:
+    """Key of one multicast distribution, shared by its sender and members (see mesh.multicast).
+
+    AES-GCM with a random nonce prefix and a message counter, like aead1. Only the sender
+    seals, so one key never sees a nonce twice. `key_id` tells members which key opens a frame.
+    """
+
+    def __init__(self, key: Optional[bytes] = None, key_id: Optional[int] = None):
+        self.key = key or AESGCM.generate_key(256)
+        self.key_id = int.from_bytes(os.urandom(4), 'big') if key_id is None else key_id
+        self._aes = AESGCM(self.key)
+        self.sent = 0
+        self._prefix = os.urandom(NONCE_SIZE - COUNTER.size)
+
+    def overhead(self) -> int:
+        return NONCE_SIZE + TAG_SIZE
+
+    def seal_into(self, plaintext, buf, offset: int = 0) -> int:
+        n = len(plaintext)
+        nonce = self._prefix + COUNTER.pack(self.sent)
+        self.sent += 1
+        view = memoryview(buf)
+        view[offset:offset + NONCE_SIZE] = nonce
+        start = offset + NONCE_SIZE
+        self._aes.encrypt_into(nonce, plaintext, None, view[start:start + n + TAG_SIZE])
+        return NONCE_SIZE + n + TAG_SIZE
+
+    def open(self, payload) -> bytearray:
+        """Raises InvalidTag unless a holder of this key sealed `payload`."""
+        payload = memoryview(payload)
+        if len(payload) < self.overhead():
+            raise ValueError('sealed payload too short')
+        buf = bytearray(len(payload) - self.overhead())
+        self._aes.decrypt_into(bytes(payload[:NONCE_SIZE]), payload[NONCE_SIZE:], None, buf)
+        return buf
+
+
+RESUME_NONCE_SIZE = 16
+
+
+def resumed_secret(resumption: bytes, client_nonce: bytes, server_nonce: bytes) -> bytes:
+    """Key material of a session resumed from a ticket; fresh nonces make it unique."""
+    return HKDF(algorithm=hashes.SHA256(), length=32, salt=client_nonce + server_nonce,
+                info=b'rechain mesh v1 resumed', backend=default_backend()).derive(resumption)
+
+
+class Tickets:
+    """Issues and redeems resumption tickets, sealed under a key that never leaves this node.
+
+    A ticket is opaque to its holder: nonce | AES-GCM({id, secret, expires}). Only the holder
+    also knows the secret (it derived it from the same session), so a copied ticket is useless.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._aes = AESGCM(AESGCM.generate_key(256))
+
+    def issue(self, peer_id: str, secret: bytes, now: float) -> bytes:
+        nonce = os.urandom(NONCE_SIZE)
+        body = json.dumps({'id': peer_id, 'secret': b64(secret), 'expires': now + self.ttl}).encode('utf-8')
+        return nonce + self._aes.encrypt(nonce, body, b'ticket')
+
+    def redeem(self, ticket: bytes, peer_id: str, now: float) -> Optional[bytes]:
+        """The resumption secret in `ticket`, or None if it is forged, expired or was issued to someone else."""
+        try:
+            body = json.loads(self._aes.decrypt(ticket[:NONCE_SIZE], ticket[NONCE_SIZE:], b'ticket'))
+        except Exception:
+            return None
+        if body.get('id') != peer_id or body.get('expires', 0) < now:
+            return None
+        return ub64(body['secret'])
+
+
 def b64(x: bytes) -> str:
     return base64.b64encode(x).decode('ascii')
 
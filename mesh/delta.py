@@ -0,0 +1,151 @@
+"""Delta sync for new versions of objects the receiver already holds.
+
+Both sides split an object into content-defined segments with a gear rolling hash, so an
+edit only changes the segments around it. The holder of the new version sends a RECIPE:
+the (length, hash) list of its segments. The requester matches those against the segments
+of its old version, copies every fixed-size transfer chunk that is fully covered by matched
+segments, and pulls only the remaining chunks through the normal windowed transfer.
+
+The gear hash runs in pure Python, about 5 MB/s. `Segmenter` therefore takes an object block by
+block, so SyncNode can read blocks from storage and hash each one in an executor thread.
+"""
+
+import hashlib
+from typing import Dict, List, Tuple
+
+MIN_AVG = 2048
+MAX_AVG = 1 << 16
+TARGET_SEGMENTS = 256  # keeps a RECIPE around a few KB regardless of object size
+SEGMENT_HASH_BYTES = 8
+
+_MASK64 = (1 << 64) - 1
+_GEAR = [int.from_bytes(hashlib.sha256(bytes([i])).digest()[:8], 'big') for i in range(256)]
+
+
+def average_for(size: int) -> int:
+    """Power-of-two average segment size for an object of `size` bytes."""
+    avg = MIN_AVG
+    while avg < MAX_AVG and size // avg > TARGET_SEGMENTS:
+        avg <<= 1
+    return avg
+
+
+def _cut(view, avg: int) -> int:
+    """Length of the segment at the start of `view`; `view` holds at least avg*4 bytes unless it ends the data."""
+    shift = 64 - (avg.bit_length() - 1)
+    end = min(len(view), avg * 4)
+    pos = min(avg // 4, end)
+    gear = _GEAR
+    h = 0
+    # the hash only depends on the last 64 bytes, so warm up just before the first cut candidate
+    for b in view[max(0, pos - 64):pos]:
+        h = ((h << 1) + gear[b]) & _MASK64
+    j = pos
+    for b in view[pos:end]:
+        h = ((h << 1) + gear[b]) & _MASK64
+        j += 1
+        if not h >> shift:
+            return j
+    return end
+
+
+def segments(data, avg: int) -> List[Tuple[int, int]]:
+    """Content-defined (offset, length) segments; lengths stay within [avg/4, avg*4]."""
+    view = memoryview(data)
+    out = []
+    start = 0
+    while start < len(view):
+        length = _cut(view[start:], avg)
+        out.append((start, length))
+        start += length
+    return out
+
+
+class Segmenter:
+    """The segments of `segments()`, from data fed in blocks: (offset, length, hash) of each completed one."""
+
+    def __init__(self, avg: int):
+        self.avg = avg
+        self.pending = bytearray()  # data from the start of the next segment
+        self.offset = 0
+
+    def feed(self, block) -> List[Tuple[int, int, str]]:
+        self.pending += block
+        return self._take(self.avg * 4)
+
+    def finish(self) -> List[Tuple[int, int, str]]:
+        return self._take(1)
+
+    def _take(self, room: int) -> List[Tuple[int, int, str]]:
+        out = []
+        while len(self.pending) >= room:
+            with memoryview(self.pending) as view:
+                length = _cut(view, self.avg)
+                out.append((self.offset, length, segment_hash(view[:length])))
+            del self.pending[:length]
+            self.offset += length
+        return out
+
+
+def segment_hash(data) -> str:
+    return hashlib.blake2b(data, digest_size=SEGMENT_HASH_BYTES).hexdigest()
+
+
+def recipe(data, avg: int = None) -> dict:
+    """Segment list of `data` as sent in a RECIPE message."""
+    avg = avg or average_for(len(data))
+    view = memoryview(data)
+    return {'avg': avg, 'segments': [[length, segment_hash(view[off:off + length])] for off, length in segments(view, avg)]}
+
+
+def reusable_ranges(old_segments, new_recipe: dict, size: int, chunk_size: int) -> Dict[int, List[Tuple[int, int]]]:
+    """Transfer chunks of the new version that can be rebuilt from the old one.
+
+    `old_segments` are the (offset, length, hash) segments of the old data at the recipe's average.
+    Returns chunk index -> (old offset, length) pieces for every chunk fully covered by segments whose
+    (length, hash) also occurs in the old data.
+    """
+    known: Dict[Tuple[int, str], int] = {}
+    for off, length, h in old_segments:
+        known.setdefault((length, h), off)
+    # matched byte ranges of the new object: (new offset, length, old offset)
+    matched = []
+    pos = 0
+    for length, h in new_recipe['segments']:
+        src = known.get((int(length), h))
+        if src is not None:
+            if matched and matched[-1][0] + matched[-1][1] == pos and matched[-1][2] + matched[-1][1] == src:
+                matched[-1] = (matched[-1][0], matched[-1][1] + length, matched[-1][2])
+            else:
+                matched.append((pos, int(length), src))
+        pos += int(length)
+    if pos != size:
+        return {}
+    out = {}
+    seg = 0
+    nchunks = -(-size // chunk_size)
+    for idx in range(nchunks):
+        start, end = idx * chunk_size, min(size, (idx + 1) * chunk_size)
+        while seg < len(matched) and matched[seg][0] + matched[seg][1] <= start:
+            seg += 1
+        parts = []
+        cursor = start
+        k = seg
+        while cursor < end and k < len(matched) and matched[k][0] <= cursor:
+            m_off, m_len, m_src = matched[k]
+            take = min(end, m_off + m_len) - cursor
+            parts.append((m_src + cursor - m_off, take))
+            cursor += take
+            k += 1
+        if cursor == end:
+            out[idx] = parts
+    return out
+
+
+def reusable_chunks(old, new_recipe: dict, size: int, chunk_size: int) -> Dict[int, bytes]:
+    """reusable_ranges() for `old` held in memory, as chunk index -> chunk bytes."""
+    old_view = memoryview(old)
+    found = [(off, length, segment_hash(old_view[off:off + length]))
+             for off, length in segments(old_view, new_recipe['avg'])]
+    ranges = reusable_ranges(found, new_recipe, size, chunk_size)
+    return {idx: b''.join(old_view[off:off + n] for off, n in parts) for idx, parts in ranges.items()}
@@ -20,6 +20,7 @@ from typing import Callable
 MCAST_GRP = '224.0.0.251'
 MCAST_PORT = 9999
 ANNOUNCE_INTERVAL = 5.0
+MIN_ANNOUNCE_GAP = 0.5  # announce_now() never sends more often than this
 BUFFER_SIZE = 4096
 
 
@@ -30,6 +31,7 @@ class DiscoveryService:
         self.on_update = on_update
         self.running = False
         self._sock = None
+        self._wake = threading.Event()
 
     def _build_packet(self):
         packet = {
@@ -72,13 +74,18 @@ class DiscoveryService:
         sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
         ttl = struct.pack('b', 1)
         sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
-        packet = self._build_packet()
         while self.running:
             try:
-                sock.sendto(packet, (MCAST_GRP, MCAST_PORT))
+                sock.sendto(self._build_packet(), (MCAST_GRP, MCAST_PORT))  # metadata may change (store summary)
             except Exception:
                 pass
-            time.sleep(ANNOUNCE_INTERVAL)
+            time.sleep(MIN_ANNOUNCE_GAP)
+            self._wake.wait(ANNOUNCE_INTERVAL - MIN_ANNOUNCE_GAP)
+            self._wake.clear()
+
+    def announce_now(self):
+        """Send the next announcement early, e.g. because the metadata changed."""
+        self._wake.set()
 
     def start(self):
         if self.running:
@@ -92,6 +99,7 @@ class DiscoveryService:
 
     def stop(self):
         self.running = False
+        self._wake.set()
         try:
             if self._sock:
                 self._sock.close()
@@ -0,0 +1,141 @@
+"""Forward error correction for chunk transfers on lossy links.
+
+Chunks are coded in groups of GROUP consecutive chunks (the last group of an object may be
+shorter) with a systematic Reed-Solomon code over GF(2^8), built from a Cauchy matrix: the
+data chunks go out unchanged, followed by up to MAX_REPAIR repair symbols of CHUNK size.
+Any k of the k + r chunks and repair symbols of a group rebuild the whole group, so losses
+within a group cost no retransmission round trip.
+
+The receiver decides: a REQUEST carries `fec`, the repair symbols it wants per fully requested
+group, from `repair_count(loss)` with the loss rate measured on that peer (mesh.peers). On a
+clean link it asks for none and nothing changes. Only peers holding the whole object answer
+with repair symbols (capability `fec1`); swarm peers serving a partial copy send chunks only.
+
+Coding cost is one table lookup per byte (`bytes.translate`) and one big-integer XOR per
+chunk and coefficient, so it stays in C.
+"""
+
+import math
+from typing import Dict, List
+
+CAP_FEC = 'fec1'
+GROUP = 16  # data chunks per coding group
+MAX_REPAIR = 8  # repair symbols per group at most
+MIN_LOSS = 0.01  # measured loss below which no repair symbols are requested
+SIGMA = 2.0  # repair symbols cover the expected losses plus this many standard deviations
+MAX_GROUPS = 64  # groups per transfer holding repair symbols that could not be used yet
+
+_EXP = bytearray(512)
+_LOG = bytearray(256)
+_x = 1
+for _i in range(255):
+    _EXP[_i] = _x
+    _LOG[_x] = _i
+    _x <<= 1
+    if _x & 0x100:
+        _x ^= 0x11D
+for _i in range(255, 512):
+    _EXP[_i] = _EXP[_i - 255]
+_TABLES: Dict[int, bytes] = {}
+
+
+def _mul(a: int, b: int) -> int:
+    if a == 0 or b == 0:
+        return 0
+    return _EXP[_LOG[a] + _LOG[b]]
+
+
+def _inv(a: int) -> int:
+    return _EXP[255 - _LOG[a]]
+
+
+def _table(c: int) -> bytes:
+    t = _TABLES.get(c)
+    if t is None:
+        t = _TABLES[c] = bytes(_mul(c, v) for v in range(256))
+    return t
+
+
+def _coef(row: int, col: int) -> int:
+    """Cauchy matrix entry 1 / (x_row + y_col) with x = 128 + row, y = col: every square submatrix is invertible."""
+    return _inv((128 + row) ^ col)
+
+
+def _combine(terms, size: int) -> bytes:
+    """XOR of coefficient * vector over (coefficient, vector) pairs."""
+    acc = 0
+    for c, vec in terms:
+        if c:
+            acc ^= int.from_bytes(vec if c == 1 else vec.translate(_table(c)), 'big')
+    return acc.to_bytes(size, 'big')
+
+
+def _pad(chunk, size: int) -> bytes:
+    chunk = bytes(chunk)
+    return chunk if len(chunk) == size else chunk + bytes(size - len(chunk))
+
+
+def repair_count(loss: float, k: int = GROUP) -> int:
+    """Repair symbols per group of `k` chunks for a link losing `loss` of its datagrams."""
+    if loss < MIN_LOSS:
+        return 0
+    loss = min(loss, 0.5)
+    n = k / (1 - loss)  # datagrams to send for k to arrive on average
+    r = n - k + SIGMA * math.sqrt(n * loss * (1 - loss))
+    return max(1, min(MAX_REPAIR, math.ceil(r)))
+
+
+def encode(chunks: List[bytes], rows, size: int) -> List[bytes]:
+    """Repair symbols `rows` (e.g. range(r)) of the group `chunks`, each `size` bytes."""
+    data = [_pad(c, size) for c in chunks]
+    return [_combine(((_coef(j, i), d) for i, d in enumerate(data)), size) for j in rows]
+
+
+def recover(k: int, chunks: Dict[int, bytes], repairs: Dict[int, bytes], size: int) -> Dict[int, bytes]:
+    """The missing data chunks of a group of `k`, padded to `size`; empty if there are too few pieces.
+
+    `chunks` maps positions in the group (0..k-1) to data chunks, `repairs` maps rows to repair symbols.
+    """
+    missing = [i for i in range(k) if i not in chunks]
+    if not missing or len(repairs) < len(missing):
+        return {}
+    rows = sorted(repairs)[:len(missing)]
+    data = {i: _pad(c, size) for i, c in chunks.items()}
+    # each repair symbol minus the known chunks is a combination of the missing ones only
+    sums = [_combine([(1, repairs[j])] + [(_coef(j, i), d) for i, d in data.items()], size) for j in rows]
+    # invert the Cauchy submatrix rows x missing (Gauss-Jordan over GF(2^8))
+    e = len(missing)
+    m = [[_coef(j, i) for i in missing] + [int(r == c) for c in range(e)] for r, j in enumerate(rows)]
+    for col in range(e):
+        pivot = next(r for r in range(col, e) if m[r][col])
+        m[col], m[pivot] = m[pivot], m[col]
+        scale = _inv(m[col][col])
+        m[col] = [_mul(scale, v) for v in m[col]]
+        for r in range(e):
+            if r != col and m[r][col]:
+                f = m[r][col]
+                m[r] = [v ^ _mul(f, p) for v, p in zip(m[r], m[col])]
+    return {i: _combine(((m[n][e + r], sums[r]) for r in range(e)), size) for n, i in enumerate(missing)}
+
+
+class RepairSet:
+    """Repair symbols received for the groups of one transfer that are not complete yet."""
+
+    def __init__(self, max_groups: int = MAX_GROUPS):
+        self.max_groups = max_groups
+        self.groups: Dict[int, Dict[int, bytes]] = {}  # group -> {row: symbol}, oldest first
+
+    def add(self, group: int, row: int, symbol: bytes) -> Dict[int, bytes]:
+        rows = self.groups.get(group)
+        if rows is None:
+            rows = self.groups[group] = {}
+            if len(self.groups) > self.max_groups:
+                self.groups.pop(next(iter(self.groups)))
+        rows[row] = symbol
+        return rows
+
+    def get(self, group: int) -> Dict[int, bytes]:
+        return self.groups.get(group, {})
+
+    def discard(self, group: int):
+        self.groups.pop(group, None)
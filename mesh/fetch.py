@@ -0,0 +1,83 @@
+"""Namespaces, subscriptions and the fetch queue for SyncNode.
+
+A namespace is an object id prefix, e.g. 'photos/' or 'alerts/'. A node created with
+`subscribe=['alerts/', 'config/']` lists those prefixes in HELLO (and DIGESTS/TREE), and peers
+then summarize and advertise only the objects under them; `None` subscribes to everything.
+
+Objects a peer has newer versions of are not fetched at once but queued in a `FetchQueue`.
+The node keeps at most `max_fetches` transfers running and starts the most urgent queued
+object whenever one finishes: highest priority first, then smallest size, then first come.
+Priorities are configured per namespace (`priorities={'alerts/': 10, 'video/': -1}`; the
+longest matching prefix wins, default 0). A queued object remembers every peer that offered
+it, so the transfer can start from the best-ranked one and swarm from the rest.
+"""
+
+import heapq
+import itertools
+import math
+from typing import Dict, Iterable, Optional
+
+MAX_FETCHES = 16  # transfers (and delta recipe waits) running at once
+MAX_QUEUED = 4096  # objects waiting; offers beyond this are dropped until anti-entropy repeats them
+
+
+def matches(oid: str, prefixes: Optional[tuple]) -> bool:
+    """Whether `oid` is in one of the namespaces `prefixes`; None means every namespace."""
+    return prefixes is None or oid.startswith(prefixes)
+
+
+def normalize(prefixes: Optional[Iterable[str]]) -> Optional[tuple]:
+    return None if prefixes is None else tuple(sorted(set(str(p) for p in prefixes)))
+
+
+class FetchQueue:
+    def __init__(self, priorities: Optional[Dict[str, int]] = None, limit: int = MAX_QUEUED):
+        self.priorities = dict(priorities or {})
+        self.limit = limit
+        self.dropped = 0
+        self.entries: Dict[str, dict] = {}  # object id -> {entry, version, peers}
+        self._heap = []
+        self._seq = itertools.count()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, oid):
+        return oid in self.entries
+
+    def priority(self, oid: str) -> int:
+        best, value = -1, 0
+        for prefix, p in self.priorities.items():
+            if len(prefix) > best and oid.startswith(prefix):
+                best, value = len(prefix), p
+        return value
+
+    def push(self, entry: dict, addr):
+        """Queue a digest entry offered by `addr`; a newer version replaces a queued older one."""
+        oid, ver = entry['id'], entry.get('version', 0)
+        item = self.entries.get(oid)
+        if item is not None and item['version'] > ver:
+            return
+        if item is not None and item['version'] == ver and item['entry'].get('hash') == entry.get('hash'):
+            if addr not in item['peers']:
+                item['peers'].append(addr)
+            return
+        if item is None and len(self.entries) >= self.limit:
+            self.dropped += 1
+            return
+        item = self.entries[oid] = {'entry': entry, 'version': ver, 'peers': [addr]}
+        size = entry.get('size')
+        key = (-self.priority(oid), math.inf if size is None else int(size), next(self._seq))
+        heapq.heappush(self._heap, (key, oid, item))
+
+    def pop(self) -> Optional[dict]:
+        """The most urgent queued item, or None."""
+        while self._heap:
+            _, oid, item = heapq.heappop(self._heap)
+            if self.entries.get(oid) is item:  # else superseded by a newer version
+                del self.entries[oid]
+                return item
+        return None
+
+    def discard(self, oid: str):
+        self.entries.pop(oid, None)
@@ -0,0 +1,183 @@
+"""Fragmentation of datagrams larger than the path MTU, and path MTU probing.
+
+Works below the sync protocol: any datagram the node sends (JSON or binary, sealed or not) that
+is larger than the path MTU towards a peer is cut into FRAGMENT frames, and the receiver hands
+the reassembled datagram to the usual decoding path. This only happens towards peers that list
+`frag1` in HELLO/DIGESTS; older peers get the datagram whole, as before.
+
+FRAGMENT frame: binary header with type T_FRAGMENT, version = message id (per sender), index =
+fragment index, no object id, payload = FRAG (fragment count) + the piece. Fragments are not
+sealed themselves; the datagram they rebuild is, so a forged fragment only spoils one message.
+Fragments are not retransmitted: losing one loses the message, as losing the datagram would.
+Senders therefore keep messages small (DIGESTS go out in batches) and fragmentation only
+covers the occasional message over the path MTU. `split` raises FragmentError for a datagram
+the receiver would refuse, so the caller sees it instead of the peer silently dropping it.
+
+`Reassembler` keeps partial messages per (peer, message id) and bounds them three ways:
+fragments of a message must all arrive within REASSEMBLY_TIMEOUT, a peer has at most
+PEER_PARTIALS messages in progress, and all partials together hold at most MAX_PARTIAL_BYTES.
+The oldest partial message is dropped to make room.
+
+`PathMtu` finds the largest datagram that gets through to a peer. Every peer starts at MIN_MTU,
+which any IPv4/IPv6 path carries. Once a datagram to the peer is too big for MIN_MTU, padded
+PROBE frames binary-search up to the smaller of our `mtu` and the peer's advertised one. A PROBE
+is answered with a small PROBE_ACK, and a probe lost PROBE_TRIES times in a row marks its size as
+too big. The search starts over from MIN_MTU every PROBE_INTERVAL, as routes change.
+"""
+
+import struct
+from typing import Dict, List, Optional
+
+from . import wire
+
+CAP_FRAGMENT = 'frag1'
+MIN_MTU = 1200  # bytes of UDP payload assumed to get through unfragmented on any path
+DEFAULT_MTU = 1472  # Ethernet: 1500 - IPv4 header - UDP header
+MAX_FRAGMENTS = 1024  # fragments per message
+MAX_MESSAGE = 1024 * 1024  # largest reassembled datagram
+REASSEMBLY_TIMEOUT = 5.0  # seconds from the first fragment of a message to its last
+PEER_PARTIALS = 8  # messages being reassembled per peer
+MAX_PARTIAL_BYTES = 4 * 1024 * 1024  # bytes held by partial messages, all peers
+PROBE_RESOLUTION = 32  # the search stops when the bounds are this close
+PROBE_TRIES = 2  # losses of one probe size before it counts as too big
+PROBE_INTERVAL = 600.0  # seconds between searches towards the same peer
+
+FRAG = struct.Struct('!H')  # fragment count, at the start of the FRAGMENT payload
+OVERHEAD = wire.HEADER_SIZE + FRAG.size
+
+
+class FragmentError(ValueError):
+    """A datagram the receiver would not reassemble; the message has to be split before sending."""
+
+
+def split(datagram, mtu: int, msg_id: int, flags: int = 0) -> List[bytes]:
+    """FRAGMENT frames of at most `mtu` bytes carrying `datagram`."""
+    size = mtu - OVERHEAD
+    if size <= 0:
+        raise FragmentError(f'mtu {mtu} too small to fragment')
+    view = memoryview(datagram)
+    count = -(-len(view) // size)
+    if count > MAX_FRAGMENTS or len(view) > MAX_MESSAGE:
+        raise FragmentError(f'datagram of {len(view)} bytes is over the {MAX_MESSAGE} byte or {MAX_FRAGMENTS} fragment limit')
+    head = FRAG.pack(count)
+    return [wire.encode_frame(wire.T_FRAGMENT, '', i, msg_id, b''.join((head, view[i * size:(i + 1) * size])), flags)
+            for i in range(count)]
+
+
+def probe(size: int) -> bytes:
+    """A PROBE frame of exactly `size` bytes; the index field repeats the size."""
+    return wire.encode_frame(wire.T_PROBE, '', size, payload=bytes(size - wire.HEADER_SIZE))
+
+
+def probe_ack(frame: wire.Frame) -> bytes:
+    return wire.encode_frame(wire.T_PROBE_ACK, '', frame.index)
+
+
+class Reassembler:
+    def __init__(self, timeout: float = REASSEMBLY_TIMEOUT, peer_partials: int = PEER_PARTIALS,
+                 max_bytes: int = MAX_PARTIAL_BYTES):
+        self.timeout = timeout
+        self.peer_partials = peer_partials
+        self.max_bytes = max_bytes
+        self.partials: Dict[tuple, dict] = {}  # (addr, message id) -> {parts, missing, bytes, started}, oldest first
+        self.bytes = 0
+        self.dropped = {'timeout': 0, 'evicted': 0, 'invalid': 0}
+
+    def add(self, addr, frame: wire.Frame, now: float) -> Optional[bytes]:
+        """Store one fragment; returns the whole datagram once its last fragment is in."""
+        self.expire(now)
+        if len(frame.payload) < FRAG.size:
+            self.dropped['invalid'] += 1
+            return None
+        count = FRAG.unpack_from(frame.payload)[0]
+        piece = bytes(frame.payload[FRAG.size:])
+        key = (addr, frame.version)
+        p = self.partials.get(key)
+        if p is None:
+            if not 0 < count <= MAX_FRAGMENTS or frame.index >= count or len(piece) * (count - 1) > MAX_MESSAGE:
+                self.dropped['invalid'] += 1
+                return None
+            self._make_room(addr, len(piece))
+            p = self.partials[key] = {'parts': [None] * count, 'missing': count, 'bytes': 0, 'started': now}
+        elif count != len(p['parts']) or frame.index >= count:
+            self.dropped['invalid'] += 1
+            return None
+        if p['parts'][frame.index] is not None:
+            return None  # duplicate
+        p['parts'][frame.index] = piece
+        p['missing'] -= 1
+        p['bytes'] += len(piece)
+        self.bytes += len(piece)
+        if p['missing']:
+            if p['bytes'] > MAX_MESSAGE:
+                self._drop(key, 'invalid')
+            elif self.bytes > self.max_bytes:
+                self._make_room(None, 0)
+            return None
+        self._drop(key)
+        return b''.join(p['parts'])
+
+    def expire(self, now: float):
+        while self.partials:
+            key, p = next(iter(self.partials.items()))
+            if now - p['started'] < self.timeout:
+                break
+            self._drop(key, 'timeout')
+
+    def _make_room(self, addr, need: int):
+        if addr is not None:
+            mine = [k for k in self.partials if k[0] == addr]
+            if len(mine) >= self.peer_partials:
+                self._drop(mine[0], 'evicted')
+        while self.partials and self.bytes + need > self.max_bytes:
+            self._drop(next(iter(self.partials)), 'evicted')
+
+    def _drop(self, key, reason: str = None):
+        p = self.partials.pop(key)
+        self.bytes -= p['bytes']
+        if reason:
+            self.dropped[reason] += 1
+
+    def __len__(self):
+        return len(self.partials)
+
+
+class PathMtu:
+    """What is known about the path MTU towards one peer; `mtu` is the largest size confirmed."""
+
+    def __init__(self, floor: int = MIN_MTU, limit: int = DEFAULT_MTU):
+        self.floor = floor
+        self.limit = max(floor, limit)  # the smaller of both ends' configured MTU
+        self.mtu = floor
+        self.ceiling = self.limit  # sizes above this are known not to get through
+        self.probing: Optional[int] = None  # size of the probe in flight
+        self.tries = 0
+
+    @property
+    def searching(self) -> bool:
+        return self.ceiling - self.mtu >= PROBE_RESOLUTION
+
+    def next_probe(self) -> Optional[int]:
+        """Size to probe next, or None once the search is over."""
+        if self.probing is None and self.searching:
+            self.probing = (self.mtu + self.ceiling + 1) // 2
+        return self.probing
+
+    def acked(self, size: int):
+        self.mtu = max(self.mtu, min(size, self.ceiling))
+        if size == self.probing:
+            self.probing, self.tries = None, 0
+
+    def lost(self, size: int):
+        if size != self.probing:
+            return
+        self.tries += 1
+        if self.tries >= PROBE_TRIES:
+            self.ceiling = size - 1
+            self.probing, self.tries = None, 0
+
+    def restart(self):
+        """Search again from the floor: the path may have changed either way."""
+        self.mtu = self.floor
+        self.ceiling = self.limit
+        self.probing, self.tries = None, 0
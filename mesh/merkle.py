@@ -0,0 +1,104 @@
+"""Prefix Merkle tree over (object id, version) pairs for digest reconciliation.
+
+Objects are bucketed by the first `depth` hex digits of sha256(object id). A leaf bucket's
+value is the XOR of its entries' hashes, so adding, replacing or removing an object is O(1)
+at the leaf; interior hashes are recomputed lazily along the dirty path only.
+
+Two nodes compare `root()` first and then descend into the children that differ, so two
+already-synced stores agree after a single exchange of one short hash.
+"""
+
+import hashlib
+from typing import Dict, List, Set, Tuple
+
+FANOUT = 16
+HEX = '0123456789abcdef'
+DEFAULT_DEPTH = 2
+HASH_HEX = 16  # hashes travel truncated to 64 bits; this is reconciliation, not authentication
+EMPTY = '0' * HASH_HEX
+
+
+def bucket_of(oid: str, depth: int) -> str:
+    return hashlib.sha256(oid.encode('utf-8')).hexdigest()[:depth]
+
+
+def entry_hash(oid: str, version: int) -> int:
+    return int.from_bytes(hashlib.sha256(f'{oid}\0{version}'.encode('utf-8')).digest(), 'big')
+
+
+class MerkleTree:
+    def __init__(self, depth: int = DEFAULT_DEPTH):
+        self.depth = depth
+        self.entries: Dict[str, Tuple[int, int]] = {}  # oid -> (version, entry hash)
+        self.buckets: Dict[str, Set[str]] = {}  # leaf prefix -> object ids
+        self.leaves: Dict[str, int] = {}  # leaf prefix -> XOR of entry hashes
+        self._cache: Dict[str, str] = {}  # prefix -> hex hash of interior nodes
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _invalidate(self, leaf: str):
+        for i in range(len(leaf)):
+            self._cache.pop(leaf[:i], None)
+
+    def update(self, oid: str, version: int):
+        old = self.entries.get(oid)
+        if old and old[0] == version:
+            return
+        leaf = bucket_of(oid, self.depth)
+        acc = self.leaves.get(leaf, 0)
+        if old:
+            acc ^= old[1]
+        h = entry_hash(oid, version)
+        self.entries[oid] = (version, h)
+        self.leaves[leaf] = acc ^ h
+        self.buckets.setdefault(leaf, set()).add(oid)
+        self._invalidate(leaf)
+
+    def remove(self, oid: str):
+        old = self.entries.pop(oid, None)
+        if not old:
+            return
+        leaf = bucket_of(oid, self.depth)
+        self.leaves[leaf] ^= old[1]
+        members = self.buckets[leaf]
+        members.discard(oid)
+        if not members:
+            del self.buckets[leaf]
+            del self.leaves[leaf]
+        self._invalidate(leaf)
+
+    def node_hash(self, prefix: str = '') -> str:
+        if len(prefix) >= self.depth:
+            if prefix not in self.leaves:
+                return EMPTY
+            return f'{self.leaves[prefix]:064x}'[:HASH_HEX]
+        cached = self._cache.get(prefix)
+        if cached is None:
+            children = self.children(prefix)
+            if all(c == EMPTY for c in children):
+                cached = EMPTY
+            else:
+                cached = hashlib.sha256(''.join(children).encode('ascii')).hexdigest()[:HASH_HEX]
+            self._cache[prefix] = cached
+        return cached
+
+    def root(self) -> str:
+        return self.node_hash('')
+
+    def children(self, prefix: str) -> List[str]:
+        return [self.node_hash(prefix + c) for c in HEX]
+
+    def is_leaf(self, prefix: str) -> bool:
+        return len(prefix) >= self.depth
+
+    def objects_under(self, prefix: str) -> List[str]:
+        """Object ids in the subtree rooted at `prefix`."""
+        if self.is_leaf(prefix):
+            return sorted(self.buckets.get(prefix[:self.depth], ()))
+        return sorted(oid for leaf, members in self.buckets.items() if leaf.startswith(prefix) for oid in members)
+
+    def diff_children(self, prefix: str, theirs: List[str]) -> List[str]:
+        """Child prefixes whose remote hash is non-empty and differs from ours."""
+        mine = self.children(prefix)
+        return [prefix + HEX[i] for i, h in enumerate(theirs) if h != EMPTY and h != mine[i]]
@@ -0,0 +1,256 @@
+"""Lightweight metrics registry and sampled trace spans for SyncNode.
+
+A `Registry` holds counters, gauges and histograms. Each metric has a fixed tuple of label
+names, and values are keyed by a tuple of label values, so recording a value is a dict update
+and no objects are created on the hot path. Gauges (and counters kept elsewhere, like
+receive drops) can be backed by a callback that is read at snapshot time.
+
+`Registry.snapshot()` returns plain dicts for JSON, `Registry.export_text()` the Prometheus
+text format, and `serve()` exposes both over HTTP for scraping.
+
+`Tracer` records spans for a sample of handled messages, per message type.
+"""
+
+import asyncio
+import json
+import math
+import random
+import time
+from bisect import bisect_left
+from collections import deque
+from typing import Dict, Optional, Sequence
+
+TRACE_CAPACITY = 1024
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+def exponential_buckets(start: float, factor: float, count: int):
+    return [start * factor ** i for i in range(count)]
+
+
+SECONDS_BUCKETS = exponential_buckets(1e-6, 2, 25)  # 1us .. ~17s
+RATE_BUCKETS = exponential_buckets(1024, 2, 22)  # 1 KiB/s .. 2 GiB/s
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, help: str = '', labels: Sequence[str] = (), fn=None):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.fn = fn  # read at snapshot time: a number, or {label values: number}
+        self.values: Dict[tuple, float] = {}
+
+    def samples(self) -> Dict[tuple, float]:
+        if self.fn is None:
+            return self.values
+        v = self.fn()
+        return v if isinstance(v, dict) else {(): v}
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, labels: tuple = (), n: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + n
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value: float, labels: tuple = ()):
+        self.values[labels] = value
+
+    def inc(self, labels: tuple = (), n: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + n
+
+    def dec(self, labels: tuple = (), n: float = 1):
+        self.values[labels] = self.values.get(labels, 0) - n
+
+
+class Histogram(Metric):
+    """Fixed upper bounds; values[labels] = [bucket counts (last is +Inf), sum, count]."""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str = '', labels: Sequence[str] = (), buckets: Sequence[float] = SECONDS_BUCKETS):
+        super().__init__(name, help, labels)
+        self.bounds = sorted(buckets)
+
+    def observe(self, value: float, labels: tuple = ()):
+        h = self.values.get(labels)
+        if h is None:
+            h = self.values[labels] = [[0] * (len(self.bounds) + 1), 0.0, 0]
+        h[0][bisect_left(self.bounds, value)] += 1
+        h[1] += value
+        h[2] += 1
+
+    def quantile(self, q: float, labels: tuple = ()) -> float:
+        """Estimate by linear interpolation inside the bucket holding the q-th observation."""
+        h = self.values.get(labels)
+        if not h or not h[2]:
+            return 0.0
+        rank = q * h[2]
+        seen = 0
+        for i, n in enumerate(h[0]):
+            if n and seen + n >= rank:
+                if i == len(self.bounds):
+                    return self.bounds[-1]
+                lo = self.bounds[i - 1] if i else 0.0
+                return lo + (self.bounds[i] - lo) * (rank - seen) / n
+            seen += n
+        return self.bounds[-1]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def _get(self, cls, name, *args, **kwargs):
+        m = self.metrics.get(name)
+        if m is None:
+            m = self.metrics[name] = cls(name, *args, **kwargs)
+        elif not isinstance(m, cls):
+            raise ValueError(f'metric {name} already registered as a {m.kind}')
+        return m
+
+    def counter(self, name: str, help: str = '', labels: Sequence[str] = (), fn=None) -> Counter:
+        return self._get(Counter, name, help, labels, fn)
+
+    def gauge(self, name: str, help: str = '', labels: Sequence[str] = (), fn=None) -> Gauge:
+        return self._get(Gauge, name, help, labels, fn)
+
+    def histogram(self, name: str, help: str = '', labels: Sequence[str] = (),
+                  buckets: Sequence[float] = SECONDS_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, help, labels, buckets)
+
+    def snapshot(self) -> dict:
+        """{name: {type, help, samples: [{labels, value}]}}; histogram samples carry count, sum and quantiles."""
+        out = {}
+        for m in self.metrics.values():
+            samples = []
+            for key, v in list(m.samples().items()):
+                s = {'labels': dict(zip(m.labels, key))}
+                if isinstance(m, Histogram):
+                    s.update(count=v[2], sum=v[1])
+                    for q in QUANTILES:
+                        s[f'p{int(q * 100)}'] = m.quantile(q, key)
+                else:
+                    s['value'] = v
+                samples.append(s)
+            out[m.name] = {'type': m.kind, 'help': m.help, 'samples': samples}
+        return out
+
+    def export_text(self) -> str:
+        """Prometheus text exposition format (0.0.4)."""
+        lines = []
+        for m in self.metrics.values():
+            lines.append(f'# HELP {m.name} {m.help}')
+            lines.append(f'# TYPE {m.name} {m.kind}')
+            for key, v in list(m.samples().items()):
+                labels = list(zip(m.labels, key))
+                if not isinstance(m, Histogram):
+                    lines.append(f'{m.name}{_labels(labels)} {_num(v)}')
+                    continue
+                cumulative = 0
+                for bound, n in zip(m.bounds + [math.inf], v[0]):
+                    cumulative += n
+                    lines.append(f'{m.name}_bucket{_labels(labels + [("le", bound)])} {cumulative}')
+                lines.append(f'{m.name}_sum{_labels(labels)} {_num(v[1])}')
+                lines.append(f'{m.name}_count{_labels(labels)} {v[2]}')
+        return '\n'.join(lines) + '\n'
+
+
+def _num(v) -> str:
+    if v == math.inf:
+        return '+Inf'
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+def _labels(pairs) -> str:
+    if not pairs:
+        return ''
+    esc = lambda s: str(s).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{k}="{_num(v) if isinstance(v, float) else esc(v)}"' for k, v in pairs) + '}'
+
+
+class Span:
+    __slots__ = ('name', 'peer', 'start', 'wall', 'duration', 'error')
+
+    def __init__(self, name: str, peer):
+        self.name = name
+        self.peer = peer
+        self.start = time.perf_counter()
+        self.wall = time.time()
+        self.duration = None
+        self.error = None
+
+    def to_dict(self) -> dict:
+        return {'name': self.name, 'peer': self.peer, 'ts': self.wall,
+                'duration_ms': round(self.duration * 1000, 3), 'error': self.error}
+
+
+class Tracer:
+    """Sampled spans around message handling.
+
+    `rate` is the fraction of messages traced, `rates` overrides it per message type
+    (e.g. {'CHUNK': 0.01, 'HELLO': 1.0}). With neither set, `start` returns None at once.
+    Finished spans are kept in a ring of `capacity`.
+    """
+
+    def __init__(self, rate: float = 0.0, rates: Optional[Dict[str, float]] = None, capacity: int = TRACE_CAPACITY):
+        self.rate = rate
+        self.rates = dict(rates or {})
+        self.spans = deque(maxlen=capacity)
+        self._rng = random.Random()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.rate or self.rates)
+
+    def start(self, name: str, peer=None) -> Optional[Span]:
+        if not (self.rate or self.rates):
+            return None
+        r = self.rates.get(name, self.rate)
+        if r <= 0 or (r < 1 and self._rng.random() >= r):
+            return None
+        return Span(name, peer)
+
+    def finish(self, span: Span, error: BaseException = None):
+        span.duration = time.perf_counter() - span.start
+        if error is not None:
+            span.error = repr(error)
+        self.spans.append(span)
+
+    def snapshot(self) -> list:
+        return [s.to_dict() for s in self.spans]
+
+
+async def serve(registry: Registry, host: str = '127.0.0.1', port: int = 9464, tracer: Tracer = None):
+    """Minimal HTTP endpoint: GET /metrics (text), /metrics.json (snapshot) and /traces (spans)."""
+
+    async def handle(reader, writer):
+        try:
+            line = await reader.readline()
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            parts = line.decode('latin-1').split()
+            path = parts[1] if len(parts) > 1 else '/'
+            status, ctype = '200 OK', 'application/json'
+            if path == '/metrics':
+                body, ctype = registry.export_text(), 'text/plain; version=0.0.4'
+            elif path == '/metrics.json':
+                body = json.dumps(registry.snapshot())
+            elif path == '/traces' and tracer is not None:
+                body = json.dumps(tracer.snapshot())
+            else:
+                status, body, ctype = '404 Not Found', 'not found\n', 'text/plain'
+            data = body.encode('utf-8')
+            writer.write(f'HTTP/1.1 {status}\r\nContent-Type: {ctype}\r\nContent-Length: {len(data)}\r\n'
+                         f'Connection: close\r\n\r\n'.encode('latin-1') + data)
+            await writer.drain()
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
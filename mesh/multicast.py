@@ -0,0 +1,82 @@
+"""One-to-many object distribution over IP multicast.
+
+`SyncNode.distribute(object_id)` sends an object once to a multicast group instead of once
+per peer, e.g. a firmware bundle to every device in a room. Peers that list `mcast1` in
+HELLO/DIGESTS and share a session with the sender take part:
+
+  1. MCAST_OFFER { id, version, size, hash, group: [ip, port], key_id, key } goes to each peer
+     over its session, up to OFFER_TRIES times until it answers. A peer without that version
+     joins the group and starts an incoming transfer from the sender that sends no REQUESTs.
+     It answers MCAST_JOIN { key_id, join, loss }, where `loss` is the loss it measured from
+     the sender. A peer that holds the version, or has no room for it, answers join false.
+  2. Once every peer has answered, or JOIN_WAIT has passed, the sender streams each chunk once
+     to the group, paced at `rate`. Each coding group of chunks (mesh.fec) is followed by
+     repair symbols, as many as `repair_count` gives for the highest loss any member reported
+     and the number of members; a single repair symbol fixes a different lost chunk at each
+     member at once.
+  3. MCAST_END { key_id } ends the stream, on the group and to each member over its session. A
+     member then leaves the group and requests the chunks it still misses from the sender,
+     by unicast, like any transfer: the REQUEST is the NACK. A member that hears nothing for
+     IDLE_TIMEOUT does the same.
+
+Group traffic is sealed with a fresh `crypto.GroupKey` per distribution. The key only travels
+inside the pairwise sessions, so only offered peers can read the stream or inject into it.
+GROUP frame: binary header with type T_GROUP, index = key id, payload = nonce | AES-GCM of a
+CHUNK, REPAIR or MCAST_END frame. Any member holds the key, so the group key alone does not prove the
+data came from the sender. The object hash from the OFFER does: it arrived over the sender's
+session and is checked before the object is stored; a copy that fails it is fetched again from
+the sender by unicast. Chunks are sent uncompressed, as members
+may support different codecs.
+"""
+
+import math
+import socket
+import struct
+
+from . import fec
+
+CAP_MULTICAST = 'mcast1'
+DEFAULT_GROUP = ('239.255.77.1', 9100)  # organization-local scope, away from discovery's 224.0.0.251:9999
+RATE = 1024 * 1024  # bytes/s of the group stream; multicast gets no congestion feedback
+BURST = 16 * 1024
+JOIN_WAIT = 1.0  # seconds the sender waits for answers to its offers
+OFFER_TRIES = 3  # offers sent to a peer that does not answer, spread over JOIN_WAIT
+IDLE_TIMEOUT = 3.0  # seconds without group traffic after which a member stops waiting for it
+MIN_REPAIR = 1  # repair symbols per coding group however clean the members' links look
+NACK_GROUPS = 0.5  # members expected to miss chunks of one coding group after its repair symbols
+DRAIN_POLL = 0.01  # seconds between checks that the stream has left the send queue
+TTL = 1  # multicast hops: the local network only
+
+
+def repair_count(loss: float, members: int, k: int = fec.GROUP) -> int:
+    """Repair symbols per group of `k` chunks so that on average at most NACK_GROUPS of `members` members,
+    each losing `loss` of the datagrams, still miss chunks of the group."""
+    for r in range(MIN_REPAIR, fec.MAX_REPAIR):
+        n = k + r
+        decoded = sum(math.comb(n, i) * loss ** i * (1 - loss) ** (n - i) for i in range(r + 1))
+        if members * (1 - decoded) <= NACK_GROUPS:
+            return r
+    return fec.MAX_REPAIR
+
+
+def group_socket(group, interface: str) -> socket.socket:
+    """UDP socket receiving what is sent to `group` (ip, port) on the interface with address `interface`."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(('', group[1]))
+    mreq = struct.pack('4s4s', socket.inet_aton(group[0]), socket.inet_aton(interface))
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+    sock.setblocking(False)
+    return sock
+
+
+async def listen(loop, group, interface: str, protocol_factory):
+    """Datagram endpoint for the members' side of `group`; mesh.simnet swaps in its own."""
+    return await loop.create_datagram_endpoint(protocol_factory, sock=group_socket(group, interface))
+
+
+def set_ttl(transport, ttl: int = TTL):
+    """Keep datagrams the node sends to a group on the local network."""
+    sock = transport.get_extra_info('socket')
+    if sock is not None:
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, struct.pack('b', ttl))
@@ -0,0 +1,111 @@
+"""Streaming reads of objects held or being fetched by a SyncNode.
+
+`SyncNode.open_object(oid)` returns an `ObjectReader`: an async iterator over the object's
+bytes, in order, in pieces of at most `block_size`. For a stored object the pieces come
+straight from storage. For an object still being fetched they come from the transfer's
+reassembly buffer as soon as the chunks are in, so an application can start on a large
+object long before the last chunk arrives and never holds more than a piece of it.
+
+Pieces read from a transfer have passed the per-chunk checks (length, and CRC32 where the
+peer sends one). The SHA-256 of the whole object can only be checked once every chunk is in;
+if that check fails, or a newer version replaces the one being read, the next read raises
+ReadError and the application should throw away what it got.
+"""
+
+import asyncio
+from typing import Optional
+
+READ_BLOCK = 64 * 1024  # largest piece returned by one read
+
+
+class ReadError(Exception):
+    pass
+
+
+class ObjectReader:
+    """Async iterator over the bytes of one version of an object; see the module docstring."""
+
+    def __init__(self, node, oid: str, block_size: int = READ_BLOCK):
+        self.node = node
+        self.oid = oid
+        self.block_size = block_size
+        self.version: Optional[int] = None  # pinned once the object is stored or its transfer starts
+        self.offset = 0
+        self.done = False
+        self._event = asyncio.Event()
+        node._readers.setdefault(oid, set()).add(self._event)
+        self._pin()
+        if self.version is None and oid not in node.fetches and oid not in node._delta_wait:
+            self.close()
+            raise KeyError(oid)
+
+    def _pin(self):
+        t = self.node.pending.get(self.oid)
+        if t is not None:
+            self.version = t.version
+        elif self.oid in self.node.storage:
+            self.version = self.node.storage.version(self.oid)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> bytes:
+        data = await self.read()
+        if not data:
+            raise StopAsyncIteration
+        return data
+
+    async def read(self) -> bytes:
+        """The next piece; b'' at the end of the object."""
+        while not self.done:
+            data = self._next()
+            if data is not None:
+                return data
+            self._event.clear()
+            await self._event.wait()
+        return b''
+
+    def _next(self) -> Optional[bytes]:
+        """A piece if one is available now, b'' at the end, None to wait for more."""
+        node, oid = self.node, self.oid
+        if self.version is None:
+            self._pin()
+            if self.version is None:
+                if oid in node.fetches or oid in node._delta_wait:
+                    return None
+                self.close()
+                raise ReadError(f'{oid} is no longer being fetched')
+        storage = node.storage
+        stored = storage.version(oid) if oid in storage else None
+        t = node.pending.get(oid)
+        if stored == self.version:
+            size = storage.size(oid)
+            if self.offset >= size:
+                self.close()
+                return b''
+            data = bytes(storage.read(oid, self.offset, self.block_size))
+            self.offset += len(data)
+            return data
+        if (stored is not None and stored > self.version) or (t is not None and t.version != self.version):
+            self.close()
+            raise ReadError(f'{oid} v{self.version} was replaced while reading')
+        if t is None:
+            self.close()
+            raise ReadError(f'transfer of {oid} v{self.version} failed')
+        if t.size is None or self.offset >= t.size:
+            return None  # unsized: offsets are only known once complete; at the end: wait for the hash check
+        idx = self.offset // t.chunk_size
+        count = min(t.contiguous(idx), max(1, self.block_size // t.chunk_size))
+        if not count:
+            return None
+        data = t.buf.read_at(self.offset, min(count * t.chunk_size, t.size - self.offset))
+        self.offset += len(data)
+        return data
+
+    def close(self):
+        self.done = True
+        readers = self.node._readers.get(self.oid)
+        if readers is not None:
+            readers.discard(self._event)
+            if not readers:
+                del self.node._readers[self.oid]
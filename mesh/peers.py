@@ -0,0 +1,68 @@
+"""Per-peer link quality estimates, used to pick peers for transfers and reconciliation.
+
+Each peer in `SyncNode.peers` gets a `PeerQuality` under 'quality'. It is fed from traffic the
+node exchanges anyway, with no probe messages of its own:
+  - RTT: chunk request -> chunk (Karn's rule applies), HELLO -> DIGESTS/TREE answer
+  - loss: chunks delivered vs chunks whose retransmit timer expired, HELLOs left unanswered
+  - throughput: per-source delivery rate of finished chunk transfers, size/time of stream fetches
+  - last seen: any message received from the peer
+
+`estimate(size)` turns these into the expected seconds to fetch `size` bytes from the peer;
+`score(size)` is its inverse (higher is better). Peers not heard from for PEER_TTL are evicted.
+"""
+
+from typing import Optional
+
+from .transfer import RTO_INITIAL, RttEstimator
+
+PEER_TTL = 120.0  # seconds without a message before a peer is evicted
+SWEEP_INTERVAL = 15.0
+LOSS_ALPHA = 1 / 32  # weight of one delivered or lost chunk in the loss average
+THROUGHPUT_ALPHA = 0.25
+DEFAULT_THROUGHPUT = 1024 * 1024  # bytes/s assumed for a peer nothing was fetched from yet
+MAX_LOSS = 0.9  # estimate() caps the loss it assumes so a bad peer still gets a finite cost
+SCORE_SIZE = 1024 * 1024  # reference transfer size for scores when the caller gives none
+
+
+class PeerQuality:
+    def __init__(self, now: Optional[float] = None):
+        self.rtt = RttEstimator()
+        self.loss = 0.0  # exponentially weighted fraction of chunks/probes lost
+        self.throughput: Optional[float] = None  # smoothed bytes/s
+        self.last_seen = now
+        self.samples = 0  # loss samples so far
+
+    def seen(self, now: float):
+        self.last_seen = now
+
+    def delivered(self, n: int = 1):
+        self.loss *= (1 - LOSS_ALPHA) ** n
+        self.samples += n
+
+    def lost(self, n: int = 1):
+        self.loss = 1 - (1 - self.loss) * (1 - LOSS_ALPHA) ** n
+        self.samples += n
+
+    def rate_sample(self, rate: float):
+        if rate <= 0:
+            return
+        if self.throughput is None:
+            self.throughput = rate
+        else:
+            self.throughput = (1 - THROUGHPUT_ALPHA) * self.throughput + THROUGHPUT_ALPHA * rate
+
+    def estimate(self, size: int = SCORE_SIZE) -> float:
+        """Expected seconds to fetch `size` bytes: a round trip plus transfer time, inflated by loss."""
+        srtt = self.rtt.srtt if self.rtt.srtt is not None else RTO_INITIAL
+        rate = self.throughput or DEFAULT_THROUGHPUT
+        return (srtt + size / rate) / (1 - min(self.loss, MAX_LOSS))
+
+    def score(self, size: int = SCORE_SIZE) -> float:
+        return 1.0 / self.estimate(size)
+
+    def to_dict(self, now: float = None) -> dict:
+        out = {'srtt': self.rtt.srtt, 'rttvar': self.rtt.rttvar, 'rto': self.rtt.rto, 'loss': round(self.loss, 4),
+               'throughput': self.throughput, 'last_seen': self.last_seen, 'score': self.score()}
+        if now is not None and self.last_seen is not None:
+            out['idle'] = now - self.last_seen
+        return out
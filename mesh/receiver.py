@@ -0,0 +1,184 @@
+"""Inbound datagram pipeline for SyncNode.
+
+`datagram_received` only classifies a datagram and appends it to its sender's inbox; it never
+decodes or spawns a task. A fixed pool of worker coroutines then drains the inboxes:
+
+  - Each peer has a control lane and a bulk lane (CHUNK data). Both are bounded, and control
+    is drained first.
+  - A peer is served by at most one worker at a time, so its messages are handled in order.
+    Workers take up to `batch` datagrams from a peer, decode them together, handle them, and
+    move on to the next peer (round robin).
+  - On overload, new bulk datagrams are dropped, and queued bulk is evicted to make room for
+    control. The receiver's retransmit timers recover dropped chunks. Memory stays bounded
+    by `max_total`.
+
+Handling latency (enqueue to handler completion) is sampled per lane for `stats()`.
+"""
+
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+from typing import Dict
+
+from . import wire
+
+LANE_CONTROL = 0
+LANE_BULK = 1
+
+WORKERS = 4
+BATCH = 32
+MAX_PEER_BULK = 1024  # bulk datagrams queued per peer
+MAX_PEER_CONTROL = 256
+MAX_QUEUED = 8192  # datagrams queued across all peers
+JSON_BULK_BYTES = 1200  # legacy JSON datagrams this large are chunk data
+LATENCY_SAMPLES = 4096
+
+log = logging.getLogger(__name__)
+
+
+def classify(data) -> int:
+    if wire.is_binary(data):
+        mtype, flags = data[2], data[3]
+        return LANE_BULK if mtype in (wire.T_CHUNK, wire.T_REPAIR) or flags & wire.F_BULK else LANE_CONTROL
+    return LANE_BULK if len(data) > JSON_BULK_BYTES else LANE_CONTROL
+
+
+def percentile(samples, p: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+
+class PeerInbox:
+    __slots__ = ('lanes', 'scheduled')
+
+    def __init__(self):
+        self.lanes = (deque(), deque())  # control, bulk: (datagram, time queued)
+        self.scheduled = False  # in the ready queue or being handled by a worker
+
+    def __len__(self):
+        return len(self.lanes[0]) + len(self.lanes[1])
+
+
+class ReceivePipeline:
+    """Bounded per-peer inboxes drained by a fixed set of workers into `node.handle_frame` / `node.handle_message`."""
+
+    def __init__(self, node, workers: int = WORKERS, batch: int = BATCH, max_total: int = MAX_QUEUED):
+        self.node = node
+        self.workers = workers
+        self.batch = batch
+        self.max_total = max_total
+        self.limits = (MAX_PEER_CONTROL, MAX_PEER_BULK)
+        self.inboxes: Dict[object, PeerInbox] = {}
+        self.total = 0
+        self.received = [0, 0]
+        self.dropped = [0, 0]
+        self.handled = 0
+        self.latency = (deque(maxlen=LATENCY_SAMPLES), deque(maxlen=LATENCY_SAMPLES))
+        self.clock = time.monotonic
+        self._ready = None
+        self._tasks = []
+
+    def start(self):
+        self._ready = asyncio.Queue()
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+
+    def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        self.inboxes.clear()
+        self.total = 0
+
+    def submit(self, data, addr):
+        if self._ready is None:
+            return
+        lane = classify(data)
+        self.received[lane] += 1
+        inbox = self.inboxes.get(addr)
+        if inbox is None:
+            inbox = self.inboxes[addr] = PeerInbox()
+        if len(inbox.lanes[lane]) >= self.limits[lane]:
+            self.dropped[lane] += 1
+            return
+        if self.total >= self.max_total and (lane == LANE_BULK or not self._evict_bulk()):
+            self.dropped[lane] += 1
+            return
+        inbox.lanes[lane].append((data, self.clock()))
+        self.total += 1
+        if not inbox.scheduled:
+            inbox.scheduled = True
+            self._ready.put_nowait(addr)
+
+    def _evict_bulk(self) -> bool:
+        """Make room for a control datagram by dropping the newest bulk datagram of the fullest inbox."""
+        victim = max(self.inboxes.values(), key=lambda i: len(i.lanes[LANE_BULK]), default=None)
+        if victim is None or not victim.lanes[LANE_BULK]:
+            return False
+        victim.lanes[LANE_BULK].pop()
+        self.total -= 1
+        self.dropped[LANE_BULK] += 1
+        return True
+
+    def _take(self, inbox: PeerInbox):
+        batch = []
+        for lane in (LANE_CONTROL, LANE_BULK):
+            q = inbox.lanes[lane]
+            while q and len(batch) < self.batch:
+                data, queued = q.popleft()
+                batch.append((lane, data, queued))
+        self.total -= len(batch)
+        return batch
+
+    def _decode(self, batch, addr):
+        """Decode a batch up front; undecodable datagrams are reported and skipped."""
+        out = []
+        for lane, data, queued in batch:
+            try:
+                if wire.is_binary(data):
+                    out.append((lane, wire.decode_frame(data), True, queued, 0))
+                else:
+                    out.append((lane, json.loads(data.decode('utf-8')), False, queued, len(data)))
+            except Exception as e:
+                log.warning('%s: invalid datagram from %s: %s', self.node.node_id, addr, e)
+        return out
+
+    async def _worker(self):
+        node = self.node
+        while True:
+            addr = await self._ready.get()
+            inbox = self.inboxes.get(addr)
+            if inbox is None:
+                continue
+            for lane, item, is_frame, queued, nbytes in self._decode(self._take(inbox), addr):
+                try:
+                    if is_frame:
+                        await node.handle_frame(item, addr)
+                    else:
+                        await node.handle_message(item, addr, nbytes)
+                except Exception:
+                    log.exception('%s: error handling datagram from %s', node.node_id, addr)
+                self.handled += 1
+                self.latency[lane].append(self.clock() - queued)
+            if len(inbox):
+                self._ready.put_nowait(addr)  # back of the line: other peers get a turn
+            else:
+                inbox.scheduled = False
+                if self.inboxes.get(addr) is inbox:
+                    del self.inboxes[addr]
+
+    def stats(self) -> dict:
+        out = {'queued': self.total, 'handled': self.handled}
+        for lane, name in ((LANE_CONTROL, 'control'), (LANE_BULK, 'bulk')):
+            samples = list(self.latency[lane])
+            out[name] = {
+                'received': self.received[lane],
+                'dropped': self.dropped[lane],
+                'p50_ms': round(percentile(samples, 0.50) * 1000, 3),
+                'p99_ms': round(percentile(samples, 0.99) * 1000, 3),
+            }
+        return out
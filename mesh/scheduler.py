@@ -0,0 +1,220 @@
+"""Outbound send scheduling for SyncNode.
+
+Every datagram goes through a `SendScheduler` instead of straight to `transport.sendto`:
+
+  - Two lanes. Control traffic (handshakes, HELLO, DIGESTS, REQUEST, ACK, ...) is sent before
+    any queued bulk CHUNK data and never waits for tokens.
+  - Token buckets, one per peer and optionally one for the whole link, pace bulk traffic.
+    Control datagrams are charged too, so they still count against the rate.
+  - Bulk queues are per peer and drained by deficit round robin, so one large transfer
+    cannot starve the others.
+  - Backpressure. When the transport's write buffer passes its high-water mark, asyncio calls
+    `pause_writing`. Bulk sending then stops, and producers waiting in `writable()` block
+    until `resume_writing`.
+
+With no rate configured and the transport writable, datagrams go out immediately, so the
+scheduler adds no latency to an idle link.
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Dict, Optional
+
+LANE_CONTROL = 0
+LANE_BULK = 1
+
+QUANTUM = 1500  # bytes a peer may send per round-robin turn
+MAX_BULK_QUEUE = 256  # datagrams queued per peer before producers are paused
+WRITE_HIGH_WATER = 256 * 1024  # transport write buffer size that triggers pause_writing
+DEFAULT_BURST = 64 * 1024
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int = DEFAULT_BURST, now: float = None):
+        self.rate = float(rate)
+        self.burst = burst
+        self.tokens = float(burst)
+        self.stamp = time.monotonic() if now is None else now
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def delay(self, nbytes: int, now: float) -> float:
+        """Seconds until `nbytes` may be sent (0 if now)."""
+        self._refill(now)
+        need = min(nbytes, self.burst) - self.tokens
+        return need / self.rate if need > 0 else 0.0
+
+    def take(self, nbytes: int, now: float):
+        self._refill(now)
+        self.tokens -= nbytes  # may go negative: control traffic borrows against the future
+
+
+class PeerQueue:
+    __slots__ = ('bulk', 'bucket', 'deficit', 'granted')
+
+    def __init__(self, bucket: Optional[TokenBucket]):
+        self.bulk = deque()
+        self.bucket = bucket
+        self.deficit = 0
+        self.granted = False  # quantum already added for the current round-robin turn
+
+
+class SendScheduler:
+    """Priority lanes, token-bucket pacing and fair queueing in front of a datagram transport.
+
+    `sendto(data, addr)` is called to put a datagram on the wire. `clock` is the time source
+    for pacing; SyncNode points it at its event loop's clock.
+    """
+
+    def __init__(self, sendto, rate: Optional[float] = None, peer_rate: Optional[float] = None,
+                 burst: int = DEFAULT_BURST, max_queue: int = MAX_BULK_QUEUE):
+        self.sendto = sendto
+        self.clock = time.monotonic
+        self.bucket = TokenBucket(rate, burst) if rate else None  # whole link
+        self.peer_rate = peer_rate
+        self.burst = burst
+        self.max_queue = max_queue
+        self.peers: Dict[object, PeerQueue] = {}
+        self.control = deque()  # (data, addr), FIFO across peers
+        self.active = deque()  # peers with bulk queued, in round-robin order
+        self.paused = False
+        self.closed = False
+        self.sent = [0, 0]  # datagrams per lane
+        self._timer = None
+        self._waiters = []
+
+    def _peer(self, addr) -> PeerQueue:
+        q = self.peers.get(addr)
+        if q is None:
+            q = self.peers[addr] = PeerQueue(TokenBucket(self.peer_rate, self.burst, self.clock()) if self.peer_rate else None)
+        return q
+
+    def send(self, data, addr, lane: int = LANE_CONTROL):
+        if self.closed:
+            return
+        if lane == LANE_CONTROL:
+            self.control.append((data, addr))
+        else:
+            q = self._peer(addr)
+            if not q.bulk:
+                self.active.append(addr)
+            q.bulk.append(data)
+        self._flush()
+
+    def forget(self, addr, drop: bool = False):
+        """Let go of the queue and bucket kept for `addr` once nothing is queued for it; `drop` discards what is."""
+        q = self.peers.get(addr)
+        if q is None or (q.bulk and not drop):
+            return
+        del self.peers[addr]
+        if q.bulk:
+            self.active.remove(addr)
+            self._wake()
+
+    def queued(self, addr=None) -> int:
+        """Bulk datagrams waiting, for one peer or in total."""
+        if addr is not None:
+            q = self.peers.get(addr)
+            return len(q.bulk) if q else 0
+        return sum(len(q.bulk) for q in self.peers.values())
+
+    # flow control
+
+    def pause(self):
+        self.paused = True
+
+    def resume(self):
+        self.paused = False
+        self._flush()
+        self._wake()
+
+    def congested(self, addr) -> bool:
+        if self.closed:
+            return False
+        return self.paused or self.queued(addr) >= self.max_queue
+
+    async def writable(self, addr):
+        """Wait until a bulk producer for `addr` may queue more data."""
+        while self.congested(addr):
+            fut = asyncio.get_running_loop().create_future()
+            self._waiters.append(fut)
+            await fut
+
+    def _wake(self):
+        waiters, self._waiters = self._waiters, []
+        for fut in waiters:
+            if not fut.done():
+                fut.set_result(None)
+
+    # draining
+
+    def _charge(self, q: Optional[PeerQueue], nbytes: int, now: float):
+        if self.bucket:
+            self.bucket.take(nbytes, now)
+        if q and q.bucket:
+            q.bucket.take(nbytes, now)
+
+    def _emit(self, data, addr, lane: int):
+        self.sent[lane] += 1
+        self.sendto(data, addr)
+
+    def _flush(self):
+        now = self.clock()
+        while self.control:
+            data, addr = self.control.popleft()
+            self._charge(self.peers.get(addr), len(data), now)
+            self._emit(data, addr, LANE_CONTROL)
+        wait = None
+        blocked = 0
+        while self.active and not self.paused and blocked < len(self.active):
+            addr = self.active[0]
+            q = self.peers[addr]
+            size = len(q.bulk[0])
+            delay = max(self.bucket.delay(size, now) if self.bucket else 0.0,
+                        q.bucket.delay(size, now) if q.bucket else 0.0)
+            if delay > 0:
+                wait = delay if wait is None else min(wait, delay)
+                self.active.rotate(-1)
+                blocked += 1
+                continue
+            blocked = 0
+            if not q.granted:
+                q.deficit += QUANTUM
+                q.granted = True
+            if q.deficit < size:
+                # turn over: keep the remaining deficit for the next round
+                q.granted = False
+                self.active.rotate(-1)
+                continue
+            q.deficit -= size
+            data = q.bulk.popleft()
+            self._charge(q, size, now)
+            self._emit(data, addr, LANE_BULK)
+            if not q.bulk:
+                q.deficit = 0
+                q.granted = False
+                self.active.popleft()
+            if len(q.bulk) == self.max_queue // 2 or not q.bulk:
+                self._wake()
+        if wait is not None and self._timer is None:
+            try:
+                self._timer = asyncio.get_running_loop().call_later(wait, self._on_timer)
+            except RuntimeError:
+                pass
+
+    def _on_timer(self):
+        self._timer = None
+        self._flush()
+
+    def close(self):
+        self.closed = True
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        self.control.clear()
+        self.active.clear()
+        self.peers.clear()
+        self._wake()
@@ -0,0 +1,485 @@
+"""In-process simulated network for SyncNode, driven by a virtual clock.
+
+`SimNetwork` runs unmodified SyncNodes inside a `SimLoop`: an asyncio event loop whose
+clock only moves when there is nothing left to run, jumping straight to the next timer.
+`loop.create_datagram_endpoint` hands out `SimTransport`s instead of UDP sockets, so
+`SyncNode.start()` works as usual, and `SimDiscovery` replaces multicast discovery. Multicast
+groups for `SyncNode.distribute()` are joined through `SimNetwork.listen_group`; a datagram sent
+to a group leaves its sender once and reaches each member over its own link.
+
+Datagrams are routed between hosts (IP strings) over links with:
+  - latency + uniform jitter (seconds)
+  - bandwidth (bytes/s, serialized per directed link; None = unlimited)
+  - loss (probability per datagram) and reorder (probability of an extra random delay)
+  - mtu (larger datagrams are dropped; per link, or the network's)
+With `tick` set, deliveries due within the same tick fire together from one timer, in the order
+they were sent, and arrive up to `tick` late; large meshes then run several times fewer loop
+iterations. Each node can also have an uplink rate; its write buffer then fills and the node sees
+pause_writing/resume_writing like on a real socket. `partition()` splits hosts into groups
+that cannot reach each other until `heal()`.
+
+All randomness (loss, jitter, discovery timing, SyncNode tie-breaks) comes from `seed`, so a
+run is repeatable in one process. String hashing is randomized per process; set
+PYTHONHASHSEED for identical runs across processes.
+
+    net = SimNetwork(seed=1, latency=0.02, loss=0.01)
+    nodes = [net.add_node() for _ in range(1000)]
+    net.run(main())  # a coroutine that starts the nodes and awaits asyncio.sleep() / node state
+"""
+
+import asyncio
+import math
+import random
+import selectors
+from collections import Counter as Tally
+from typing import Dict, Optional
+
+from .async_sync import SyncNode
+from .discovery import ANNOUNCE_INTERVAL, MCAST_PORT, MIN_ANNOUNCE_GAP
+
+SYNC_PORT = 9000
+DEFAULT_MTU = 65507
+DEFAULT_SEGMENT = 'lan0'
+
+
+class SimulationStalled(RuntimeError):
+    """Nothing is ready or scheduled, but the simulation was asked to keep running."""
+
+
+class _VirtualSelector(selectors.BaseSelector):
+    """No real I/O ever happens: `select` advances the loop's clock to the next timer."""
+
+    def __init__(self):
+        self.loop = None
+        self._map = {}
+
+    def register(self, fileobj, events, data=None):
+        fd = fileobj if isinstance(fileobj, int) else fileobj.fileno()
+        key = self._map[fd] = selectors.SelectorKey(fileobj, fd, events, data)
+        return key
+
+    def unregister(self, fileobj):
+        fd = fileobj if isinstance(fileobj, int) else fileobj.fileno()
+        return self._map.pop(fd)
+
+    def select(self, timeout=None):
+        if timeout is None:
+            raise SimulationStalled('no runnable callbacks and no timers')
+        if timeout > 0:
+            self.loop._now = self.loop._scheduled[0]._when
+        return []
+
+    def get_map(self):
+        return self._map
+
+    def close(self):
+        self._map.clear()
+
+
+class SimLoop(asyncio.SelectorEventLoop):
+    def __init__(self, network: 'SimNetwork'):
+        selector = _VirtualSelector()
+        super().__init__(selector)
+        selector.loop = self
+        self.network = network
+        self._now = 0.0
+
+    def time(self) -> float:
+        return self._now
+
+    def _write_to_self(self):
+        pass  # select never blocks, so there is nothing to wake
+
+    async def create_datagram_endpoint(self, protocol_factory, local_addr=None, remote_addr=None, **kwargs):
+        return self.network.bind(protocol_factory, local_addr)
+
+
+class Link:
+    __slots__ = ('latency', 'jitter', 'bandwidth', 'loss', 'reorder', 'mtu', 'busy_until')
+
+    def __init__(self, latency: float = 0.001, jitter: float = 0.0, bandwidth: Optional[float] = None,
+                 loss: float = 0.0, reorder: float = 0.0, mtu: Optional[int] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.loss = loss
+        self.reorder = reorder
+        self.mtu = mtu  # None: the network's
+        self.busy_until = 0.0
+
+    def copy(self, **changes) -> 'Link':
+        link = Link(self.latency, self.jitter, self.bandwidth, self.loss, self.reorder, self.mtu)
+        for k, v in changes.items():
+            setattr(link, k, v)
+        return link
+
+
+class SimTransport(asyncio.DatagramTransport):
+    def __init__(self, network: 'SimNetwork', addr, protocol):
+        super().__init__()
+        self.network = network
+        self.addr = addr
+        self.protocol = protocol
+        self.uplink: Optional[float] = None  # bytes/s; None = unlimited
+        self.busy_until = 0.0
+        self.high = 64 * 1024
+        self.low = 16 * 1024
+        self.paused = False
+        self.group = None  # multicast group this endpoint receives, if any
+        self._closing = False
+
+    def get_extra_info(self, name, default=None):
+        return self.addr if name == 'sockname' else default
+
+    def set_write_buffer_limits(self, high=None, low=None):
+        self.high = 64 * 1024 if high is None else high
+        self.low = self.high // 4 if low is None else low
+
+    def get_write_buffer_size(self) -> int:
+        if not self.uplink:
+            return 0
+        return int(max(0.0, self.busy_until - self.network.loop.time()) * self.uplink)
+
+    def sendto(self, data, addr=None):
+        if self._closing:
+            return
+        now = self.network.loop.time()
+        depart = now
+        if self.uplink:
+            depart = self.busy_until = max(now, self.busy_until) + len(data) / self.uplink
+            if not self.paused and self.get_write_buffer_size() > self.high:
+                self.paused = True
+                self.protocol.pause_writing()
+                self.network.loop.call_at(self.busy_until - self.low / self.uplink, self._resume)
+        self.network.send(self.addr, addr, bytes(data), depart)
+
+    def _resume(self):
+        if self.paused and not self._closing:
+            self.paused = False
+            self.protocol.resume_writing()
+
+    def is_closing(self) -> bool:
+        return self._closing
+
+    def close(self):
+        if self._closing:
+            return
+        self._closing = True
+        self.network.unbind(self.addr, self)
+        self.network.loop.call_soon(self.protocol.connection_lost, None)
+
+    def abort(self):
+        self.close()
+
+
+class SimDiscovery:
+    """Stands in for mesh.discovery.DiscoveryService: announces to the hosts sharing a segment."""
+
+    def __init__(self, network: 'SimNetwork', node_id: str, metadata: dict = None, on_update=None):
+        self.network = network
+        self.node_id = node_id
+        self.metadata = metadata or {}
+        self.on_update = on_update
+        self.running = False
+        self._timer = None
+        self._last = None
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.network.discovery_services[self.node_id] = self
+        net = self.network
+        self._timer = net.loop.call_later(net.rng.uniform(0, net.announce_interval), self._announce)
+
+    def stop(self):
+        self.running = False
+        self.network.discovery_services.pop(self.node_id, None)
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+
+    def announce_now(self):
+        if not self.running:
+            return
+        net = self.network
+        if self._timer:
+            self._timer.cancel()
+        at = net.loop.time() if self._last is None else max(net.loop.time(), self._last + MIN_ANNOUNCE_GAP)
+        self._timer = net.loop.call_at(at, self._announce)
+
+    def _announce(self):
+        net = self.network
+        self._last = net.loop.time()
+        host = net.hosts[self.node_id]
+        msg = {'node_id': self.node_id, 'ts': net.loop.time(), 'meta': self.metadata}
+        for other in net.neighbours(self.node_id):
+            svc = net.discovery_services.get(other)
+            if svc is None:
+                continue
+            arrive = net.route(host, net.hosts[other], 128, net.loop.time())
+            if arrive is not None:
+                net.at(arrive, svc._deliver, msg, (host, MCAST_PORT))
+        interval = net.announce_interval
+        self._timer = net.loop.call_later(net.rng.uniform(0.9 * interval, 1.1 * interval), self._announce)
+
+    def _deliver(self, msg, addr):
+        if self.running and self.on_update:
+            self.on_update(msg, addr)
+
+
+class SimNetwork:
+    def __init__(self, seed: int = 0, latency: float = 0.001, jitter: float = 0.0, bandwidth: Optional[float] = None,
+                 loss: float = 0.0, reorder: float = 0.0, mtu: int = DEFAULT_MTU,
+                 announce_interval: float = ANNOUNCE_INTERVAL, tick: float = 0.0):
+        self.rng = random.Random(seed)
+        self.default = Link(latency, jitter, bandwidth, loss, reorder)
+        self.mtu = mtu
+        self.announce_interval = announce_interval
+        self.tick = tick  # seconds; 0 = every delivery at its exact time
+        self._due: Dict[int, list] = {}  # tick number -> (callback, args) of the deliveries it fires
+        self.loop = SimLoop(self)
+        self.links: Dict[tuple, Link] = {}  # (src host, dst host) -> Link, for overrides and bandwidth state
+        self.endpoints = {}  # addr -> SimTransport
+        self.nodes: Dict[str, SyncNode] = {}
+        self.uplinks = {}  # addr -> uplink bytes/s
+        self.hosts: Dict[str, str] = {}  # node_id -> host
+        self.segments: Dict[str, list] = {}  # segment -> node ids (discovery scope)
+        self.node_segments: Dict[str, tuple] = {}
+        self.discovery_services: Dict[str, SimDiscovery] = {}
+        self.groups: Optional[Dict[str, int]] = None  # host -> partition group
+        self.members: Dict[tuple, list] = {}  # multicast group (ip, port) -> SimTransports of the hosts that joined
+        self.stats = Tally()
+
+    # topology
+
+    def add_node(self, host: str = None, port: int = SYNC_PORT, segments=(DEFAULT_SEGMENT,), uplink: float = None,
+                 **kwargs) -> SyncNode:
+        """Create a SyncNode on `host` (10.x.y.z by default); `segments` scope its discovery announcements."""
+        n = len(self.nodes)
+        host = host or f'10.{(n >> 16) & 255}.{(n >> 8) & 255}.{n & 255}'
+        kwargs.setdefault('node_id', f'sim{n}')
+        kwargs.setdefault('seed', self.rng.random())
+        node = SyncNode(host, port, **kwargs)
+        node.listen_group = self.listen_group
+        self.uplinks[(host, port)] = uplink
+        self.nodes[node.node_id] = node
+        self.hosts[node.node_id] = host
+        self.node_segments[node.node_id] = tuple(segments)
+        for seg in segments:
+            self.segments.setdefault(seg, []).append(node.node_id)
+        return node
+
+    def neighbours(self, node_id: str):
+        seen = set()
+        for seg in self.node_segments.get(node_id, ()):
+            for other in self.segments[seg]:
+                if other != node_id and other not in seen:
+                    seen.add(other)
+                    yield other
+
+    def link(self, a: str, b: str, symmetric: bool = True, **params):
+        """Override link parameters (latency, jitter, bandwidth, loss, reorder, mtu) between hosts a and b."""
+        for src, dst in ((a, b), (b, a)) if symmetric else ((a, b),):
+            self.links[(src, dst)] = self._link(src, dst).copy(**params)
+
+    def _link(self, src: str, dst: str) -> Link:
+        link = self.links.get((src, dst))
+        if link is None:
+            link = self.default
+            if link.bandwidth:
+                # serialization state is per directed link
+                link = self.links[(src, dst)] = link.copy()
+        return link
+
+    def partition(self, *groups):
+        """Split hosts into groups that cannot reach each other; hosts not listed form one more group."""
+        self.groups = {host: i for i, group in enumerate(groups) for host in group}
+
+    def heal(self):
+        self.groups = None
+
+    # datagrams
+
+    def bind(self, protocol_factory, local_addr):
+        if local_addr in self.endpoints:
+            raise OSError(f'address already in use: {local_addr}')
+        protocol = protocol_factory()
+        transport = SimTransport(self, local_addr, protocol)
+        transport.uplink = self.uplinks.get(tuple(local_addr))
+        self.endpoints[tuple(local_addr)] = transport
+        protocol.connection_made(transport)
+        return transport, protocol
+
+    def unbind(self, addr, transport=None):
+        if transport is not None and transport.group is not None:
+            members = self.members.get(transport.group, [])
+            if transport in members:
+                members.remove(transport)
+            return
+        self.endpoints.pop(tuple(addr), None)
+
+    async def listen_group(self, loop, group, interface: str, protocol_factory):
+        """Stands in for mesh.multicast.listen: `interface` (the node's host) receives what is sent to `group`."""
+        protocol = protocol_factory()
+        transport = SimTransport(self, (interface, group[1]), protocol)
+        transport.group = tuple(group)
+        self.members.setdefault(transport.group, []).append(transport)
+        protocol.connection_made(transport)
+        return transport, protocol
+
+    def route(self, src: str, dst: str, size: int, depart: float) -> Optional[float]:
+        """Arrival time of a datagram leaving `src` at `depart`, or None if it is dropped."""
+        link = self._link(src, dst)
+        if size > (link.mtu or self.mtu):
+            self.stats['dropped_mtu'] += 1
+            return None
+        if self.groups is not None and self.groups.get(src, -1) != self.groups.get(dst, -1):
+            self.stats['dropped_partition'] += 1
+            return None
+        if link.loss and self.rng.random() < link.loss:
+            self.stats['dropped_loss'] += 1
+            return None
+        if link.bandwidth:
+            depart = link.busy_until = max(depart, link.busy_until) + size / link.bandwidth
+        arrive = depart + link.latency
+        if link.jitter:
+            arrive += self.rng.uniform(0, link.jitter)
+        if link.reorder and self.rng.random() < link.reorder:
+            arrive += self.rng.uniform(0, 2 * link.latency + 0.001)
+            self.stats['reordered'] += 1
+        return arrive
+
+    def send(self, src_addr, dst_addr, data: bytes, depart: float):
+        self.stats['sent'] += 1
+        members = self.members.get(tuple(dst_addr))
+        if members is not None:
+            self.stats['multicast'] += 1
+            for transport in members:
+                if transport.addr[0] != src_addr[0]:
+                    arrive = self.route(src_addr[0], transport.addr[0], len(data), depart)
+                    if arrive is not None:
+                        self.at(arrive, self._deliver_group, transport, data, src_addr)
+            return
+        arrive = self.route(src_addr[0], dst_addr[0], len(data), depart)
+        if arrive is not None:
+            self.at(arrive, self._deliver, tuple(dst_addr), data, src_addr)
+
+    def at(self, when: float, callback, *args):
+        """Deliver at `when`: call `callback(*args)` then, or at the end of its tick with the rest due in it."""
+        if not self.tick:
+            self.loop.call_at(when, callback, *args)
+            return
+        n = math.ceil(when / self.tick)
+        batch = self._due.get(n)
+        if batch is None:
+            batch = self._due[n] = []
+            self.loop.call_at(n * self.tick, self._fire, n)
+        batch.append((callback, args))
+
+    def _fire(self, n: int):
+        for callback, args in self._due.pop(n):
+            callback(*args)
+
+    def _deliver(self, dst_addr, data, src_addr):
+        transport = self.endpoints.get(dst_addr)
+        if transport is None:
+            self.stats['dropped_unbound'] += 1
+            return
+        self.stats['delivered'] += 1
+        transport.protocol.datagram_received(data, src_addr)
+
+    def _deliver_group(self, transport, data, src_addr):
+        if transport.is_closing():
+            return
+        self.stats['delivered'] += 1
+        transport.protocol.datagram_received(data, src_addr)
+
+    # running
+
+    def discovery(self, node_id: str, metadata: dict = None, on_update=None) -> SimDiscovery:
+        """Factory for SyncNode.start_with_discovery(service=net.discovery)."""
+        return SimDiscovery(self, node_id, metadata, on_update)
+
+    @property
+    def now(self) -> float:
+        return self.loop.time()
+
+    async def start_all(self, discovery: bool = False):
+        for node in self.nodes.values():
+            await node.start()
+            if discovery:
+                node.start_with_discovery(service=self.discovery)
+
+    def stop_all(self):
+        for node in self.nodes.values():
+            node.stop()
+
+    def run(self, coro):
+        """Run `coro` to completion in virtual time and return its result."""
+        asyncio.set_event_loop(self.loop)
+        try:
+            return self.loop.run_until_complete(coro)
+        finally:
+            asyncio.set_event_loop(None)
+
+    def close(self):
+        self.stop_all()
+        tasks = asyncio.all_tasks(self.loop)
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        self.loop.close()
+
+
+async def _scenario(net: SimNetwork, nodes, objects: int, size: int, duration: float) -> dict:
+    for i in range(objects):
+        nodes[net.rng.randrange(len(nodes))].add_object(f'obj{i}', net.rng.randbytes(size), version=1)
+    await net.start_all(discovery=True)
+    converged = None
+    while net.now < duration:
+        await asyncio.sleep(0.5)
+        if converged is None and all(len(n.storage) == objects for n in nodes):
+            converged = net.now
+    return {'converged_s': converged, 'held': sum(len(n.storage) for n in nodes), 'wanted': objects * len(nodes)}
+
+
+def main(argv=None):
+    import argparse
+    import json
+    import logging
+    import time
+
+    p = argparse.ArgumentParser(description='Simulate a mesh of SyncNodes with discovery in virtual time.')
+    p.add_argument('--nodes', type=int, default=1000)
+    p.add_argument('--segment', type=int, default=10, help='nodes per discovery segment; the first of each also joins a backbone')
+    p.add_argument('--objects', type=int, default=1)
+    p.add_argument('--size', type=int, default=64 * 1024)
+    p.add_argument('--duration', type=float, default=30.0, help='virtual seconds to run')
+    p.add_argument('--latency', type=float, default=0.01)
+    p.add_argument('--jitter', type=float, default=0.005)
+    p.add_argument('--bandwidth', type=float, default=None, help='bytes/s per link')
+    p.add_argument('--loss', type=float, default=0.01)
+    p.add_argument('--announce', type=float, default=ANNOUNCE_INTERVAL, help='discovery announcement interval (s)')
+    p.add_argument('--tick', type=float, default=0.001, help='batch deliveries into ticks of this many seconds (0: exact)')
+    p.add_argument('--seed', type=int, default=1)
+    p.add_argument('--log-level', default='ERROR')
+    args = p.parse_args(argv)
+    logging.basicConfig(level=args.log_level.upper(), format='%(message)s')
+    net = SimNetwork(args.seed, args.latency, args.jitter, args.bandwidth, args.loss, announce_interval=args.announce,
+                     tick=args.tick)
+    nodes = []
+    for i in range(args.nodes):
+        segments = [f'lan{i // args.segment}'] + (['backbone'] if i % args.segment == 0 else [])
+        nodes.append(net.add_node(segments=segments))
+    t0 = time.perf_counter()
+    result = net.run(_scenario(net, nodes, args.objects, args.size, args.duration))
+    wall = time.perf_counter() - t0
+    net.close()
+    result.update(virtual_s=args.duration, wall_s=round(wall, 3), speed=round(args.duration / wall, 3), **net.stats)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,598 @@
+"""Object stores for SyncNode.
+
+Both stores behave like the original `object_id -> (data, version)` dict and add
+`read(oid, offset, length)` returning a memoryview so chunks are served without copying,
+and `writer(oid, version)` for putting an object piece by piece (see ObjectWriter).
+
+  - MemoryStore: everything on the Python heap (the previous behaviour).
+  - LogStore: append-only log of records on disk, mmap-backed reads, an id -> (offset, length,
+    version, sha256) index checkpointed next to the log, crash recovery by scanning the log tail
+    past the last checkpoint, and compaction that can run in a background thread.
+  - CacheStore: a size-bounded LRU of recently used objects in memory in front of a LogStore;
+    objects pushed out of the cache (or too large for it) live only in the log.
+
+Log record layout (network byte order):
+  magic (4s) | flags (B) | crc32 of id+data (I) | version (I) | id length (H) | data length (Q) | sha256 (32s)
+  followed by the UTF-8 id and the data. A record with F_TOMBSTONE deletes the id.
+  A log starts with an F_HEADER record whose id is the log's generation, new with every
+  compaction. The checkpoint names the generation it indexes; one for another generation (a crash
+  after compaction replaced the log but before it checkpointed) is ignored and the log replayed.
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import zlib
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from typing import Dict, Iterator, Optional, Tuple
+
+RECORD = struct.Struct('!4sBIIHQ32s')
+RECORD_MAGIC = b'RMOB'
+F_TOMBSTONE = 0x01
+F_HEADER = 0x02
+
+LOG_NAME = 'objects.log'
+INDEX_NAME = 'objects.idx'
+CHECKPOINT_EVERY = 256  # puts between index checkpoints
+COMPACT_RATIO = 0.5  # compact when more than this fraction of the log is garbage
+COMPACT_MIN_BYTES = 1 << 20
+COPY_BLOCK = 1 << 20  # bytes per read when copying staged objects into the log
+HOT_CACHE = 64 << 20  # CacheStore: bytes of object data kept in memory
+HOT_OBJECT_FRACTION = 8  # CacheStore: objects larger than 1/8 of the cache go straight to the log
+
+
+def _check_offset(offset: int):
+    if offset < 0:
+        raise ValueError('negative read offset %d' % offset)
+
+
+def _header(generation: str) -> bytes:
+    gen = generation.encode('ascii')
+    return RECORD.pack(RECORD_MAGIC, F_HEADER, zlib.crc32(gen) & 0xFFFFFFFF, 0, len(gen), 0, bytes(32)) + gen
+
+
+def _fsync_dir(directory: str):
+    """Make a rename in `directory` durable."""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return  # directories cannot be opened on every platform
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class ObjectWriter:
+    """Incremental put: `write()` an object in pieces, then `commit()` it (or `abort()`).
+
+    Size, SHA-256 and the log CRC are computed as the data goes by, so the caller never needs
+    the whole object in memory. `sink` is where the store keeps the pieces until commit.
+    """
+
+    def __init__(self, store, oid: str, version: int, sink):
+        self.store = store
+        self.oid = oid
+        self.version = version
+        self.sink = sink
+        self.size = 0
+        self.sha = hashlib.sha256()
+        self.crc = zlib.crc32(oid.encode('utf-8'))
+
+    def write(self, data):
+        self.sink.write(data)
+        self.sha.update(data)
+        self.crc = zlib.crc32(data, self.crc)
+        self.size += len(data)
+
+    @property
+    def digest(self) -> str:
+        return self.sha.hexdigest()
+
+    def commit(self, digest: Optional[str] = None) -> bool:
+        """Store the object; if `digest` is given and does not match, discard it and return False."""
+        if digest and digest != self.digest:
+            self.abort()
+            return False
+        self.store._put_written(self)
+        self.abort()
+        return True
+
+    def abort(self):
+        close = getattr(self.sink, 'close', None)
+        if close:
+            close()
+        self.sink = None
+
+
+class MemoryStore(MutableMapping):
+    """Heap-backed store; the digest of each object is computed lazily and cached."""
+
+    def __init__(self):
+        self._objects: Dict[str, Tuple[bytes, int]] = {}
+        self._digests: Dict[str, str] = {}
+
+    def __getitem__(self, oid):
+        return self._objects[oid]
+
+    def __setitem__(self, oid, value):
+        data, version = value
+        self.put(oid, data, version)
+
+    def __delitem__(self, oid):
+        del self._objects[oid]
+        self._digests.pop(oid, None)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._objects)
+
+    def __len__(self):
+        return len(self._objects)
+
+    def put(self, oid: str, data, version: int, digest: Optional[str] = None):
+        self._objects[oid] = (bytes(data), version)
+        if digest:
+            self._digests[oid] = digest
+        else:
+            self._digests.pop(oid, None)
+
+    def writer(self, oid: str, version: int) -> ObjectWriter:
+        return ObjectWriter(self, oid, version, _BytesSink())
+
+    def _put_written(self, w: ObjectWriter):
+        self._objects[w.oid] = (bytes(w.sink.buf), w.version)
+        self._digests[w.oid] = w.digest
+
+    def version(self, oid: str) -> int:
+        return self._objects[oid][1]
+
+    def size(self, oid: str) -> int:
+        return len(self._objects[oid][0])
+
+    def digest(self, oid: str) -> str:
+        d = self._digests.get(oid)
+        if d is None:
+            d = self._digests[oid] = hashlib.sha256(self._objects[oid][0]).hexdigest()
+        return d
+
+    def read(self, oid: str, offset: int = 0, length: Optional[int] = None) -> memoryview:
+        _check_offset(offset)
+        view = memoryview(self._objects[oid][0])
+        return view[offset:] if length is None else view[offset:offset + length]
+
+    def versions(self) -> Iterator[Tuple[str, int]]:
+        return ((oid, ver) for oid, (_, ver) in self._objects.items())
+
+    def close(self):
+        pass
+
+
+class _BytesSink:
+    def __init__(self):
+        self.buf = bytearray()
+
+    def write(self, data):
+        self.buf += data
+
+    def close(self):
+        self.buf = None
+
+
+class LogStore(MutableMapping):
+    """Append-only, log-structured object store in `directory`.
+
+    Opening the store reads only the index checkpoint and the log records appended after it;
+    object bytes stay on disk and are handed out as memoryviews into an mmap of the log.
+    """
+
+    def __init__(self, directory: str, sync: bool = False):
+        self.directory = directory
+        self.sync = sync  # fsync after every put
+        os.makedirs(directory, exist_ok=True)
+        self.log_path = os.path.join(directory, LOG_NAME)
+        self.index_path = os.path.join(directory, INDEX_NAME)
+        self.index: Dict[str, Tuple[int, int, int, str]] = {}  # oid -> (data offset, length, version, sha256 hex)
+        self.live_bytes = 0
+        self._lock = threading.RLock()
+        self._compacting = False
+        self._since_checkpoint = 0
+        self._mm = None
+        self._mm_size = 0
+        if not os.path.exists(self.log_path):
+            open(self.log_path, 'wb').close()
+        self._f = open(self.log_path, 'r+b')
+        self.generation = self._read_generation()  # None: a log written before generations
+        self._end = self._recover()
+        self._f.truncate(self._end)
+        if self._end == 0:
+            self.generation = os.urandom(8).hex()
+            self._f.write(_header(self.generation))
+            self._end = RECORD.size + len(self.generation)
+            self._f.flush()
+
+    # recovery
+
+    def _read_generation(self) -> Optional[str]:
+        self._f.seek(0)
+        head = self._f.read(RECORD.size)
+        if len(head) < RECORD.size:
+            return None
+        magic, flags, _, _, id_len, _, _ = RECORD.unpack(head)
+        if magic != RECORD_MAGIC or not flags & F_HEADER:
+            return None
+        return self._f.read(id_len).decode('ascii')
+
+    def _load_checkpoint(self) -> int:
+        try:
+            with open(self.index_path) as f:
+                cp = json.load(f)
+        except (OSError, ValueError):
+            return 0
+        if cp.get('generation') != self.generation:
+            return 0  # indexes a log that has been replaced since
+        self.index = {oid: tuple(e) for oid, e in cp['entries'].items()}
+        return int(cp['log_end'])
+
+    def _recover(self) -> int:
+        """Load the checkpoint, then replay valid records after it; stop at the first torn record."""
+        start = self._load_checkpoint()
+        size = os.fstat(self._f.fileno()).st_size
+        if start > size:
+            # checkpoint newer than the log (log replaced underneath us): rebuild from scratch
+            self.index, start = {}, 0
+        end = self._replay(start, size)
+        self.live_bytes = sum(RECORD.size + len(oid.encode('utf-8')) + e[1] for oid, e in self.index.items())
+        return end
+
+    def _replay(self, pos: int, size: int, f=None, index=None) -> int:
+        f = f or self._f
+        index = self.index if index is None else index
+        while pos + RECORD.size <= size:
+            f.seek(pos)
+            head = f.read(RECORD.size)
+            magic, flags, crc, version, id_len, length, digest = RECORD.unpack(head)
+            end = pos + RECORD.size + id_len + length
+            if magic != RECORD_MAGIC or end > size:
+                break
+            body = f.read(id_len + length)
+            if zlib.crc32(body) & 0xFFFFFFFF != crc:
+                break
+            oid = body[:id_len].decode('utf-8')
+            if flags & F_HEADER:
+                pass
+            elif flags & F_TOMBSTONE:
+                index.pop(oid, None)
+            else:
+                index[oid] = (pos + RECORD.size + id_len, length, version, digest.hex())
+            pos = end
+        return pos
+
+    def checkpoint(self):
+        with self._lock:
+            self._f.flush()
+            os.fsync(self._f.fileno())
+            tmp = self.index_path + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump({'generation': self.generation, 'log_end': self._end, 'entries': self.index}, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.index_path)
+            _fsync_dir(self.directory)
+            self._since_checkpoint = 0
+
+    # mapping interface
+
+    def __getitem__(self, oid):
+        with self._lock:  # as in read(): the index and the map must come from the same log
+            e = self.index[oid]
+            return self._view(e[0], e[1]), e[2]
+
+    def __setitem__(self, oid, value):
+        data, version = value
+        self.put(oid, data, version)
+
+    def __delitem__(self, oid):
+        with self._lock:
+            if oid not in self.index:
+                raise KeyError(oid)
+            self._append(oid, b'', 0, bytes(32), F_TOMBSTONE)
+            e = self.index.pop(oid)
+            self.live_bytes -= RECORD.size + len(oid.encode('utf-8')) + e[1]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self.index))
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, oid):
+        return oid in self.index
+
+    # store interface
+
+    def _append(self, oid: str, data, version: int, digest: bytes, flags: int = 0) -> int:
+        oid_b = oid.encode('utf-8')
+        crc = zlib.crc32(data, zlib.crc32(oid_b)) & 0xFFFFFFFF
+        head = RECORD.pack(RECORD_MAGIC, flags, crc, version, len(oid_b), len(data), digest)
+        pos = self._end
+        self._f.seek(pos)
+        self._f.write(head)
+        self._f.write(oid_b)
+        self._f.write(data)
+        self._end = pos + len(head) + len(oid_b) + len(data)
+        self._f.flush()
+        if self.sync:
+            os.fsync(self._f.fileno())
+        return pos + len(head) + len(oid_b)
+
+    def put(self, oid: str, data, version: int, digest: Optional[str] = None):
+        digest_b = bytes.fromhex(digest) if digest else hashlib.sha256(data).digest()
+        with self._lock:
+            offset = self._append(oid, data, version, digest_b)
+            self._indexed(oid, offset, len(data), version, digest_b.hex())
+
+    def _indexed(self, oid: str, offset: int, length: int, version: int, digest: str):
+        old = self.index.get(oid)
+        self.index[oid] = (offset, length, version, digest)
+        id_len = len(oid.encode('utf-8'))
+        if old:
+            self.live_bytes -= RECORD.size + id_len + old[1]
+        self.live_bytes += RECORD.size + id_len + length
+        self._since_checkpoint += 1
+        if self._since_checkpoint >= CHECKPOINT_EVERY:
+            self.checkpoint()
+
+    def writer(self, oid: str, version: int) -> ObjectWriter:
+        """Pieces are staged in an unlinked temporary file and copied into the log on commit."""
+        return ObjectWriter(self, oid, version, tempfile.TemporaryFile(dir=self.directory))
+
+    def _put_written(self, w: ObjectWriter):
+        oid_b = w.oid.encode('utf-8')
+        head = RECORD.pack(RECORD_MAGIC, 0, w.crc & 0xFFFFFFFF, w.version, len(oid_b), w.size, w.sha.digest())
+        w.sink.seek(0)
+        with self._lock:
+            pos = self._end
+            self._f.seek(pos)
+            self._f.write(head)
+            self._f.write(oid_b)
+            shutil.copyfileobj(w.sink, self._f, COPY_BLOCK)
+            self._end = pos + len(head) + len(oid_b) + w.size
+            self._f.flush()
+            if self.sync:
+                os.fsync(self._f.fileno())
+            self._indexed(w.oid, pos + len(head) + len(oid_b), w.size, w.version, w.digest)
+
+    def version(self, oid: str) -> int:
+        return self.index[oid][2]
+
+    def size(self, oid: str) -> int:
+        return self.index[oid][1]
+
+    def digest(self, oid: str) -> str:
+        return self.index[oid][3]
+
+    def versions(self) -> Iterator[Tuple[str, int]]:
+        return ((oid, e[2]) for oid, e in list(self.index.items()))
+
+    def _view(self, offset: int, length: int) -> memoryview:
+        if length == 0:
+            return memoryview(b'')
+        with self._lock:
+            if offset + length > self._mm_size:
+                # remap to cover the grown log; views into the old map keep it alive
+                self._f.flush()
+                self._mm = mmap.mmap(self._f.fileno(), self._end, access=mmap.ACCESS_READ)
+                self._mm_size = self._end
+            return memoryview(self._mm)[offset:offset + length]
+
+    def read(self, oid: str, offset: int = 0, length: Optional[int] = None) -> memoryview:
+        _check_offset(offset)
+        with self._lock:  # compact() swaps the index and the map together
+            start, size, _, _ = self.index[oid]
+            offset = min(offset, size)
+            length = size - offset if length is None else min(length, size - offset)
+            return self._view(start + offset, length)
+
+    # compaction
+
+    def garbage_ratio(self) -> float:
+        return 1 - self.live_bytes / self._end if self._end else 0.0
+
+    def needs_compaction(self) -> bool:
+        return not self._compacting and self._end >= COMPACT_MIN_BYTES and self.garbage_ratio() > COMPACT_RATIO
+
+    def compact(self):
+        """Rewrite live records into a fresh log. Safe to run in a thread while puts continue."""
+        with self._lock:
+            if self._compacting:
+                return
+            self._compacting = True
+            snapshot = dict(self.index)
+            end = self._end
+            self._f.flush()
+        tmp_path = self.log_path + '.compact'
+        try:
+            new_index = {}
+            generation = os.urandom(8).hex()
+            with open(self.log_path, 'rb') as src, open(tmp_path, 'w+b') as dst:
+                dst.write(_header(generation))
+                pos = dst.tell()
+                for oid, (offset, length, version, digest) in snapshot.items():
+                    oid_b = oid.encode('utf-8')
+                    src.seek(offset - len(oid_b) - RECORD.size)
+                    record = src.read(RECORD.size + len(oid_b) + length)
+                    dst.write(record)
+                    new_index[oid] = (pos + RECORD.size + len(oid_b), length, version, digest)
+                    pos += len(record)
+                with self._lock:
+                    # carry over records appended while we were copying
+                    self._f.flush()
+                    src.seek(end)
+                    tail = src.read(self._end - end)
+                    dst.write(tail)
+                    dst.flush()
+                    os.fsync(dst.fileno())
+                    self._replay(pos, pos + len(tail), dst, new_index)
+                    os.replace(tmp_path, self.log_path)
+                    _fsync_dir(self.directory)
+                    self.generation = generation
+                    self._f.close()
+                    self._f = open(self.log_path, 'r+b')
+                    self.index = new_index
+                    self._end = pos + len(tail)
+                    self._mm = None
+                    self._mm_size = 0
+                    self.live_bytes = sum(RECORD.size + len(o.encode('utf-8')) + e[1] for o, e in new_index.items())
+                    self.checkpoint()
+        finally:
+            self._compacting = False
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def close(self):
+        with self._lock:
+            if self._f.closed:
+                return
+            self.checkpoint()
+            self._f.close()
+            self._mm = None
+
+
+class CacheStore(MutableMapping):
+    """Objects in memory up to `max_memory` bytes, least recently used first out to a LogStore.
+
+    Puts go to memory; when the cache is over budget the least recently used objects spill to
+    the log in `directory`, and objects larger than max_memory / HOT_OBJECT_FRACTION are written
+    there directly. Reads of spilled objects are mmap-backed and leave them in the log, so the
+    page cache rather than the Python heap holds them. close() spills whatever is still in memory,
+    so the directory can be reopened later; a crash loses only the in-memory objects.
+    """
+
+    def __init__(self, directory: str, max_memory: int = HOT_CACHE, sync: bool = False):
+        self.log = LogStore(directory, sync)
+        self.max_memory = max_memory
+        self.max_object = max_memory // HOT_OBJECT_FRACTION
+        self.hot: 'OrderedDict[str, Tuple[bytes, int, Optional[str]]]' = OrderedDict()  # oid -> (data, version, sha256)
+        self.hot_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.spills = 0
+
+    def __getitem__(self, oid):
+        e = self.hot.get(oid)
+        if e is None:
+            return self.log[oid]
+        self.hot.move_to_end(oid)
+        return e[0], e[1]
+
+    def __setitem__(self, oid, value):
+        data, version = value
+        self.put(oid, data, version)
+
+    def __delitem__(self, oid):
+        if not self._drop_hot(oid):
+            del self.log[oid]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self.hot) + list(self.log))
+
+    def __len__(self):
+        return len(self.hot) + len(self.log)
+
+    def __contains__(self, oid):
+        return oid in self.hot or oid in self.log
+
+    def put(self, oid: str, data, version: int, digest: Optional[str] = None):
+        self._drop_hot(oid)
+        if len(data) > self.max_object:
+            self.log.put(oid, data, version, digest)
+            return
+        if oid in self.log:
+            del self.log[oid]  # the hot copy replaces it; the two tiers never hold the same id
+        self.hot[oid] = (bytes(data), version, digest)
+        self.hot_bytes += len(data)
+        self._spill()
+
+    def _drop_hot(self, oid: str) -> bool:
+        e = self.hot.pop(oid, None)
+        if e is not None:
+            self.hot_bytes -= len(e[0])
+        return e is not None
+
+    def _spill(self):
+        while self.hot_bytes > self.max_memory:
+            oid, (data, version, digest) = self.hot.popitem(last=False)
+            self.hot_bytes -= len(data)
+            self.log.put(oid, data, version, digest)
+            self.spills += 1
+
+    def writer(self, oid: str, version: int) -> ObjectWriter:
+        return ObjectWriter(self, oid, version, tempfile.TemporaryFile(dir=self.log.directory))
+
+    def _put_written(self, w: ObjectWriter):
+        if w.size > self.max_object:
+            self._drop_hot(w.oid)
+            self.log._put_written(w)
+            return
+        w.sink.seek(0)
+        self.put(w.oid, w.sink.read(), w.version, w.digest)
+
+    def _hot(self, oid: str):
+        e = self.hot.get(oid)
+        if e is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return e
+
+    def version(self, oid: str) -> int:
+        e = self.hot.get(oid)
+        return self.log.version(oid) if e is None else e[1]
+
+    def size(self, oid: str) -> int:
+        e = self.hot.get(oid)
+        return self.log.size(oid) if e is None else len(e[0])
+
+    def digest(self, oid: str) -> str:
+        e = self.hot.get(oid)
+        if e is None:
+            return self.log.digest(oid)
+        if e[2] is None:
+            e = self.hot[oid] = (e[0], e[1], hashlib.sha256(e[0]).hexdigest())
+        return e[2]
+
+    def read(self, oid: str, offset: int = 0, length: Optional[int] = None) -> memoryview:
+        _check_offset(offset)
+        e = self._hot(oid)
+        if e is None:
+            return self.log.read(oid, offset, length)
+        self.hot.move_to_end(oid)
+        view = memoryview(e[0])
+        return view[offset:] if length is None else view[offset:offset + length]
+
+    def versions(self) -> Iterator[Tuple[str, int]]:
+        return iter([(oid, e[1]) for oid, e in self.hot.items()] + list(self.log.versions()))
+
+    def needs_compaction(self) -> bool:
+        return self.log.needs_compaction()
+
+    def compact(self):
+        self.log.compact()
+
+    def stats(self) -> dict:
+        return {'hot_bytes': self.hot_bytes, 'hot_objects': len(self.hot), 'max_memory': self.max_memory,
+                'spilled_objects': len(self.log), 'spilled_bytes': self.log.live_bytes,
+                'hits': self.hits, 'misses': self.misses, 'spills': self.spills}
+
+    def close(self):
+        if self.log._f.closed:
+            return
+        self.max_memory = 0
+        self._spill()
+        self.log.close()
@@ -0,0 +1,158 @@
+"""Stream (TCP) transport for bulk object data.
+
+Control messages and small objects keep using UDP datagrams. When both peers list `stream1`
+in HELLO/DIGESTS (with their TCP port in `stream_port`), objects of at least STREAM_MIN_SIZE
+bytes are fetched over a TCP connection instead. The kernel then does flow control and
+retransmission, and each record carries up to RECORD_SIZE bytes, so one write and one
+seal/open cover what would have been 256 datagrams.
+
+Record layout (network byte order): length (I) | type (B) | flags (B) | payload (`length` bytes)
+  - OPEN  client -> server, in clear: JSON {from, port}. `port` is the client's UDP port; it
+          names the peer whose session keys protect the rest of the connection.
+  - GET   client -> server: JSON {id, version, offset}
+  - DATA  server -> client: object bytes, starting at the requested offset
+  - END   server -> client: JSON {size} after the last DATA record
+  - ERROR server -> client: JSON {error}; the client falls back to datagrams
+When the peers share a session, every record after OPEN is sealed (F_SEALED, plus F_AEAD for
+the aead1 suite) with the same `Session` that protects their datagrams, so the connection is
+only usable by the holder of the keys.
+
+`StreamPool` keeps up to POOL_SIZE idle connections per peer for reuse and closes those left
+idle for IDLE_TIMEOUT.
+"""
+
+import asyncio
+import json
+import struct
+import time
+from typing import Dict, List
+
+CAP_STREAM = 'stream1'
+STREAM_MIN_SIZE = 256 * 1024  # smaller objects are not worth a connection
+RECORD_SIZE = 256 * 1024  # DATA bytes per record; a multiple of the chunk size
+MAX_RECORD = RECORD_SIZE + 1024  # largest record accepted, sealing overhead included
+POOL_SIZE = 2  # idle connections kept per peer
+IDLE_TIMEOUT = 30.0
+CONNECT_TIMEOUT = 5.0
+READ_TIMEOUT = 10.0  # longest wait for the next record of an object being fetched
+
+RECORD = struct.Struct('!IBB')
+
+# record types
+R_OPEN = 1
+R_GET = 2
+R_DATA = 3
+R_END = 4
+R_ERROR = 5
+
+# flags
+F_SEALED = 0x01
+F_AEAD = 0x02
+
+
+class StreamError(Exception):
+    pass
+
+
+class StreamConnection:
+    """Framed records over one TCP connection; records are sealed once `session` is set."""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, session=None):
+        self.reader = reader
+        self.writer = writer
+        self.session = session
+
+    @property
+    def closed(self) -> bool:
+        return self.writer.is_closing() or self.reader.at_eof()
+
+    async def send(self, rtype: int, payload=b''):
+        flags = 0
+        if self.session is not None:
+            payload = self.session.seal(payload)
+            flags = F_SEALED | (F_AEAD if self.session.aead else 0)
+        self.writer.write(RECORD.pack(len(payload), rtype, flags))
+        self.writer.write(payload)
+        await self.writer.drain()  # waits while the kernel send buffer is full
+
+    async def send_json(self, rtype: int, obj: dict):
+        await self.send(rtype, json.dumps(obj).encode('utf-8'))
+
+    async def recv(self):
+        """(type, payload) of the next record; raises IncompleteReadError at EOF."""
+        length, rtype, flags = RECORD.unpack(await self.reader.readexactly(RECORD.size))
+        if length > MAX_RECORD:
+            raise StreamError(f'record of {length} bytes exceeds the limit')
+        payload = await self.reader.readexactly(length)
+        if flags & F_SEALED:
+            if self.session is None:
+                raise StreamError('sealed record but no session')
+            try:
+                payload = self.session.open(payload, bool(flags & F_AEAD))
+            except Exception as e:
+                raise StreamError(f'cannot open record: {e}') from None
+        elif self.session is not None:
+            raise StreamError('unsealed record on a secure connection')
+        return rtype, payload
+
+    def close(self):
+        self.writer.close()
+
+
+async def connect(host: str, port: int, node_id: str, udp_port: int, session=None) -> StreamConnection:
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), CONNECT_TIMEOUT)
+    conn = StreamConnection(reader, writer)
+    await conn.send_json(R_OPEN, {'from': node_id, 'port': udp_port})
+    conn.session = session
+    return conn
+
+
+class StreamPool:
+    """Idle connections per peer address, reused by later fetches from the same peer."""
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.idle: Dict[object, List[list]] = {}  # addr -> [[connection, idle since]]
+        self.opened = 0
+        self.reused = 0
+
+    async def acquire(self, addr, connect) -> StreamConnection:
+        """An idle connection to `addr`, or a new one from `await connect()`."""
+        conns = self.idle.get(addr)
+        while conns:
+            conn, since = conns.pop()
+            if not conn.closed and self.clock() - since < IDLE_TIMEOUT:
+                self.reused += 1
+                return conn
+            conn.close()
+        conn = await connect()
+        self.opened += 1
+        return conn
+
+    def release(self, addr, conn: StreamConnection, reusable: bool = True):
+        """Return a connection after use; it is closed if broken, mid-record or the pool is full."""
+        conns = self.idle.setdefault(addr, [])
+        if not reusable or conn.closed or len(conns) >= POOL_SIZE:
+            conn.close()
+            return
+        entry = [conn, self.clock()]
+        conns.append(entry)
+        asyncio.get_running_loop().call_later(IDLE_TIMEOUT, self._expire, addr, entry)
+
+    def _expire(self, addr, entry):
+        conns = self.idle.get(addr, [])
+        if entry in conns and self.clock() - entry[1] >= IDLE_TIMEOUT:
+            conns.remove(entry)
+            entry[0].close()
+
+    def discard(self, addr):
+        """Close the idle connections to `addr`, e.g. after its session keys changed."""
+        for conn, _ in self.idle.pop(addr, ()):
+            conn.close()
+
+    def idle_count(self) -> int:
+        return sum(len(c) for c in self.idle.values())
+
+    def close(self):
+        for addr in list(self.idle):
+            self.discard(addr)
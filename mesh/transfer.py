@@ -0,0 +1,585 @@
+"""Receiver-driven chunk transfer state for mesh sync.
+
+The receiver keeps a window of requested-but-unanswered chunks, tracks which chunks arrived
+in a per-chunk bitmap and re-requests (selective NACK) only the chunks whose retransmission
+timer expired. Timers follow RFC 6298 (SRTT/RTTVAR with Karn's rule).
+
+Chunks are written at their offset into a preallocated buffer (in memory, or a sparse
+`.part` file when a state directory is configured), each one checked against its CRC32,
+and the assembled object against the SHA-256 advertised in DIGESTS. File-backed transfers
+persist their bitmap in a `.meta` sidecar so they resume after a restart.
+
+A sized transfer can pull from several sources at once (swarming). Each source has its own
+in-flight set and a window sized by its measured throughput. Chunks are picked rarest-first
+among the partial holders. Once every missing chunk is requested and at most ENDGAME_CHUNKS are
+missing, idle sources duplicate the oldest outstanding requests, up to ENDGAME_COPIES sources
+per chunk (endgame). Chunks held by a slow or departed source go back to the pool for the others.
+"""
+
+import base64
+import hashlib
+import json
+import os
+import random
+import time
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+DEFAULT_WINDOW = 64
+DEFAULT_CHUNK_SIZE = 1024
+PERSIST_EVERY = 64  # chunks received between bitmap checkpoints
+MAX_REQUEST_CHUNKS = 256
+MAX_RETRIES = 8
+
+RTO_INITIAL = 0.5
+RTO_MIN = 0.05
+RTO_MAX = 5.0
+
+MIN_SOURCE_WINDOW = 4
+SWARM_WINDOW_FACTOR = 4  # in-flight budget across all sources, in transfer windows
+LOOKAHEAD = 8  # rarest-first looks this many windows past the first unrequested chunk
+ENDGAME_CHUNKS = 16  # missing chunks from which idle sources duplicate requests; earlier, duplicates only add load
+ENDGAME_COPIES = 2  # sources asked for one chunk at once in the endgame
+RATE_INTERVAL = 0.05  # seconds of deliveries per throughput sample
+RATE_ALPHA = 0.25
+BLOCK_SIZE = 256 * 1024  # bytes per piece when copying a finished object out of its buffer
+
+
+def chunk_count(size: int, chunk_size: int) -> int:
+    return max(1, -(-size // chunk_size))
+
+
+def chunk_checksum(data) -> int:
+    return zlib.crc32(data) & 0xFFFFFFFF
+
+
+def object_hash(data) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def to_ranges(indices) -> List[Tuple[int, int]]:
+    """Coalesce chunk indices into sorted (start, count) ranges."""
+    ranges = []
+    for i in sorted(indices):
+        if ranges and ranges[-1][0] + ranges[-1][1] == i:
+            ranges[-1][1] += 1
+        else:
+            ranges.append([i, 1])
+    return [(s, c) for s, c in ranges]
+
+
+def clip_ranges(ranges, nchunks: int) -> List[Tuple[int, int]]:
+    """(start, count) ranges from a peer, cut to chunks 0..nchunks-1; malformed or empty ones are dropped."""
+    clipped = []
+    for r in ranges:
+        try:
+            first, count = int(r[0]), int(r[1])
+        except (TypeError, ValueError, IndexError):
+            continue
+        if first < 0 or count <= 0 or first >= nchunks:
+            continue
+        clipped.append((first, min(count, nchunks - first)))
+    return clipped
+
+
+class RttEstimator:
+    """Smoothed round-trip time and retransmission timeout (RFC 6298)."""
+
+    def __init__(self):
+        self.srtt: Optional[float] = None
+        self.rttvar: Optional[float] = None
+        self.rto = RTO_INITIAL
+
+    def sample(self, rtt: float):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.rto = min(RTO_MAX, max(RTO_MIN, self.srtt + 4 * self.rttvar))
+
+    def backoff(self):
+        self.rto = min(RTO_MAX, self.rto * 2)
+
+
+class Source:
+    """A peer serving chunks of one transfer. `have` is None when it holds the whole object."""
+
+    def __init__(self, addr, have: Optional[bytearray] = None):
+        self.addr = addr
+        self.have = have
+        self.inflight: Dict[int, float] = {}  # chunk index -> time requested
+        self.retries = 0
+        self.rate: Optional[float] = None  # smoothed bytes/s delivered
+        self.timer = None
+        self._mark = None
+        self._bytes = 0
+
+    def has(self, idx: int) -> bool:
+        return self.have is None or (idx < len(self.have) and bool(self.have[idx]))
+
+    def idle(self, now: float):
+        """Restart the throughput sample; time spent with nothing requested says nothing about the peer."""
+        self._mark, self._bytes = now, 0
+
+    def delivered(self, nbytes: int, now: float):
+        if self._mark is None:
+            self._mark = now
+        self._bytes += nbytes
+        elapsed = now - self._mark
+        if elapsed >= RATE_INTERVAL:
+            sample = self._bytes / elapsed
+            self.rate = sample if self.rate is None else (1 - RATE_ALPHA) * self.rate + RATE_ALPHA * sample
+            self._mark, self._bytes = now, 0
+
+
+class ChunkBuffer:
+    """In-memory reassembly buffer, preallocated when the object size is known."""
+
+    def __init__(self, size: Optional[int] = None):
+        self.data = bytearray(size or 0)
+
+    @property
+    def memory(self) -> int:
+        return len(self.data)
+
+    def write(self, offset: int, chunk):
+        end = offset + len(chunk)
+        if end > len(self.data):
+            self.data.extend(bytes(end - len(self.data)))
+        self.data[offset:end] = chunk
+
+    def read(self, size: int) -> bytes:
+        return bytes(self.data[:size])
+
+    def read_at(self, offset: int, length: int) -> bytes:
+        return bytes(self.data[offset:offset + length])
+
+    def blocks(self, size: int, block_size: int = BLOCK_SIZE):
+        with memoryview(self.data) as view:
+            for offset in range(0, size, block_size):
+                yield view[offset:min(size, offset + block_size)]
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.data = bytearray()
+
+
+class FileChunkBuffer:
+    """Reassembly into a sparse file so partial objects survive a restart."""
+
+    def __init__(self, path: str, size: Optional[int] = None):
+        self.path = path
+        self.f = open(path, 'r+b' if os.path.exists(path) else 'w+b')
+        if size is not None:
+            self.f.truncate(size)
+
+    memory = 0  # the bytes live in the file
+
+    def write(self, offset: int, chunk):
+        self.f.seek(offset)
+        self.f.write(chunk)
+
+    def read(self, size: int) -> bytes:
+        return self.read_at(0, size)
+
+    def read_at(self, offset: int, length: int) -> bytes:
+        self.f.flush()
+        self.f.seek(offset)
+        return self.f.read(length)
+
+    def blocks(self, size: int, block_size: int = BLOCK_SIZE):
+        for offset in range(0, size, block_size):
+            yield self.read_at(offset, min(block_size, size - offset))
+
+    def flush(self):
+        self.f.flush()
+        os.fsync(self.f.fileno())
+
+    def close(self):
+        self.f.close()
+
+
+class IncomingTransfer:
+    """State of one object being pulled from a peer.
+
+    `size` is None while the object size is unknown (legacy peers do not advertise sizes);
+    in that case chunks are requested one at a time until the last one (more=0) arrives.
+    `peer` is the first source; a parked transfer has no sources and waits for any peer that
+    advertises the object. Only sized transfers take more than one source.
+    """
+
+    def __init__(self, oid: str, version: int, peer, size: Optional[int] = None, window: int = DEFAULT_WINDOW,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE, digest: Optional[str] = None, path: Optional[str] = None,
+                 rng: Optional[random.Random] = None):
+        self.oid = oid
+        self.version = version
+        self.size = size
+        self.digest = digest
+        self.chunk_size = chunk_size
+        self.nchunks = chunk_count(size, chunk_size) if size is not None else None
+        self.window = max(1, window)
+        self.received = bytearray(self.nchunks or 1)
+        self.nreceived = 0
+        self.last_len = None  # length of the final chunk once it arrived (unsized transfers)
+        self.path = path  # state path prefix; None for memory-only transfers
+        self.buf = FileChunkBuffer(path + '.part', size) if path else ChunkBuffer(size)
+        self.unsaved = 0
+        self.corrupt = 0
+        self.sources: Dict[object, Source] = {}  # peer addr -> Source
+        self.avail = bytearray(self.nchunks or 0)  # partial holders per chunk, for rarest-first
+        self.inflight = {}  # chunk index -> time first requested from any source
+        self.retried = set()  # indices requested more than once (no RTT samples, Karn's rule)
+        self.next_idx = 0  # no chunk below this is missing and unrequested
+        self.announced = 0  # nreceived when we last told peers what we hold
+        self.stream = None  # task fetching the object over a stream connection (mesh.stream); no chunk requests meanwhile
+        self.multicast = None  # membership in the sender's group stream (mesh.multicast); no chunk requests meanwhile
+        self.multicast_from = None  # sender of the group stream this transfer joined; any member can write to it
+        self.repairs = None  # fec.RepairSet: FEC repair symbols waiting for the rest of their group (mesh.fec)
+        self.started = time.monotonic()
+        self.progress = self.started  # when the last chunk arrived
+        self.owner = peer  # the peer whose reassembly budget this transfer is charged to (mesh.budget)
+        self._rng = rng or random.Random()  # tie-breaks in rarest-first; pass a seeded one for repeatable runs
+        if peer is not None:
+            self.add_source(peer)
+
+    def _ensure(self, idx: int):
+        if idx >= len(self.received):
+            self.received.extend(bytes(idx + 1 - len(self.received)))
+
+    @property
+    def memory(self) -> int:
+        """Bytes of reassembly buffer held in memory."""
+        return self.buf.memory
+
+    @property
+    def peer(self):
+        return next(iter(self.sources), None)
+
+    # sources
+
+    def add_source(self, addr, ranges=None) -> Source:
+        """Add or update a source; `ranges` lists the chunks a partial holder has, None means all."""
+        src = self.sources.get(addr)
+        if src is None:
+            src = self.sources[addr] = Source(addr, None if ranges is None else bytearray(self.nchunks or 0))
+        if ranges is None:
+            self._forget_have(src)
+            src.have = None
+        elif src.have is not None:
+            for start, count in ranges:
+                for i in range(max(0, int(start)), min(int(start) + int(count), len(src.have))):
+                    if not src.have[i]:
+                        src.have[i] = 1
+                        self.avail[i] = min(255, self.avail[i] + 1)
+        return src
+
+    def _forget_have(self, src: Source):
+        if src.have is None:
+            return
+        for i, held in enumerate(src.have):
+            if held:
+                self.avail[i] -= 1
+
+    def remove_source(self, addr) -> Optional[Source]:
+        """Drop a departed or hopeless source and return its outstanding chunks to the pool."""
+        src = self.sources.get(addr)
+        if src is None:
+            return None
+        self.release(addr, to_ranges(src.inflight))
+        self._forget_have(src)
+        del self.sources[addr]
+        return src
+
+    def release(self, addr, ranges):
+        """Stop expecting `ranges` from `addr`; chunks nobody else was asked for become pickable again."""
+        src = self.sources.get(addr)
+        if src is None:
+            return
+        for start, count in ranges:
+            for i in range(start, start + count):
+                if src.inflight.pop(i, None) is None:
+                    continue
+                if not any(i in s.inflight for s in self.sources.values()):
+                    self.inflight.pop(i, None)
+                    if not self.has(i):
+                        self.next_idx = min(self.next_idx, i)
+
+    def source_window(self, src: Source) -> int:
+        """Chunks `src` may have outstanding: the transfer window split by measured throughput."""
+        if len(self.sources) <= 1:
+            return self.window
+        if src.retries:
+            return MIN_SOURCE_WINDOW  # just probe a source that is losing requests
+        known = [s.rate for s in self.sources.values() if s.rate]
+        default = sum(known) / len(known) if known else 1.0
+        total = sum(s.rate or default for s in self.sources.values())
+        budget = self.window * min(len(self.sources), SWARM_WINDOW_FACTOR)
+        share = int(budget * (src.rate or default) / total)
+        return max(MIN_SOURCE_WINDOW, min(self.window, share))
+
+    @property
+    def known_chunks(self) -> int:
+        """Chunks known to exist: exact when sized, else one past the highest chunk seen with more=1."""
+        return len(self.received)
+
+    def complete(self) -> bool:
+        return self.nchunks is not None and self.nreceived >= self.nchunks
+
+    def next_batch(self, now: float, addr=None, align: int = 1) -> List[Tuple[int, int]]:
+        """Open the window of source `addr`: ranges of chunks to request (empty if the window is still mostly full).
+
+        With `align` > 1 an in-order batch ends on a multiple of `align` chunks where it can (FEC groups).
+        """
+        src = self.sources.get(addr) or self.add_source(addr)
+        window = self.source_window(src)
+        free = window - len(src.inflight)
+        # refill in batches so one REQUEST covers many chunks
+        if free <= 0 or (self.nchunks is not None and src.inflight and free < max(1, window // 2)):
+            return []
+        if align > 1 and self.nchunks is not None:
+            end = (self.next_idx + free) // align * align
+            if end > self.next_idx:
+                free = end - self.next_idx
+        if not src.inflight:
+            src.idle(now)
+        new = self._pick(src, free)
+        if not new and self.nchunks is not None:
+            new = self._endgame(src, free)
+        for i in new:
+            src.inflight[i] = now
+            self.inflight.setdefault(i, now)
+        return to_ranges(new)
+
+    def _pick(self, src: Source, free: int) -> List[int]:
+        if self.nchunks is None or (len(self.sources) == 1 and src.have is None):
+            # one full source (or unknown size): plain sequential order
+            new = []
+            while free > 0 and self.next_idx < self.known_chunks:
+                if not self.has(self.next_idx) and self.next_idx not in self.inflight:
+                    new.append(self.next_idx)
+                    free -= 1
+                self.next_idx += 1
+            return new
+        i = self.next_idx
+        while i < self.nchunks and (self.received[i] or i in self.inflight):
+            i += 1
+        self.next_idx = i
+        candidates = [j for j in range(i, min(self.nchunks, i + LOOKAHEAD * self.window))
+                      if not self.received[j] and j not in self.inflight and src.has(j)]
+        # rarest first; random among equals so peers pulling the same object spread out
+        rng = self._rng
+        candidates.sort(key=lambda j: (self.avail[j], rng.random()))
+        return candidates[:free]
+
+    def _endgame(self, src: Source, free: int) -> List[int]:
+        """Once each of the last missing chunks is in flight, duplicate the oldest requests held by other sources."""
+        missing = self.nchunks - self.nreceived
+        if missing > len(self.inflight) or missing > ENDGAME_CHUNKS:
+            return []
+        asked = [s.inflight for s in self.sources.values()]
+        oldest = sorted((t, i) for i, t in self.inflight.items()
+                        if i not in src.inflight and src.has(i) and sum(i in f for f in asked) < ENDGAME_COPIES)
+        new = [i for _, i in oldest[:free]]
+        self.retried.update(new)
+        return new
+
+    def prefill(self, chunks) -> int:
+        """Mark chunks that are already available locally (delta sync) as received."""
+        filled = 0
+        for idx, data in chunks.items():
+            if idx < self.known_chunks and not self.has(idx) and self._valid(idx, data, True, None):
+                self.buf.write(idx * self.chunk_size, data)
+                self.received[idx] = 1
+                self.nreceived += 1
+                filled += 1
+        self.next_idx = self.first_missing()
+        return filled
+
+    def write_range(self, idx: int, data) -> int:
+        """Store a run of whole chunks starting at chunk `idx` (stream transfers); returns the chunks it covers.
+
+        The run may end with the object's last, shorter chunk. Only sized transfers take runs.
+        """
+        offset = idx * self.chunk_size
+        end = offset + len(data)
+        if self.nchunks is None or end > self.size or (len(data) % self.chunk_size and end != self.size):
+            raise ValueError('data does not line up with chunk boundaries')
+        self.buf.write(offset, data)
+        count = -(-len(data) // self.chunk_size)
+        new = count - self.received.count(1, idx, idx + count)
+        self.received[idx:idx + count] = b'\x01' * count
+        self.nreceived += new
+        self.unsaved += new
+        if self.path and self.unsaved >= PERSIST_EVERY:
+            self.save()
+        self.next_idx = self.first_missing()
+        return count
+
+    def has(self, idx: int) -> bool:
+        return idx < len(self.received) and bool(self.received[idx])
+
+    def _valid(self, idx: int, data, more: bool, checksum: Optional[int]) -> bool:
+        if checksum is not None and chunk_checksum(data) != checksum:
+            return False
+        if self.nchunks is None:
+            if idx not in self.inflight and not self.has(idx):
+                return False  # unsized: only requested chunks, or the bitmap and buffer grow to any index
+            return len(data) == self.chunk_size if more else len(data) <= self.chunk_size
+        if idx >= self.nchunks:
+            return False
+        expected = self.size - idx * self.chunk_size if idx == self.nchunks - 1 else self.chunk_size
+        return len(data) == expected
+
+    def on_chunk(self, idx: int, data, more: bool, now: float, checksum: Optional[int] = None,
+                 addr=None) -> Optional[float]:
+        """Record a chunk that arrived from `addr`. Returns an RTT sample when one is valid, else None.
+
+        Corrupt or mis-sized chunks are ignored and stay in flight, so the retransmit timer re-requests them.
+        """
+        if not self._valid(idx, data, more, checksum):
+            self.corrupt += 1
+            return None
+        src = self.sources.get(addr)
+        sent = src.inflight.get(idx) if src else None
+        self.inflight.pop(idx, None)
+        for s in self.sources.values():
+            s.inflight.pop(idx, None)  # endgame duplicates, or a late answer after a release
+        if self.has(idx):
+            return None
+        self._ensure(idx)
+        self.buf.write(idx * self.chunk_size, data)
+        self.received[idx] = 1
+        self.nreceived += 1
+        if self.nchunks is None:
+            if not more:
+                self.nchunks = idx + 1
+                self.last_len = len(data)
+                del self.received[self.nchunks:]
+            else:
+                self._ensure(idx + 1)
+        if src:
+            src.delivered(len(data), now)
+        self.unsaved += 1
+        if self.path and self.unsaved >= PERSIST_EVERY:
+            self.save()
+        if sent is None or idx in self.retried:
+            return None
+        return now - sent
+
+    def expired(self, now: float, rto: float, addr=None) -> List[Tuple[int, int]]:
+        """Selective NACK: ranges of chunks in flight at `addr` whose timer expired; they are re-armed."""
+        src = self.sources.get(addr)
+        if src is None:
+            return []
+        lost = [i for i, t in src.inflight.items() if now - t >= rto]
+        for i in lost:
+            src.inflight[i] = now
+            self.inflight[i] = now
+            self.retried.add(i)
+        return to_ranges(lost)
+
+    def missing(self) -> List[int]:
+        return [i for i in range(self.known_chunks) if not self.has(i)]
+
+    def first_missing(self) -> int:
+        idx = self.received.find(0)
+        return idx if idx >= 0 else self.known_chunks
+
+    def have_ranges(self, limit: int) -> List[Tuple[int, int]]:
+        """Up to `limit` (start, count) runs of received chunks, as advertised to other pullers."""
+        out = []
+        i = self.received.find(1)
+        while i >= 0 and len(out) < limit:
+            j = self.received.find(0, i)
+            if j < 0:
+                j = len(self.received)
+            out.append((i, j - i))
+            i = self.received.find(1, j)
+        return out
+
+    def read_chunk(self, idx: int) -> bytes:
+        """A received chunk, for serving other peers before the object is complete."""
+        length = self.size - idx * self.chunk_size if idx == self.nchunks - 1 else self.chunk_size
+        return self.buf.read_at(idx * self.chunk_size, length)
+
+    def park(self):
+        """Detach from all sources; keep received chunks so another peer can resume."""
+        self.sources.clear()
+        self.avail = bytearray(len(self.avail))
+        self.inflight.clear()
+        self.retried.clear()
+        self.next_idx = self.first_missing()
+        if self.path:
+            self.save()
+
+    def final_size(self) -> int:
+        if self.size is not None:
+            return self.size
+        return (self.nchunks - 1) * self.chunk_size + (self.last_len or 0)
+
+    def blocks(self, block_size: int = BLOCK_SIZE):
+        """The object bytes in pieces of at most `block_size`, without assembling them in one buffer."""
+        return self.buf.blocks(self.final_size(), block_size)
+
+    def contiguous(self, idx: int) -> int:
+        """Received chunks in a row starting at chunk `idx`."""
+        end = self.received.find(0, idx)
+        return (end if end >= 0 else len(self.received)) - idx
+
+    def assemble(self) -> Optional[bytes]:
+        """Return the object bytes, or None when they do not match the advertised hash."""
+        data = self.buf.read(self.final_size())
+        if self.digest and object_hash(data) != self.digest:
+            return None
+        return data
+
+    # persistence of partial state
+
+    def save(self):
+        self.buf.flush()
+        meta = {
+            'id': self.oid,
+            'version': self.version,
+            'size': self.size,
+            'hash': self.digest,
+            'chunk_size': self.chunk_size,
+            'received': base64.b64encode(bytes(self.received)).decode('ascii'),
+        }
+        tmp = self.path + '.meta.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp, self.path + '.meta')
+        self.unsaved = 0
+
+    def close(self):
+        self.buf.close()
+
+    def remove(self):
+        self.close()
+        if self.path:
+            for ext in ('.part', '.meta'):
+                try:
+                    os.remove(self.path + ext)
+                except FileNotFoundError:
+                    pass
+
+    @classmethod
+    def load(cls, path: str, window: int = DEFAULT_WINDOW, rng: Optional[random.Random] = None) -> 'IncomingTransfer':
+        """Restore a parked transfer from `<path>.meta` / `<path>.part`."""
+        with open(path + '.meta') as f:
+            meta = json.load(f)
+        t = cls(meta['id'], meta['version'], None, meta['size'], window, meta['chunk_size'], meta['hash'], path, rng)
+        received = base64.b64decode(meta['received'])
+        if t.nchunks is None or len(received) == len(t.received):
+            t.received = bytearray(received)
+            t.nreceived = t.received.count(1)
+        t.next_idx = t.first_missing()
+        return t
+
+
+def state_path(state_dir: str, oid: str) -> str:
+    return os.path.join(state_dir, hashlib.sha1(oid.encode('utf-8')).hexdigest())
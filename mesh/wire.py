@@ -0,0 +1,244 @@
+"""Wire codecs for mesh sync messages.
+
+Two encodings are supported:
+  - JSON (legacy): one JSON object per datagram, binary fields base64-encoded.
+  - Binary v1: a fixed struct header followed by the object id and raw payload bytes.
+
+Binary framing is only used towards peers that advertised the `bin1` capability in HELLO,
+so nodes running the JSON-only prototype keep working.
+
+Binary frame layout (network byte order):
+  magic (B) | wire version (B) | type (B) | flags (B) | object version (I) | chunk index (I) | id length (B)
+  followed by `id length` bytes of UTF-8 object id and the payload.
+"""
+
+import json
+import struct
+
+from . import compress
+
+MAGIC = 0xA5
+WIRE_VERSION = 1
+CAP_BINARY = 'bin1'
+
+HEADER = struct.Struct('!BBBBIIB')
+HEADER_SIZE = HEADER.size
+RANGE = struct.Struct('!II')  # REQUEST payload: (first chunk, chunk count) pairs
+CRC = struct.Struct('!I')  # trailing CHUNK checksum when F_CRC is set
+REPAIR = struct.Struct('!BB')  # REPAIR payload: (row, chunks in the group), then the symbol
+
+# message types
+T_KEY_EXCHANGE = 1
+T_HELLO = 2
+T_DIGESTS = 3
+T_REQUEST = 4
+T_CHUNK = 5
+T_ACK = 6
+T_ENCRYPTED = 7
+T_TREE = 8
+T_TREE_REQUEST = 9
+T_DELTA_REQUEST = 10
+T_RECIPE = 11
+T_CRDT_PULL = 12
+T_CRDT_DELTA = 13
+T_HAVE = 14
+T_GOSSIP = 15
+T_FRAGMENT = 16
+T_PROBE = 17
+T_PROBE_ACK = 18
+T_REPAIR = 19
+T_MCAST_OFFER = 20
+T_MCAST_JOIN = 21
+T_MCAST_END = 22
+T_GROUP = 23
+
+TYPE_NAMES = {
+    T_KEY_EXCHANGE: 'KEY_EXCHANGE',
+    T_HELLO: 'HELLO',
+    T_DIGESTS: 'DIGESTS',
+    T_REQUEST: 'REQUEST',
+    T_CHUNK: 'CHUNK',
+    T_ACK: 'ACK',
+    T_ENCRYPTED: 'ENCRYPTED',
+    T_TREE: 'TREE',
+    T_TREE_REQUEST: 'TREE_REQUEST',
+    T_DELTA_REQUEST: 'DELTA_REQUEST',
+    T_RECIPE: 'RECIPE',
+    T_CRDT_PULL: 'CRDT_PULL',
+    T_CRDT_DELTA: 'CRDT_DELTA',
+    T_HAVE: 'HAVE',
+    T_GOSSIP: 'GOSSIP',
+    T_FRAGMENT: 'FRAGMENT',
+    T_PROBE: 'PROBE',
+    T_PROBE_ACK: 'PROBE_ACK',
+    T_REPAIR: 'REPAIR',
+    T_MCAST_OFFER: 'MCAST_OFFER',
+    T_MCAST_JOIN: 'MCAST_JOIN',
+    T_MCAST_END: 'MCAST_END',
+    T_GROUP: 'GROUP',
+}
+TYPE_CODES = {name: code for code, name in TYPE_NAMES.items()}
+
+# flags
+F_MORE = 0x01
+F_JSON = 0x02  # payload is a JSON object carrying the remaining message fields
+F_CRC = 0x04  # CHUNK payload ends with a CRC32 of the chunk data
+F_AEAD = 0x08  # ENCRYPTED payload was sealed with the aead1 suite rather than gcm-hmac
+F_BULK = 0x10  # ENCRYPTED payload carries chunk data: receivers may shed it first under load
+F_COMP = 0x20  # CHUNK payload is a codec id byte + compressed data (the CRC covers the decompressed data)
+F_COPY = 0x40  # REQUEST repeated right after the original on a lossy link; served only if the original was lost
+
+MAX_CHUNK_BYTES = 64 * 1024  # decompression limit when the caller does not give one
+
+
+class WireError(ValueError):
+    pass
+
+
+class Frame:
+    """A decoded binary frame. `payload` is a memoryview into the received datagram."""
+
+    __slots__ = ('type', 'flags', 'version', 'index', 'oid', 'payload')
+
+    def __init__(self, mtype: int, flags: int, version: int, index: int, oid: str, payload):
+        self.type = mtype
+        self.flags = flags
+        self.version = version
+        self.index = index
+        self.oid = oid
+        self.payload = payload
+
+    @property
+    def more(self) -> bool:
+        return bool(self.flags & F_MORE)
+
+    def chunk(self, max_size: int = MAX_CHUNK_BYTES):
+        """(data, checksum) of a CHUNK frame; checksum is None when the sender did not attach one.
+
+        Compressed chunks are decompressed (to at most `max_size` bytes); a bad stream raises WireError.
+        """
+        data, checksum = self.payload, None
+        if self.flags & F_CRC and len(data) >= CRC.size:
+            data, checksum = data[:-CRC.size], CRC.unpack_from(data, len(data) - CRC.size)[0]
+        if self.flags & F_COMP:
+            if not len(data):
+                raise WireError('empty compressed chunk')
+            try:
+                data = compress.decompress(data[0], data[1:], max_size)
+            except compress.CompressionError as e:
+                raise WireError(f'bad compressed chunk: {e}') from None
+        return data, checksum
+
+    def ranges(self):
+        """(start, count) chunk ranges of a REQUEST frame; a bare header asks for one chunk."""
+        p = self.payload
+        if not len(p):
+            return [(self.index, 1)]
+        return [RANGE.unpack_from(p, off) for off in range(0, len(p) - RANGE.size + 1, RANGE.size)]
+
+    def repair(self):
+        """(row, group size, symbol) of a REPAIR frame; the index field is the group number."""
+        if len(self.payload) < REPAIR.size:
+            raise WireError('truncated repair symbol')
+        row, k = REPAIR.unpack_from(self.payload)
+        return row, k, self.payload[REPAIR.size:]
+
+    def to_message(self, sender: str = None) -> dict:
+        """Expand a frame into the equivalent JSON-style message dict (control path only)."""
+        msg = json.loads(bytes(self.payload).decode('utf-8')) if self.flags & F_JSON else {}
+        msg['type'] = TYPE_NAMES.get(self.type, self.type)
+        if sender and 'from' not in msg:
+            msg['from'] = sender
+        if self.oid:
+            msg.setdefault('id', self.oid)
+        if self.type in (T_REQUEST, T_CHUNK):
+            msg.setdefault('chunk', self.index)
+        if self.type == T_REQUEST and len(self.payload):
+            msg['ranges'] = [list(r) for r in self.ranges()]
+        if self.type == T_REQUEST and self.version:
+            msg['fec'] = self.version
+        if self.type in (T_CHUNK, T_ACK):
+            msg.setdefault('version', self.version)
+        return msg
+
+
+def is_binary(data) -> bool:
+    return len(data) >= HEADER_SIZE and data[0] == MAGIC
+
+
+def encode_frame(mtype: int, oid: str = '', index: int = 0, version: int = 0, payload=b'', flags: int = 0) -> bytes:
+    oid_b = oid.encode('utf-8')
+    if len(oid_b) > 255:
+        raise WireError('object id too long for binary framing')
+    return b''.join((HEADER.pack(MAGIC, WIRE_VERSION, mtype, flags, version, index, len(oid_b)), oid_b, payload))
+
+
+def frame_buffer(mtype: int, payload_size: int, flags: int = 0, index: int = 0) -> bytearray:
+    """Buffer holding the header of an id-less frame, with room for a payload written in place."""
+    buf = bytearray(HEADER_SIZE + payload_size)
+    HEADER.pack_into(buf, 0, MAGIC, WIRE_VERSION, mtype, flags, 0, index, 0)
+    return buf
+
+
+def encode_chunk(oid: str, index: int, version: int, data, more: bool, checksum: int = None, codec: int = 0) -> bytes:
+    """`codec` non-zero means `data` is already compressed with that codec id; `checksum` is of the raw data."""
+    flags = F_MORE if more else 0
+    if codec:
+        flags |= F_COMP
+        data = b''.join((bytes((codec,)), data))
+    if checksum is not None:
+        flags |= F_CRC
+        data = b''.join((data, CRC.pack(checksum)))
+    return encode_frame(T_CHUNK, oid, index, version, data, flags)
+
+
+def encode_request(oid: str, ranges, fec: int = 0, flags: int = 0) -> bytes:
+    """`fec`: repair symbols wanted per coding group, carried in the version field."""
+    payload = b''.join(RANGE.pack(start, count) for start, count in ranges)
+    return encode_frame(T_REQUEST, oid, ranges[0][0] if ranges else 0, fec, payload, flags)
+
+
+def encode_repair(oid: str, group: int, version: int, row: int, k: int, symbol) -> bytes:
+    return encode_frame(T_REPAIR, oid, group, version, b''.join((REPAIR.pack(row, k), symbol)))
+
+
+def encode_message(msg: dict) -> bytes:
+    """Encode a JSON-style message dict as a binary frame.
+
+    CHUNK/REQUEST/ACK map onto header fields; anything else travels as a JSON payload.
+    `from` is dropped: binary frames are only exchanged with peers already known by address.
+    """
+    mtype = TYPE_CODES[msg['type']]
+    oid = msg.get('id') or ''
+    index = int(msg.get('chunk', 0))
+    version = int(msg.get('version', 0))
+    if mtype == T_CHUNK:
+        return encode_chunk(oid, index, version, msg['data'], bool(msg.get('more')), msg.get('checksum'))
+    if mtype == T_REQUEST and msg.get('ranges'):
+        return encode_request(oid, msg['ranges'], int(msg.get('fec', 0)))
+    if mtype in (T_REQUEST, T_ACK):
+        return encode_frame(mtype, oid, index, version)
+    rest = {k: v for k, v in msg.items() if k not in ('type', 'from')}
+    return encode_frame(mtype, payload=json.dumps(rest).encode('utf-8'), flags=F_JSON)
+
+
+def decode_frame(data) -> Frame:
+    if not is_binary(data):
+        raise WireError('not a binary frame')
+    magic, wver, mtype, flags, version, index, id_len = HEADER.unpack_from(data)
+    if wver != WIRE_VERSION:
+        raise WireError(f'unsupported wire version {wver}')
+    view = memoryview(data)
+    end = HEADER_SIZE + id_len
+    if end > len(view):
+        raise WireError('truncated frame')
+    oid = str(view[HEADER_SIZE:end], 'utf-8') if id_len else ''
+    return Frame(mtype, flags, version, index, oid, view[end:])
+
+
+def encode_json(msg: dict) -> bytes:
+    return json.dumps(msg).encode('utf-8')
+
+
+def decode_json(data) -> dict:
+    return json.loads(bytes(data).decode('utf-8'))
@@ -21,10 +21,15 @@ def test_key_exchange_and_secure_transfer():
         node_b.send_hello(('127.0.0.1', 12001))
 
         # wait for transfer
-        await asyncio.sleep(1.0)
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if 'objX' in node_b.storage:
+                break
 
         assert 'objX' in node_b.storage
         assert node_b.storage['objX'][0] == data
+        node_a.stop()
+        node_b.stop()
 
     asyncio.run(_run())
 
@@ -0,0 +1,20 @@
+import asyncio
+import random
+import pytest
+from mesh.bench_sync import parse_sizes, run_once
+
+
+def test_size_distributions():
+    rng = random.Random(1)
+    assert parse_sizes('fixed:4096')(rng) == 4096
+    assert all(10 <= parse_sizes('uniform:10:20')(rng) <= 20 for _ in range(50))
+    assert parse_sizes('lognormal:1000:0.5')(rng) > 0
+    with pytest.raises(ValueError):
+        parse_sizes('pareto:1')
+
+
+def test_small_run_converges_under_loss():
+    r = asyncio.run(run_once(nodes=3, objects=4, sizes='fixed:8192', encrypt=True, loss=0.05, seed=3,
+                             base_port=12121, timeout=30))
+    assert r['delivered_bytes'] == 2 * r['object_bytes']
+    assert r['transfers'] == 8 and r['converge_s'] > 0 and r['cpu_s_per_mb'] > 0
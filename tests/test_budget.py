@@ -0,0 +1,66 @@
+import asyncio
+from mesh.async_sync import CHUNK_SIZE, SyncNode
+from mesh.simnet import SimNetwork
+from mesh.transfer import IncomingTransfer
+
+
+def test_peer_reassembly_cap_defers_fetches():
+    net = SimNetwork(seed=21, latency=0.01)
+    a = net.add_node()
+    b = net.add_node(peer_reassembly=128 * 1024, max_fetches=16)
+    net.link(a.host, b.host, bandwidth=1024 * 1024)
+    for i in range(6):
+        a.add_object(f'o{i}', bytes([i]) * 64 * 1024, version=1)
+    peak = []
+
+    async def _run():
+        await net.start_all()
+        b.send_hello((a.host, a.port))
+        while len(b.storage) < 6 and net.now < 30:
+            peak.append(b.memory_stats()['reassembly_bytes'])
+            await asyncio.sleep(0.01)
+
+    net.run(_run())
+    stats = b.memory_stats()
+    assert len(b.storage) == 6 and max(peak) == 128 * 1024
+    assert stats['fetches_deferred'] > 0 and stats['reassembly_bytes'] == 0
+    net.close()
+
+
+def test_stalled_transfers_are_evicted():
+    net = SimNetwork(seed=22, latency=0.01)
+    a, b = net.add_node(), net.add_node(peer_ttl=0, stall_timeout=20.0)
+    a.add_object('obj', bytes(200 * 1024), version=1)
+
+    async def _run():
+        await net.start_all()
+        b.send_hello((a.host, a.port))
+        await asyncio.sleep(0.05)
+        net.partition([a.host], [b.host])  # the sender goes quiet mid-transfer
+        await asyncio.sleep(10.0)
+        assert b.memory_stats()['reassembly_bytes'] == 200 * 1024
+        await asyncio.sleep(40.0)
+
+    net.run(_run())
+    stats = b.memory_stats()
+    assert 'obj' not in b.pending and stats['reassembly_bytes'] == 0
+    assert stats['transfers_evicted'] == {'stalled': 1}
+    net.close()
+
+
+def test_unsized_chunks_far_out_or_over_the_budget_are_refused():
+    node = SyncNode('127.0.0.1', 12170, node_id='nodeB', peer_reassembly=64 * CHUNK_SIZE)
+    peer = ('127.0.0.1', 12171)
+    t = node.pending['obj'] = IncomingTransfer('obj', 1, peer, chunk_size=CHUNK_SIZE)
+    assert t.next_batch(0.0, peer) == [(0, 1)]
+
+    async def _run():
+        for idx in (10, 200000, 2 ** 32 - 1):  # never requested; the first is within the budget
+            await node._accept_chunk(peer, 'obj', idx, bytes(CHUNK_SIZE), 1, 1)
+        assert t.memory == 0 and len(t.received) == 1 and t.corrupt == 1
+        t.inflight[64] = t.sources[peer].inflight[64] = 0.0  # as if requested once 64 chunks were in
+        await node._accept_chunk(peer, 'obj', 64, bytes(CHUNK_SIZE), 1, 1)
+
+    asyncio.run(_run())
+    assert 'obj' not in node.pending and t.memory == 0
+    assert node.memory_stats()['transfers_evicted'] == {'oversize': 1}
@@ -0,0 +1,66 @@
+import asyncio
+import json
+import os
+import pytest
+from mesh import compress, wire
+from mesh.simnet import SimNetwork
+
+
+def test_codecs_roundtrip_and_bound_output():
+    data = json.dumps([{'id': i, 'name': f'node{i}', 'online': True} for i in range(50)]).encode()[:1024]
+    for name in compress.available():
+        packed = compress.CODECS[name].compress(data)
+        assert len(packed) < len(data) // 3
+        assert compress.decompress(name, packed, 1024) == data
+        with pytest.raises(compress.CompressionError):
+            compress.decompress(name, packed, 512)  # would expand past the limit
+    assert compress.negotiate(['lzma', 'zlib'], ['zlib']).name == 'zlib'
+    assert compress.negotiate(['zlib'], None) is None
+    assert not compress.worth_compressing(os.urandom(4096), compress.CODECS['zlib'])
+
+
+def test_compressed_chunk_frame():
+    data = b'{"k": "v"} ' * 90
+    zlib = compress.CODECS['zlib']
+    frame = wire.decode_frame(wire.encode_chunk('o', 3, 1, zlib.compress(data), True, 1234, zlib.cid))
+    assert frame.flags & wire.F_COMP
+    out, checksum = frame.chunk(1024)
+    assert bytes(out) == data and checksum == 1234
+    bad = wire.decode_frame(wire.encode_chunk('o', 3, 1, b'\xff' * 20, True, 1234, zlib.cid))
+    with pytest.raises(wire.WireError):
+        bad.chunk(1024)
+
+
+def _sync(objects, receiver_codecs=None):
+    net = SimNetwork(seed=1, latency=0.005)
+    a = net.add_node()
+    b = net.add_node(codecs=receiver_codecs)
+    for oid, data in objects.items():
+        a.add_object(oid, data, version=1)
+
+    async def _run():
+        await net.start_all()
+        b.send_key_exchange((a.host, a.port))
+        await asyncio.sleep(0.1)
+        b.send_hello((a.host, a.port))
+        await asyncio.sleep(3.0)
+
+    net.run(_run())
+    for oid, data in objects.items():
+        assert b.storage[oid] == (data, 1)
+    net.close()
+    return {k: sum(v.values()) for k, v in ((m.name, m.values) for m in a.metrics.metrics.values()) if 'compress' in k}, a
+
+
+def test_compressible_objects_shrink_and_random_data_is_skipped():
+    logs = '\n'.join(f'2026-10-18T12:{i % 60:02d}:00 node{i % 7} INFO synced object obj{i} v{i % 3}' for i in range(2000)).encode()
+    blob = os.urandom(64 * 1024)
+    stats, a = _sync({'log': logs, 'blob': blob})
+    assert stats['mesh_chunks_compressed_total'] >= len(logs) // 1024
+    assert stats['mesh_compression_saved_bytes_total'] > len(logs) // 2
+    assert stats['mesh_incompressible_objects_total'] == 1
+    sent = a.metrics.metrics['mesh_bytes_sent_total'].values
+    assert sum(v for (t, _), v in sent.items() if t == 'CHUNK') < len(logs) // 2 + len(blob) * 1.2
+
+    stats, _ = _sync({'log': logs}, receiver_codecs=[])
+    assert stats.get('mesh_chunks_compressed_total', 0) == 0
@@ -0,0 +1,87 @@
+import asyncio
+from mesh import crdt
+from mesh.async_sync import SyncNode
+from mesh.crdt import Replica, VersionVector
+
+
+def _sync(src: Replica, dst: Replica):
+    deltas = src.deltas_since(dst.vv)
+    if deltas is None:
+        dst.apply_state(src.crdt.state(), src.vv.to_dict())
+    else:
+        dst.apply_deltas(deltas)
+
+
+def test_concurrent_writers_converge():
+    a, b = Replica('gcounter', 'A'), Replica('gcounter', 'B')
+    a.update('increment', 3)
+    b.update('increment', 4)
+    b.update('increment')
+    _sync(a, b)
+    _sync(b, a)
+    assert a.value() == b.value() == 8
+    assert a.vv == b.vv == VersionVector({'A': 1, 'B': 2})
+
+    sa, sb = Replica('orset', 'A'), Replica('orset', 'B')
+    sa.update('add', 'x')
+    _sync(sa, sb)
+    sb.update('remove', 'x')
+    sa.update('add', 'x')  # concurrent re-add wins
+    sa.update('add', 'y')
+    _sync(sa, sb)
+    _sync(sb, sa)
+    assert sa.value() == sb.value() == {'x', 'y'}
+
+    ma, mb = Replica('lwwmap', 'A'), Replica('lwwmap', 'B')
+    ma.update('set', 'k', 'old', ts=1.0)
+    mb.update('set', 'k', 'new', ts=2.0)
+    mb.update('set', 'gone', 1, ts=1.0)
+    mb.update('delete', 'gone', ts=3.0)
+    _sync(ma, mb)
+    _sync(mb, ma)
+    assert ma.value() == mb.value() == {'k': 'new'}
+
+
+def test_deltas_cover_only_recent_ops(monkeypatch):
+    a, b = Replica('gcounter', 'A'), Replica('gcounter', 'B')
+    for _ in range(50):
+        a.update('increment')
+    _sync(a, b)
+    a.update('increment')
+    assert len(a.deltas_since(b.vv)) == 1
+    monkeypatch.setattr(crdt, 'MAX_DELTA_LOG', 5)
+    for _ in range(10):
+        a.update('increment')
+    assert a.deltas_since(b.vv) is None  # log truncated: full state instead
+    _sync(a, b)
+    assert b.value() == 61
+
+
+def test_nodes_replicate_crdt_deltas():
+    async def _run():
+        node_a = SyncNode('127.0.0.1', 12071, node_id='nodeA')
+        node_b = SyncNode('127.0.0.1', 12072, node_id='nodeB')
+        ca = node_a.add_crdt('visits', 'gcounter')
+        cb = node_b.add_crdt('visits', 'gcounter')
+        ca.update('increment', 5)
+        cb.update('increment', 2)
+        await node_a.start()
+        await node_b.start()
+        node_b.send_hello(('127.0.0.1', 12071))
+        node_a.send_hello(('127.0.0.1', 12072))
+        await asyncio.sleep(0.2)
+        assert ca.value() == cb.value() == 7
+        assert node_a.tree.root() == node_b.tree.root()
+
+        sent = []
+        orig = node_a._send_msg
+        node_a._send_msg = lambda msg, addr: (sent.append(msg), orig(msg, addr))
+        ca.update('increment')
+        node_b.send_hello(('127.0.0.1', 12071))
+        await asyncio.sleep(0.2)
+        assert cb.value() == 8
+        assert [m['deltas'] for m in sent if m['type'] == 'CRDT_DELTA'] == [[['nodeA', 2, {'nodeA': 6}]]]
+        node_a.stop()
+        node_b.stop()
+
+    asyncio.run(_run())
@@ -0,0 +1,80 @@
+import asyncio
+import pytest
+from mesh.crypto import SUITE_LEGACY, Session, Tickets, encrypt_and_mac, generate_keypair, resumed_secret, verify_and_decrypt
+from mesh.async_sync import SyncNode
+
+
+def _pair(aead):
+    pub_a, priv_a = generate_keypair()
+    pub_b, priv_b = generate_keypair()
+    return Session(priv_a, pub_a, pub_b, aead), Session(priv_b, pub_b, pub_a, aead)
+
+
+def test_aead_session_roundtrip_and_counter_nonces():
+    a, b = _pair(True)
+    first, second = a.seal(b'x' * 100), a.seal(b'x' * 100)
+    assert len(first) == 100 + a.overhead()
+    assert first[:12] != second[:12]  # counter advanced
+    assert b.open(first, True) == b'x' * 100
+    assert a.open(b.seal(b'reply'), True) == b'reply'
+    # each direction has its own key: a sealed payload does not open on the sending side
+    with pytest.raises(Exception):
+        a.open(a.seal(b'loop'), True)
+    tampered = bytearray(first)
+    tampered[20] ^= 1
+    with pytest.raises(Exception):
+        b.open(tampered, True)
+
+
+def test_legacy_session_matches_old_helpers():
+    a, b = _pair(False)
+    sealed = a.seal(b'old peer')
+    assert verify_and_decrypt(bytes(sealed[:12]), bytes(sealed[12:-32]), bytes(sealed[-32:]), b.enc_key, b.mac_key) == b'old peer'
+    n, ct, mac = encrypt_and_mac(b'from old peer', b.enc_key, b.mac_key)
+    assert a.open(n + ct + mac, False) == b'from old peer'
+    buf = bytearray(64)
+    assert a.open_into(n + ct + mac, buf, False) == len(b'from old peer')
+
+
+def test_tickets_resume_only_for_their_holder():
+    a, b = _pair(True)
+    assert a.resumption == b.resumption
+    tickets = Tickets(ttl=60)
+    ticket = tickets.issue('nodeA', b.resumption, now=0)
+    assert tickets.redeem(ticket, 'nodeA', now=30) == a.resumption
+    assert tickets.redeem(ticket, 'nodeC', now=30) is None  # issued to someone else
+    assert tickets.redeem(ticket, 'nodeA', now=61) is None  # expired
+    assert tickets.redeem(ticket[:-1] + bytes([ticket[-1] ^ 1]), 'nodeA', now=30) is None
+    assert Tickets(ttl=60).redeem(ticket, 'nodeA', now=30) is None  # another node's key
+    # both ends derive the same resumed keys from the secret and the two fresh nonces
+    secret = resumed_secret(a.resumption, b'c' * 16, b's' * 16)
+    ra = Session(None, b'c' * 16, b's' * 16, True, secret)
+    rb = Session(None, b's' * 16, b'c' * 16, True, resumed_secret(b.resumption, b'c' * 16, b's' * 16))
+    assert rb.open(ra.seal(b'resumed'), True) == b'resumed'
+    assert resumed_secret(a.resumption, b'c' * 16, b't' * 16) != secret
+
+
+def test_suite_negotiation():
+    async def _run():
+        node_a = SyncNode('127.0.0.1', 12081, node_id='nodeA')
+        node_b = SyncNode('127.0.0.1', 12082, node_id='nodeB')
+        node_c = SyncNode('127.0.0.1', 12083, node_id='nodeC')
+        node_c.suites = [SUITE_LEGACY]  # behaves like a peer without AEAD-only support
+        data = b'S' * 5000
+        node_a.add_object('objS', data, version=1)
+        for n in (node_a, node_b, node_c):
+            await n.start()
+        node_b.send_key_exchange(('127.0.0.1', 12081))
+        node_c.send_key_exchange(('127.0.0.1', 12081))
+        await asyncio.sleep(0.05)
+        assert node_a.peers[('127.0.0.1', 12082)]['session'].aead
+        assert not node_a.peers[('127.0.0.1', 12083)]['session'].aead
+        node_b.send_hello(('127.0.0.1', 12081))
+        node_c.send_hello(('127.0.0.1', 12081))
+        await asyncio.sleep(0.3)
+        assert node_b.storage['objS'] == (data, 1)
+        assert node_c.storage['objS'] == (data, 1)
+        for n in (node_a, node_b, node_c):
+            n.stop()
+
+    asyncio.run(_run())
@@ -0,0 +1,65 @@
+import asyncio
+import random
+from mesh import delta
+from mesh.async_sync import SyncNode
+
+
+def _edit(data: bytes, at: int, insert: bytes) -> bytes:
+    return data[:at] + insert + data[at + 10:]
+
+
+def test_segments_resynchronise_after_insert():
+    data = random.Random(7).randbytes(200 * 1024)
+    new = _edit(data, 100_000, b'inserted bytes')
+    r = delta.recipe(new)
+    assert sum(length for length, _ in r['segments']) == len(new)
+    reuse = delta.reusable_chunks(data, r, len(new), 1024)
+    nchunks = -(-len(new) // 1024)
+    assert nchunks - len(reuse) < 20
+    for idx, chunk in reuse.items():
+        assert chunk == new[idx * 1024:(idx + 1) * 1024]
+
+
+def test_delta_transfer_sends_only_changed_chunks():
+    async def _run():
+        old = random.Random(3).randbytes(256 * 1024)
+        new = _edit(old, 50_000, b'a small edit in the middle')
+        node_a = SyncNode('127.0.0.1', 12061, node_id='nodeA')
+        node_b = SyncNode('127.0.0.1', 12062, node_id='nodeB')
+        node_a.add_object('doc', new, version=2)
+        node_b.add_object('doc', old, version=1)
+        await node_a.start()
+        await node_b.start()
+        served = []
+        orig = node_a._send_chunk
+        node_a._send_chunk = lambda addr, oid, idx, *rest: (served.append(idx), orig(addr, oid, idx, *rest))
+        node_b.send_hello(('127.0.0.1', 12061))
+        await asyncio.sleep(0.5)
+        assert node_b.storage['doc'] == (new, 2)
+        assert 0 < len(served) < 20
+        node_a.stop()
+        node_b.stop()
+
+    asyncio.run(_run())
+
+
+def test_segments_are_hashed_off_the_event_loop():
+    data = random.Random(5).randbytes(2 * 1024 * 1024)
+    node = SyncNode('127.0.0.1', 12063, node_id='nodeA')
+    node.add_object('big', data, version=1)
+    ticks = []
+
+    async def _ticker():
+        while True:
+            ticks.append(node.clock())
+            await asyncio.sleep(0)
+
+    async def _run():
+        ticker = asyncio.ensure_future(_ticker())
+        found = await node._segment('big', 1)
+        ticker.cancel()
+        return found
+
+    avg, found = asyncio.run(_run())
+    assert [[length, h] for _, length, h in found] == delta.recipe(data)['segments']
+    assert len(ticks) > 8  # the loop kept running while blocks were hashed
@@ -0,0 +1,78 @@
+import asyncio
+import random
+from mesh import fec
+from mesh.async_sync import SyncNode
+from mesh.simnet import SimNetwork
+from mesh.transfer import IncomingTransfer, object_hash
+
+
+def test_any_k_pieces_rebuild_a_group():
+    rng = random.Random(5)
+    size = 1000
+    chunks = [rng.randbytes(size) for _ in range(fec.GROUP - 1)] + [rng.randbytes(300)]  # short last chunk
+    repairs = dict(enumerate(fec.encode(chunks, range(4), size)))
+    lost = rng.sample(range(fec.GROUP), 4)
+    have = {i: c for i, c in enumerate(chunks) if i not in lost}
+    got = fec.recover(fec.GROUP, have, {j: repairs[j] for j in (3, 0, 2, 1)}, size)
+    assert sorted(got) == sorted(lost)
+    assert all(got[i][:len(chunks[i])] == chunks[i] for i in lost)
+    assert fec.recover(fec.GROUP, have, {0: repairs[0]}, size) == {}  # too few pieces
+    assert fec.repair_count(0.0) == 0 and 0 < fec.repair_count(0.05) < fec.repair_count(0.2) <= fec.MAX_REPAIR
+
+
+def _fetch(fec_repair, loss=0.1, size=512 * 1024):
+    net = SimNetwork(seed=31, latency=0.1)
+    a, b = net.add_node(), net.add_node(fec_repair=fec_repair)
+    a.add_object('obj', random.Random(size).randbytes(size), version=1)
+
+    async def _run():
+        await net.start_all()
+        b.send_key_exchange((a.host, a.port))
+        await asyncio.sleep(1.0)
+        net.default.loss = loss
+        start = net.now
+        b.send_hello((a.host, a.port))
+        while 'obj' not in b.storage and net.now < 300:
+            await asyncio.sleep(0.05)
+        return net.now - start
+
+    took = net.run(_run())
+    assert b.storage['obj'] == a.storage['obj']
+    recovered = b.metrics.metrics['mesh_fec_recovered_chunks_total'].values.get((), 0)
+    net.close()
+    return took, recovered
+
+
+def test_repair_symbols_save_round_trips_on_a_lossy_link():
+    plain, none = _fetch(False)
+    coded, recovered = _fetch(True)
+    assert none == 0 and recovered > 20
+    assert coded < plain
+
+
+def test_repair_symbols_with_a_bad_row_or_sender_are_dropped():
+    size = 1024
+    chunks = [bytes([i]) * size for i in range(fec.GROUP)]
+    repairs = fec.encode(chunks, range(2), size)
+    node = SyncNode('127.0.0.1', 12160, node_id='nodeB')
+    peer = ('127.0.0.1', 12161)
+    t = node.pending['obj'] = IncomingTransfer('obj', 1, peer, size=size * fec.GROUP, chunk_size=size,
+                                               digest=object_hash(b''.join(chunks)))
+    for i in range(2, fec.GROUP):
+        t.on_chunk(i, chunks[i], True, 0.0)
+
+    async def _run():
+        await node.start()
+        stranger = ('127.0.0.1', 12162)  # not a source of the transfer
+        await node._accept_chunk(stranger, 'obj', 0, chunks[0], 1, 1)
+        await node._accept_repair(stranger, 'obj', 0, 1, 0, fec.GROUP, repairs[0])
+        assert not t.has(0) and t.repairs is None
+        await node._accept_repair(peer, 'obj', 0, 1, 0, fec.GROUP, repairs[0])
+        for row, k in ((200, fec.GROUP), (fec.MAX_REPAIR, fec.GROUP), (1, 0), (1, fec.GROUP + 1)):
+            await node._accept_repair(peer, 'obj', 0, 1, row, k, repairs[1])
+        assert t.repairs.get(0) == {0: repairs[0]}
+        await node._accept_repair(peer, 'obj', 0, 1, 1, fec.GROUP, repairs[1])
+        node.stop()
+
+    asyncio.run(_run())
+    assert node.storage['obj'] == (b''.join(chunks), 1)
@@ -0,0 +1,54 @@
+import asyncio
+from mesh.fetch import FetchQueue, matches, normalize
+from mesh.simnet import SimNetwork
+
+
+def test_queue_orders_by_priority_then_size():
+    q = FetchQueue({'alerts/': 10, 'video/': -1, 'video/thumbs/': 5})
+    q.push({'id': 'video/a', 'version': 1, 'size': 10}, 'p1')
+    q.push({'id': 'docs/big', 'version': 1, 'size': 5000}, 'p1')
+    q.push({'id': 'docs/small', 'version': 1, 'size': 50}, 'p1')
+    q.push({'id': 'alerts/x', 'version': 1, 'size': 1 << 20}, 'p1')
+    q.push({'id': 'video/thumbs/1', 'version': 1, 'size': 100}, 'p1')
+    q.push({'id': 'docs/small', 'version': 1, 'size': 50}, 'p2')  # same version: another source
+    q.push({'id': 'docs/big', 'version': 2, 'size': 40}, 'p2')  # newer version supersedes
+    order = []
+    while q:
+        item = q.pop()
+        order.append((item['entry']['id'], item['version'], item['peers']))
+    assert order == [('alerts/x', 1, ['p1']), ('video/thumbs/1', 1, ['p1']), ('docs/big', 2, ['p2']),
+                     ('docs/small', 1, ['p1', 'p2']), ('video/a', 1, ['p1'])]
+    assert q.pop() is None
+    assert matches('a/1', None) and matches('a/1', normalize(['b/', 'a/'])) and not matches('c/1', ('a/',))
+
+
+def test_subscribed_node_only_sees_its_namespaces():
+    net = SimNetwork(seed=7, latency=0.01)
+    a = net.add_node()
+    b = net.add_node(subscribe=['alerts/'], max_fetches=2)
+    for i in range(3):
+        a.add_object(f'alerts/{i}', b'alert %d' % i * 100, version=1)
+    for i in range(30):
+        a.add_object(f'logs/{i}', b'log %d' % i * 100, version=1)
+    seen = []
+    orig = b._on_digests
+
+    def _on_digests(msg, addr):
+        seen.extend(e['id'] for e in msg.get('digests', []))
+        return orig(msg, addr)
+    b._on_digests = _on_digests
+
+    async def _run():
+        await net.start_all()
+        b.send_hello((a.host, a.port))
+        await asyncio.sleep(2.0)
+        a.add_object('alerts/new', b'urgent', version=1)
+        a.add_object('logs/new', b'noise', version=1)
+        await asyncio.sleep(2.0)
+
+    net.run(_run())
+    assert sorted(b.storage) == ['alerts/0', 'alerts/1', 'alerts/2', 'alerts/new']
+    assert seen and all(oid.startswith('alerts/') for oid in seen)
+    assert a.peers[(b.host, b.port)]['subscribe'] == ('alerts/',)
+    assert a._tree_for(('alerts/',)).root() == b.tree.root()
+    net.close()
@@ -0,0 +1,64 @@
+import asyncio
+import random
+import pytest
+from mesh import async_sync, fragment, wire
+from mesh.simnet import SimNetwork
+
+
+def test_fragments_reassemble_in_any_order_within_bounds():
+    data = random.Random(1).randbytes(5000)
+    frags = fragment.split(data, 1200, msg_id=7)
+    assert len(frags) == 5 and all(len(f) <= 1200 for f in frags)
+    r = fragment.Reassembler(timeout=5.0, peer_partials=2)
+    order = [4, 0, 4, 2, 1]  # out of order, one duplicate
+    assert [r.add('a', wire.decode_frame(frags[i]), now=0.0) for i in order] == [None] * 5
+    assert r.add('a', wire.decode_frame(frags[3]), now=1.0) == data and len(r) == 0 and r.bytes == 0
+    # a third message from the same peer evicts the oldest, and partials time out
+    for msg_id in (1, 2, 3):
+        r.add('a', wire.decode_frame(fragment.split(data, 1200, msg_id)[0]), now=2.0)
+    assert len(r) == 2 and r.dropped['evicted'] == 1
+    r.expire(now=7.5)
+    assert len(r) == 0 and r.bytes == 0 and r.dropped['timeout'] == 2
+    with pytest.raises(fragment.FragmentError):  # more than a receiver reassembles
+        fragment.split(bytes(fragment.MAX_MESSAGE + 1), 9000, msg_id=8)
+
+
+def test_path_mtu_search_converges():
+    pmtu = fragment.PathMtu(1200, 9000)
+    while pmtu.next_probe() is not None:
+        size = pmtu.next_probe()
+        for _ in range(fragment.PROBE_TRIES):
+            if size <= 4000:
+                pmtu.acked(size)
+                break
+            pmtu.lost(size)
+    assert 4000 - fragment.PROBE_RESOLUTION < pmtu.mtu <= 4000 < pmtu.ceiling + 1
+    pmtu.restart()
+    assert pmtu.mtu == 1200 and pmtu.ceiling == 9000
+
+
+def test_large_digests_cross_a_small_mtu_link(monkeypatch):
+    monkeypatch.setattr(async_sync, 'DIGEST_BYTES', 64 * 1024)  # one DIGESTS message, fragmented
+    net = SimNetwork(seed=23, latency=0.01)
+    a, b = net.add_node(), net.add_node()
+    net.link(a.host, b.host, mtu=1300)
+    for i in range(30):
+        a.add_object(f'{i:03d}/' + 'x' * 120, bytes([i]) * 100, version=1)  # DIGESTS of ~7 KB
+
+    async def _run():
+        await net.start_all()
+        b.send_key_exchange((a.host, a.port))
+        await asyncio.sleep(0.5)
+        b.send_hello((a.host, a.port))
+        while len(b.storage) < 30 and net.now < 10:
+            await asyncio.sleep(0.1)
+        await asyncio.sleep(10.0)  # probes lost to the MTU wait an RTO each
+
+    net.run(_run())
+    assert len(b.storage) == 30
+    assert a.metrics.metrics['mesh_fragmented_datagrams_total'].values[()] >= 1
+    pmtu = a.peers[(b.host, b.port)]['pmtu']
+    assert 1300 - fragment.PROBE_RESOLUTION < pmtu.mtu <= 1300 and not pmtu.searching
+    assert net.stats['dropped_mtu'] == 2 * 2  # two probe sizes over 1300, PROBE_TRIES each; b never sends that much
+    assert b.peers[(a.host, a.port)].get('pmtu_timer') is None
+    net.close()
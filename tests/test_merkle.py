@@ -0,0 +1,97 @@
+import asyncio
+import json
+from mesh.async_sync import DIGEST_BYTES, SyncNode
+from mesh.merkle import EMPTY, MerkleTree
+
+
+def _descend(a: MerkleTree, b: MerkleTree):
+    """Objects a must send so that b catches up, found by comparing subtrees top-down."""
+    frontier, found = [''], []
+    while frontier:
+        nxt = []
+        for p in frontier:
+            if a.is_leaf(p):
+                found.extend(a.objects_under(p))
+            else:
+                nxt.extend(b.diff_children(p, a.children(p)))
+        frontier = nxt
+    return sorted(oid for oid in found if b.entries.get(oid, (None,))[0] != a.entries[oid][0])
+
+
+def test_incremental_updates_match_rebuild():
+    a, b = MerkleTree(), MerkleTree()
+    assert a.root() == EMPTY
+    for i in range(500):
+        a.update(f'obj{i}', 1)
+    a.update('obj7', 2)
+    a.remove('obj8')
+    for i in reversed(range(500)):
+        if i != 8:
+            b.update(f'obj{i}', 2 if i == 7 else 1)
+    assert a.root() == b.root() != EMPTY
+
+
+def test_descent_finds_only_differences():
+    a, b = MerkleTree(), MerkleTree()
+    for i in range(1000):
+        a.update(f'obj{i}', 1)
+        b.update(f'obj{i}', 1)
+    a.update('obj3', 2)
+    a.update('new', 1)
+    assert a.root() != b.root()
+    assert _descend(a, b) == ['new', 'obj3']
+
+
+def test_synced_nodes_exchange_one_round_trip():
+    async def _run():
+        node_a = SyncNode('127.0.0.1', 12041, node_id='nodeA')
+        node_b = SyncNode('127.0.0.1', 12042, node_id='nodeB')
+        for i in range(300):
+            node_a.add_object(f'obj{i}', b'x' * 10, version=1)
+            node_b.add_object(f'obj{i}', b'x' * 10, version=1)
+        node_a.add_object('extra', b'payload', version=1)
+        await node_a.start()
+        await node_b.start()
+        sent = []
+        orig = node_a._send_msg
+        node_a._send_msg = lambda msg, addr: (sent.append(msg), orig(msg, addr))
+        node_b.send_hello(('127.0.0.1', 12041))
+        await asyncio.sleep(0.3)
+        assert node_b.storage['extra'] == (b'payload', 1)
+        assert [m['type'] for m in sent] == ['TREE', 'TREE', 'DIGESTS']
+        ids = [d['id'] for d in sent[2]['digests']]
+        assert 'extra' in ids and len(ids) < 10
+
+        sent.clear()
+        node_b.send_hello(('127.0.0.1', 12041))
+        await asyncio.sleep(0.1)
+        assert len(sent) == 1 and sent[0]['digests'] == []
+        node_a.stop()
+        node_b.stop()
+
+    asyncio.run(_run())
+
+
+def test_empty_node_catches_up_on_thousands_of_objects():
+    async def _run():
+        node_a = SyncNode('127.0.0.1', 12043, node_id='nodeA')
+        node_b = SyncNode('127.0.0.1', 12044, node_id='nodeB')
+        for i in range(5000):
+            node_a.add_object('obj%05d' % i, b'v%d' % i, version=1)
+        await node_a.start()
+        await node_b.start()
+        sizes = []
+        orig = node_a._send_msg
+        node_a._send_msg = lambda msg, addr: (sizes.append(len(json.dumps(msg.get('digests', [])))), orig(msg, addr))
+        node_b.send_hello(('127.0.0.1', 12043))
+        for _ in range(100):
+            await asyncio.sleep(0.1)
+            if len(node_b.storage) == 5000:
+                break
+        assert node_b.tree.root() == node_a.tree.root()
+        assert max(sizes) <= DIGEST_BYTES + 2
+        assert node_a.metrics.metrics['mesh_fragmented_datagrams_total'].values.get((), 0) == 0
+        node_a.stop()
+        node_b.stop()
+
+    asyncio.run(_run())
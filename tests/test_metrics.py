@@ -0,0 +1,77 @@
+import asyncio
+import json
+import os
+from mesh.async_sync import SyncNode
+from mesh.metrics import Registry, Tracer
+
+
+def test_registry_snapshot_and_export():
+    reg = Registry()
+    c = reg.counter('msgs_total', 'Messages', ('type',))
+    c.inc(('HELLO',))
+    c.inc(('CHUNK',), 3)
+    reg.gauge('depth', 'Queue depth', fn=lambda: 7)
+    h = reg.histogram('lat_seconds', 'Latency', buckets=[0.001, 0.01, 0.1])
+    for v in (0.0005, 0.005, 0.005, 0.05):
+        h.observe(v)
+    snap = reg.snapshot()
+    assert {s['labels']['type']: s['value'] for s in snap['msgs_total']['samples']} == {'HELLO': 1, 'CHUNK': 3}
+    assert snap['depth']['samples'] == [{'labels': {}, 'value': 7}]
+    lat = snap['lat_seconds']['samples'][0]
+    assert lat['count'] == 4 and 0.001 <= lat['p50'] <= 0.01
+    text = reg.export_text()
+    assert 'msgs_total{type="CHUNK"} 3' in text
+    assert 'lat_seconds_bucket{le="0.01"} 3' in text and 'lat_seconds_bucket{le="+Inf"} 4' in text
+    assert 'lat_seconds_count 4' in text
+
+
+def test_tracer_sampling():
+    tr = Tracer()
+    assert not tr.enabled and tr.start('CHUNK') is None
+    tr.rates = {'HELLO': 1.0}
+    assert tr.start('CHUNK') is None
+    span = tr.start('HELLO', 'peer')
+    tr.finish(span, ValueError('x'))
+    assert tr.snapshot()[0]['name'] == 'HELLO' and 'ValueError' in tr.snapshot()[0]['error']
+
+
+def test_node_records_transfer_metrics():
+    async def _run():
+        node_a = SyncNode('127.0.0.1', 12111, node_id='nodeA')
+        node_b = SyncNode('127.0.0.1', 12112, node_id='nodeB', trace_rate=1.0)
+        data = os.urandom(64 * 1024)
+        node_a.add_object('obj', data, version=1)
+        await node_a.start()
+        await node_b.start()
+        server = await node_b.serve_metrics('127.0.0.1', 12113)
+        node_b.send_key_exchange(('127.0.0.1', 12111))
+        await asyncio.sleep(0.05)
+        node_b.send_hello(('127.0.0.1', 12111))
+        for _ in range(40):
+            await asyncio.sleep(0.05)
+            if 'obj' in node_b.storage:
+                break
+        assert node_b.storage['obj'] == (data, 1)
+        peer = '127.0.0.1:12111'
+        m = node_b.metrics_snapshot()['metrics']
+        received = {(s['labels']['type'], s['labels']['peer']): s['value'] for s in m['mesh_messages_received_total']['samples']}
+        assert received[('CHUNK', peer)] == 64
+        sent = {s['labels']['type']: s['value'] for s in m['mesh_messages_sent_total']['samples']}
+        assert sent['HELLO'] == 1 and sent['REQUEST'] >= 1
+        assert {s['labels']['op'] for s in m['mesh_crypto_seconds']['samples']} == {'seal', 'open'}
+        assert m['mesh_chunk_rtt_seconds']['samples'][0]['count'] > 0
+        assert m['mesh_transfers_total']['samples'] == [{'labels': {'result': 'complete'}, 'value': 1}]
+        assert m['mesh_transfer_bytes_total']['samples'][0]['value'] == len(data)
+        assert {s['name'] for s in node_b.tracer.snapshot()} >= {'CHUNK', 'DIGESTS'}
+
+        reader, writer = await asyncio.open_connection('127.0.0.1', 12113)
+        writer.write(b'GET /metrics.json HTTP/1.1\r\nHost: x\r\n\r\n')
+        response = await reader.read()
+        writer.close()
+        head, body = response.split(b'\r\n\r\n', 1)
+        assert head.startswith(b'HTTP/1.1 200') and 'mesh_bytes_received_total' in json.loads(body)
+        node_a.stop()
+        node_b.stop()
+        await server.wait_closed()
+
+    asyncio.run(_run())
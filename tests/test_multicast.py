@@ -0,0 +1,80 @@
+import asyncio
+import random
+from mesh import fec, multicast
+from mesh.simnet import SimNetwork
+
+
+def test_repair_count_grows_with_loss_and_members():
+    assert multicast.repair_count(0.0, 30) == multicast.MIN_REPAIR
+    assert multicast.repair_count(0.05, 1) < multicast.repair_count(0.05, 30) < multicast.repair_count(0.2, 30)
+    assert multicast.repair_count(0.5, 100) == fec.MAX_REPAIR
+
+
+def test_distribute_sends_an_object_once_to_many_peers():
+    net = SimNetwork(seed=11, latency=0.005)
+    sender = net.add_node(fanout=0, anti_entropy=0)
+    peers = [net.add_node(fanout=0, anti_entropy=0) for _ in range(12)]
+    data = random.Random(3).randbytes(128 * 1024)
+    sender.add_object('fw/bundle', data, version=1)
+    peers[0].add_object('fw/bundle', data, version=1)  # has it already: declines
+    heard = []
+
+    class Eavesdropper:
+        def connection_made(self, transport):
+            pass
+
+        def datagram_received(self, datagram, addr):
+            heard.append(datagram)
+
+    async def _run():
+        await net.start_all()
+        await net.listen_group(net.loop, multicast.DEFAULT_GROUP, '10.9.9.9', Eavesdropper)
+        for p in peers:
+            p.send_key_exchange((sender.host, sender.port))
+        await asyncio.sleep(1.0)
+        for p in peers:
+            sender.send_hello((p.host, p.port))
+        await asyncio.sleep(0.5)
+        net.default.loss = 0.05
+        members = await sender.distribute('fw/bundle')
+        while not all('fw/bundle' in p.storage for p in peers) and net.now < 60:
+            await asyncio.sleep(0.1)
+        return members
+
+    members = net.run(_run())
+    assert sorted(members) == sorted((p.host, p.port) for p in peers[1:])
+    assert all(p.storage.read('fw/bundle') == data for p in peers)
+    # unicast would cost 11 copies; the stream is one, and the gaps are few
+    sent = sum(sender.metrics.metrics['mesh_bytes_sent_total'].values.values())
+    assert sent < 3 * len(data)
+    assert net.stats['multicast'] >= len(data) // 1024
+    # the group only carries sealed frames
+    assert heard and not any(data[i:i + 64] in d for d in heard for i in (0, 40000, 90000))
+    assert not any(p._groups or p._mcast_in for p in peers)
+    net.close()
+
+
+def test_a_multicast_copy_that_fails_its_hash_is_fetched_again_by_unicast():
+    net = SimNetwork(seed=12, latency=0.005)
+    sender, peer = net.add_node(fanout=0, anti_entropy=0), net.add_node(fanout=0, anti_entropy=0)
+    data = random.Random(4).randbytes(64 * 1024)
+    sender.add_object('fw/bundle', data, version=1)
+
+    async def _run():
+        await net.start_all()
+        peer.send_key_exchange((sender.host, sender.port))
+        await asyncio.sleep(1.0)
+        sender.send_hello((peer.host, peer.port))
+        await asyncio.sleep(0.5)
+        task = asyncio.ensure_future(sender.distribute('fw/bundle'))
+        while not (peer.pending.get('fw/bundle') and peer.pending['fw/bundle'].has(0)):
+            await asyncio.sleep(0.001)
+        peer.pending['fw/bundle'].buf.write(0, bytes(1024))  # as if another member had injected chunk 0
+        await task
+        while 'fw/bundle' not in peer.storage and net.now < 30:
+            await asyncio.sleep(0.1)
+
+    net.run(_run())
+    assert peer.storage.read('fw/bundle') == data
+    assert peer.metrics.metrics['mesh_transfers_total'].values[('corrupt',)] == 1
+    net.close()
@@ -0,0 +1,61 @@
+import asyncio
+import os
+
+import pytest
+
+from mesh.objectio import ReadError
+from mesh.simnet import SimNetwork
+from mesh.storage import LogStore
+
+
+def test_read_while_downloading(tmp_path):
+    net = SimNetwork(seed=11, latency=0.01)
+    a = net.add_node(storage=LogStore(str(tmp_path / 'a')))
+    b = net.add_node()
+    net.link(a.host, b.host, bandwidth=512 * 1024)
+    data = os.urandom(1024 * 1024)
+    path = tmp_path / 'video.bin'
+    path.write_bytes(data)
+    assert a.add_object_from_file('video', str(path), version=2) == len(data)
+    got, progress = [], []
+
+    async def _run():
+        await net.start_all()
+        b.send_hello((a.host, a.port))
+        while 'video' not in b.pending and 'video' not in b.fetches:
+            await asyncio.sleep(0.01)
+        async for piece in b.open_object('video'):
+            got.append(piece)
+            progress.append('video' in b.storage)
+
+    net.run(_run())
+    assert b''.join(got) == data and b.storage['video'] == (data, 2)
+    assert len(got) > 2 and not progress[0]  # the first pieces came from the partial transfer
+    net.close()
+
+
+def test_add_from_async_iterator_and_failed_transfer(tmp_path):
+    net = SimNetwork(seed=12, latency=0.01)
+    a, b = net.add_node(), net.add_node()
+
+    async def pieces():
+        for i in range(64):
+            yield bytes([i]) * 4096
+
+    async def _run():
+        await net.start_all()
+        size = await a.add_object_stream('log', pieces(), version=1)
+        assert size == 64 * 4096 and a.storage.size('log') == size
+        a.storage._digests['log'] = '00' * 32  # advertise a hash the data will not match
+        b.send_hello((a.host, a.port))
+        while 'log' not in b.pending:
+            await asyncio.sleep(0.01)
+        with pytest.raises(ReadError):
+            async for _ in b.open_object('log'):
+                pass
+        with pytest.raises(KeyError):
+            b.open_object('nothing')
+
+    net.run(_run())
+    assert 'log' not in b.storage and not b._readers
+    net.close()
@@ -0,0 +1,61 @@
+import asyncio
+from mesh.peers import PeerQuality
+from mesh.simnet import SimNetwork
+
+
+def test_quality_estimate_prefers_fast_clean_links():
+    near, far = PeerQuality(0.0), PeerQuality(0.0)
+    for _ in range(20):
+        near.rtt.sample(0.005)
+        far.rtt.sample(0.2)
+    near.rate_sample(10e6)
+    far.rate_sample(1e6)
+    near.delivered(100)
+    far.delivered(90)
+    far.lost(10)
+    assert near.loss == 0 and 0.2 < far.loss < 0.5
+    assert near.estimate(1 << 20) < far.estimate(1 << 20) and near.score() > far.score()
+
+
+def test_peer_table_ranks_links_from_observed_traffic():
+    net = SimNetwork(seed=5, latency=0.005)
+    b = net.add_node()
+    near, far = net.add_node(), net.add_node()
+    net.link(b.host, far.host, latency=0.1, bandwidth=256 * 1024, loss=0.05)
+    for i in range(4):
+        near.add_object(f'n{i}', bytes(range(256)) * 128, version=1)
+        far.add_object(f'f{i}', bytes(range(256)) * 128, version=1)
+
+    async def _run():
+        await net.start_all()
+        for peer, prefix in ((near, 'n'), (far, 'f')):
+            while sum(oid.startswith(prefix) for oid in b.storage) < 4 and net.now < 30:
+                b.send_hello((peer.host, peer.port))
+                await asyncio.sleep(1.0)
+
+    net.run(_run())
+    table = b.peer_table()
+    n, f = table[f'{near.host}:9000'], table[f'{far.host}:9000']
+    assert n['srtt'] < 0.05 < 0.2 <= f['srtt']
+    assert f['loss'] > n['loss'] and n['throughput'] > f['throughput']
+    assert b.rank_peers()[:2] == [(near.host, 9000), (far.host, 9000)]
+    net.close()
+
+
+def test_silent_peers_are_evicted_and_their_transfers_parked():
+    net = SimNetwork(seed=6, latency=0.01)
+    a, b = net.add_node(), net.add_node(peer_ttl=30.0)
+    a.add_object('obj', bytes(200 * 1024), version=1)
+
+    async def _run():
+        await net.start_all()
+        b.send_hello((a.host, a.port))
+        await asyncio.sleep(0.05)
+        net.partition([a.host], [b.host])  # a goes away mid-transfer
+        await asyncio.sleep(60.0)
+
+    net.run(_run())
+    assert (a.host, a.port) not in b.peers and b.metrics.metrics['mesh_peers_evicted_total'].values[()] == 1
+    t = b.pending['obj']
+    assert not t.sources and 0 < t.nreceived < t.nchunks
+    net.close()
@@ -0,0 +1,48 @@
+import asyncio
+from mesh import wire
+from mesh.receiver import LANE_BULK, LANE_CONTROL, ReceivePipeline, classify
+
+
+class RecordingNode:
+    node_id = 'rec'
+
+    def __init__(self):
+        self.seen = []
+
+    async def handle_frame(self, frame, addr):
+        self.seen.append((addr, frame.type, frame.index))
+
+    async def handle_message(self, msg, addr, nbytes=0):
+        self.seen.append((addr, msg['type'], None))
+
+
+def _chunk(i):
+    return wire.encode_chunk('o', i, 1, b'x' * 16, True)
+
+
+def test_classify():
+    assert classify(_chunk(0)) == LANE_BULK
+    assert classify(wire.encode_message({'type': 'HELLO'})) == LANE_CONTROL
+    assert classify(wire.frame_buffer(wire.T_ENCRYPTED, 8, wire.F_BULK)) == LANE_BULK
+    assert classify(b'{"type": "HELLO"}') == LANE_CONTROL
+
+
+def test_per_peer_order_control_first_and_bounded_queues():
+    async def _run():
+        node = RecordingNode()
+        rx = ReceivePipeline(node, workers=2, max_total=7)
+        rx.limits = (4, 6)
+        rx.start()
+        for i in range(8):
+            rx.submit(_chunk(i), 'A')
+        rx.submit(b'{"type": "HELLO"}', 'A')
+        rx.submit(b'not json', 'B')
+        # A's bulk lane holds 6; at the global cap, B's control datagram evicts A's newest chunk
+        assert rx.dropped == [0, 3] and rx.total == 7
+        await asyncio.sleep(0.01)
+        assert node.seen[0] == ('A', 'HELLO', None)
+        assert [i for _, _, i in node.seen[1:]] == [0, 1, 2, 3, 4]
+        assert rx.stats()['control']['received'] == 2 and not rx.inboxes
+        rx.stop()
+
+    asyncio.run(_run())
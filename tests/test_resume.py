@@ -0,0 +1,73 @@
+import asyncio
+import os
+from mesh.async_sync import SyncNode
+from mesh.transfer import IncomingTransfer, chunk_checksum, object_hash, state_path
+
+
+def test_reordered_duplicate_and_corrupt_chunks():
+    data = os.urandom(10)
+    t = IncomingTransfer('o', 1, None, size=10, chunk_size=4, digest=object_hash(data))
+    t.next_batch(0.0)
+    parts = [data[0:4], data[4:8], data[8:10]]
+    t.on_chunk(2, parts[2], False, 0.1, chunk_checksum(parts[2]))
+    t.on_chunk(0, parts[0], True, 0.1, chunk_checksum(parts[0]))
+    t.on_chunk(0, parts[0], True, 0.1, chunk_checksum(parts[0]))
+    t.on_chunk(1, b'XXXX', True, 0.1, chunk_checksum(parts[1]))
+    assert t.corrupt == 1 and not t.complete() and 1 in t.inflight
+    t.on_chunk(1, parts[1], True, 0.2, chunk_checksum(parts[1]))
+    assert t.complete() and t.assemble() == data
+
+
+def test_hash_mismatch_is_rejected():
+    t = IncomingTransfer('o', 1, None, size=4, chunk_size=4, digest=object_hash(b'good'))
+    t.on_chunk(0, b'evil', False, 0.0)
+    assert t.complete() and t.assemble() is None
+
+
+def test_partial_state_survives_restart(tmp_path):
+    data = os.urandom(4096)
+    path = state_path(str(tmp_path), 'obj')
+    t = IncomingTransfer('obj', 3, ('127.0.0.1', 1), size=len(data), chunk_size=1024, digest=object_hash(data), path=path)
+    t.on_chunk(0, data[:1024], True, 0.0)
+    t.on_chunk(2, data[2048:3072], True, 0.0)
+    t.park()
+    t.close()
+
+    r = IncomingTransfer.load(path)
+    assert (r.oid, r.version, r.peer, r.nreceived) == ('obj', 3, None, 2)
+    assert r.next_batch(0.0) == [(1, 1), (3, 1)]
+    r.on_chunk(1, data[1024:2048], True, 0.0)
+    r.on_chunk(3, data[3072:], False, 0.0)
+    assert r.assemble() == data
+    r.remove()
+    assert not os.listdir(tmp_path)
+
+
+def test_node_resumes_parked_transfer(tmp_path):
+    async def _run():
+        data = os.urandom(8 * 1024)
+        path = state_path(str(tmp_path), 'doc')
+        t = IncomingTransfer('doc', 1, None, size=len(data), chunk_size=1024, digest=object_hash(data), path=path)
+        for i in range(6):
+            t.on_chunk(i, data[i * 1024:(i + 1) * 1024], True, 0.0)
+        t.park()
+        t.close()
+
+        node_a = SyncNode('127.0.0.1', 12031, node_id='nodeA')
+        node_b = SyncNode('127.0.0.1', 12032, node_id='nodeB', state_dir=str(tmp_path))
+        assert node_b.pending['doc'].next_idx == 6
+        node_a.add_object('doc', data, version=1)
+        await node_a.start()
+        await node_b.start()
+        requested = []
+        orig = node_b._send_request
+        node_b._send_request = lambda addr, oid, ranges, *rest: (requested.extend(ranges), orig(addr, oid, ranges, *rest))
+        node_b.send_hello(('127.0.0.1', 12031))
+        await asyncio.sleep(0.3)
+        assert node_b.storage['doc'] == (data, 1)
+        assert requested == [(6, 2)]
+        assert not os.listdir(tmp_path)
+        node_a.stop()
+        node_b.stop()
+
+    asyncio.run(_run())
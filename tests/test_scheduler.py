@@ -0,0 +1,96 @@
+import asyncio
+import os
+import time
+from mesh.async_sync import SyncNode
+from mesh.scheduler import LANE_BULK, LANE_CONTROL, SendScheduler
+
+
+def test_control_lane_and_fair_queueing():
+    out = []
+    s = SendScheduler(lambda data, addr: out.append((data, addr)))
+    s.pause()
+    for i in range(3):
+        s.send(b'a' * 1400, 'A', LANE_BULK)
+        s.send(b'b' * 1400, 'B', LANE_BULK)
+    s.send(b'hello', 'B', LANE_CONTROL)
+    # bulk waits while the transport is paused, control does not
+    assert out == [(b'hello', 'B')]
+    assert s.congested('A') and s.queued() == 6
+    s.resume()
+    assert [addr for _, addr in out[1:]] == ['A', 'B', 'A', 'B', 'A', 'B']
+    assert s.sent == [1, 6]
+
+    s.send(b'a' * 1400, 'A', LANE_BULK)
+    s.send(b'b' * 1400, 'B', LANE_BULK)
+    s.pause()
+    s.send(b'a' * 1400, 'A', LANE_BULK)
+    s.forget('A')  # still has bulk queued
+    s.forget('B')
+    assert set(s.peers) == {'A'}
+    s.forget('A', drop=True)
+    assert not s.peers and not s.active and s.queued() == 0
+
+
+def test_token_bucket_paces_bulk_but_not_control():
+    async def _run():
+        out = []
+        s = SendScheduler(lambda data, addr: out.append((time.monotonic(), data)), peer_rate=20000, burst=2000)
+        start = time.monotonic()
+        for _ in range(6):
+            s.send(b'x' * 1000, 'A', LANE_BULK)
+        s.send(b'ping', 'A', LANE_CONTROL)
+        assert b'ping' in [d for _, d in out]
+        assert len(out) < 7
+        await asyncio.sleep(0.4)
+        assert len(out) == 7
+        # 4000 bytes over the burst at 20 kB/s
+        assert out[-1][0] - start >= 0.15
+        s.close()
+
+    asyncio.run(_run())
+
+
+def test_producers_wait_for_writable():
+    async def _run():
+        s = SendScheduler(lambda data, addr: None, max_queue=2)
+        s.pause()
+        s.send(b'1', 'A', LANE_BULK)
+        s.send(b'2', 'A', LANE_BULK)
+        waiter = asyncio.ensure_future(s.writable('A'))
+        await asyncio.sleep(0.01)
+        assert not waiter.done()
+        s.resume()
+        await asyncio.wait_for(waiter, 1)
+        assert s.queued('A') == 0
+
+    asyncio.run(_run())
+
+
+def test_handshake_stays_fast_during_rate_limited_transfer():
+    async def _run():
+        node_a = SyncNode('127.0.0.1', 12101, node_id='nodeA', peer_rate=200 * 1024)
+        node_b = SyncNode('127.0.0.1', 12102, node_id='nodeB')
+        node_c = SyncNode('127.0.0.1', 12103, node_id='nodeC')
+        data = os.urandom(200 * 1024)
+        node_a.add_object('bulk', data, version=1)
+        for n in (node_a, node_b, node_c):
+            await n.start()
+        node_b.send_key_exchange(('127.0.0.1', 12101))
+        await asyncio.sleep(0.05)
+        node_b.send_hello(('127.0.0.1', 12101))
+        await asyncio.sleep(0.3)
+        assert node_a.scheduler.queued(('127.0.0.1', 12102)) > 0
+        t0 = time.monotonic()
+        node_c.send_key_exchange(('127.0.0.1', 12101))
+        while node_c.peers[('127.0.0.1', 12101)]['session'] is None:
+            await asyncio.sleep(0.005)
+        assert time.monotonic() - t0 < 0.1
+        for _ in range(40):
+            await asyncio.sleep(0.1)
+            if 'bulk' in node_b.storage:
+                break
+        assert node_b.storage['bulk'] == (data, 1)
+        for n in (node_a, node_b, node_c):
+            n.stop()
+
+    asyncio.run(_run())
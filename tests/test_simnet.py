@@ -0,0 +1,163 @@
+import asyncio
+import random
+import time
+from mesh.simnet import SimNetwork
+
+
+def _pair_sync(net, size=64 * 1024, loss=0.0):
+    a, b = net.add_node(), net.add_node()
+    a.add_object('obj', random.Random(size).randbytes(size), version=1)  # incompressible
+
+    async def _run():
+        await net.start_all()
+        b.send_key_exchange((a.host, a.port))
+        await asyncio.sleep(1.0)
+        net.default.loss = loss  # only the sync is lossy
+        while 'obj' not in b.storage and net.now < 30:
+            b.send_hello((a.host, a.port))
+            await asyncio.sleep(0.5)
+        return net.now
+
+    return net.run(_run())
+
+
+def test_virtual_clock_latency_and_bandwidth():
+    net = SimNetwork(seed=1, latency=0.25)
+    t0 = time.perf_counter()
+    done = _pair_sync(net)
+    assert time.perf_counter() - t0 < done
+    # HELLO, DIGESTS, REQUEST and CHUNK need at least two round trips after t=1
+    assert done >= 2.0
+    net.close()
+
+    net = SimNetwork(seed=1, latency=0.001, bandwidth=32 * 1024)
+    assert _pair_sync(net) >= 1.0 + 2.0  # 64 KiB at 32 KiB/s
+    net.close()
+
+
+def test_runs_are_repeatable():
+    def _once():
+        net = SimNetwork(seed=7, latency=0.01, jitter=0.01, reorder=0.1)
+        done = _pair_sync(net, loss=0.05)
+        stats = dict(net.stats)
+        net.close()
+        return done, stats
+
+    first = _once()
+    assert first[0] < 30 and first == _once()
+    assert first[1]['dropped_loss'] > 0 and first[1]['reordered'] > 0
+
+
+def test_partition_and_heal():
+    net = SimNetwork(seed=2, latency=0.01)
+    a, b = net.add_node(), net.add_node()
+    a.add_object('obj', b'x' * 5000, version=1)
+
+    async def _run():
+        await net.start_all()
+        net.partition([a.host], [b.host])
+        b.send_key_exchange((a.host, a.port))
+        await asyncio.sleep(1.0)
+        assert b.peers[(a.host, a.port)]['session'] is None
+        net.heal()
+        b.send_key_exchange((a.host, a.port))
+        await asyncio.sleep(0.1)
+        b.send_hello((a.host, a.port))
+        await asyncio.sleep(1.0)
+        return 'obj' in b.storage
+
+    assert net.run(_run())
+    assert net.stats['dropped_partition'] == 2  # the KEY_EXCHANGE and its resend after one RTO
+    net.close()
+
+
+def test_discovery_spreads_an_object_across_segments():
+    net = SimNetwork(seed=3, latency=0.01, jitter=0.005, loss=0.01)
+    nodes = [net.add_node(segments=[f'lan{i // 10}'] + (['backbone'] if i % 10 == 0 else [])) for i in range(100)]
+    nodes[42].add_object('obj', bytes(20000), version=1)
+
+    async def _run():
+        await net.start_all(discovery=True)
+        while not all('obj' in n.storage for n in nodes) and net.now < 60:
+            await asyncio.sleep(0.5)
+        return net.now
+
+    assert net.run(_run()) < 60
+    net.close()
+
+
+def _gossip_mesh(fanout, anti_entropy):
+    net = SimNetwork(seed=3, latency=0.01, jitter=0.005, loss=0.01)
+    nodes = [net.add_node(segments=[f'lan{i // 10}'] + (['backbone'] if i % 10 == 0 else []),
+                          fanout=fanout, anti_entropy=anti_entropy) for i in range(100)]
+
+    async def _run():
+        await net.start_all(discovery=True)
+        await asyncio.sleep(12.0)  # every node has announced and been greeted at least once
+        t0 = net.now
+        nodes[42].add_object('obj', bytes(range(256)) * 80, version=1)
+        while not all('obj' in n.storage for n in nodes) and net.now < t0 + 60:
+            await asyncio.sleep(0.05)
+        return net.now - t0
+
+    took = net.run(_run())
+    gossip = sum(v for n in nodes for (mtype, _), v in n.metrics.metrics['mesh_messages_sent_total'].values.items()
+                 if mtype == 'GOSSIP')
+    transfers = sum(n.metrics.metrics['mesh_transfers_total'].values.get(('complete',), 0) for n in nodes)
+    net.close()
+    return took, gossip, transfers
+
+
+def test_push_gossip_spreads_fast_and_cheaply():
+    pull, _, _ = _gossip_mesh(fanout=0, anti_entropy=0)
+    push, gossip, transfers = _gossip_mesh(fanout=4, anti_entropy=10.0)
+    # changed summaries are announced at once, so pulling no longer waits for announcement cycles either
+    assert push < 1.0 and push <= pull
+    assert gossip <= 4 * 100 and transfers == 99  # one rumor per fanout peer, every node fetches once
+
+
+def _sent(nodes, mtype):
+    return sum(v for n in nodes for (t, _), v in n.metrics.metrics['mesh_messages_sent_total'].values.items() if t == mtype)
+
+
+def test_idle_discovery_is_quiet_and_expired_sessions_resume():
+    net = SimNetwork(seed=5, latency=0.01)
+    nodes = [net.add_node(fanout=0, anti_entropy=0, session_ttl=40.0) for _ in range(4)]
+
+    async def _run():
+        await net.start_all(discovery=True)
+        await asyncio.sleep(12.0)
+        ke, hello = _sent(nodes, 'KEY_EXCHANGE'), _sent(nodes, 'HELLO')
+        assert ke == hello == 4 * 3  # one exchange and one HELLO per ordered pair
+        await asyncio.sleep(20.0)  # four more announcement rounds, nothing changed
+        assert (_sent(nodes, 'KEY_EXCHANGE'), _sent(nodes, 'HELLO')) == (ke, hello)
+        nodes[1].add_object('obj', b'r' * 3000, version=1)
+        await asyncio.sleep(1.0)  # the changed summary is announced at once
+        assert all('obj' in n.storage for n in nodes)
+        await asyncio.sleep(40.0)  # sessions expire and are renewed from tickets
+
+    net.run(_run())
+    kinds = {}
+    for n in nodes:
+        for (kind,), v in n.metrics.metrics['mesh_sessions_total'].values.items():
+            kinds[kind] = kinds.get(kind, 0) + v
+    assert kinds['full'] + kinds['resumed'] == 2 * 2 * 6  # each pair set up once and renewed once, on both ends
+    assert kinds['resumed'] > 0  # renewed from a ticket where the side holding one noticed the expiry first
+    net.close()
+
+
+def test_anti_entropy_reconciles_without_gossip():
+    net = SimNetwork(seed=4, latency=0.01)
+    a, b = net.add_node(fanout=0, anti_entropy=2.0), net.add_node(fanout=0, anti_entropy=2.0)
+
+    async def _run():
+        await net.start_all()
+        b.send_hello((a.host, a.port))
+        await asyncio.sleep(0.5)
+        a.add_object('obj', b'x' * 5000, version=1)
+        while 'obj' not in b.storage and net.now < 30:
+            await asyncio.sleep(0.1)
+        return net.now
+
+    assert net.run(_run()) < 0.5 + 3.0 + 1.0
+    net.close()
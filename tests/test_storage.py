@@ -0,0 +1,202 @@
+import asyncio
+import base64
+import json
+import os
+import socket
+import threading
+import pytest
+from mesh import storage
+from mesh.async_sync import SyncNode
+from mesh.storage import LogStore, MemoryStore
+
+
+def test_log_store_reopen_reads_index_only(tmp_path):
+    st = LogStore(str(tmp_path))
+    st.put('a', b'hello world', 1)
+    st.put('b', b'x' * 5000, 2)
+    st.put('a', b'hello again', 2)
+    view = st.read('b', 1024, 1024)
+    assert isinstance(view, memoryview) and view == b'x' * 1024
+    st.close()
+
+    st = LogStore(str(tmp_path))
+    assert sorted(st.versions()) == [('a', 2), ('b', 2)]
+    assert st['a'] == (b'hello again', 2)
+    mem = MemoryStore()
+    mem.put('b', b'x' * 5000, 2)
+    assert st.digest('b') == mem.digest('b')
+    st.close()
+
+
+def test_log_store_recovers_from_torn_write(tmp_path):
+    st = LogStore(str(tmp_path))
+    st.put('a', b'one', 1)
+    st.checkpoint()
+    st.put('b', b'two', 1)
+    st.put('c', b'three', 1)
+    st._f.close()  # crash: no checkpoint for b and c
+    with open(os.path.join(str(tmp_path), storage.LOG_NAME), 'r+b') as f:
+        f.truncate(os.path.getsize(f.name) - 2)  # tear the last record
+
+    st = LogStore(str(tmp_path))
+    assert st['a'] == (b'one', 1) and st['b'] == (b'two', 1)
+    assert 'c' not in st
+    st.put('c', b'three', 1)
+    assert st['c'] == (b'three', 1)
+    st.close()
+
+
+def test_log_store_compaction(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, 'COMPACT_MIN_BYTES', 0)
+    st = LogStore(str(tmp_path))
+    for v in range(1, 6):
+        st.put('a', bytes([v]) * 1000, v)
+    st.put('b', b'keep', 1)
+    del st['b']
+    st.put('c', b'c' * 10, 1)
+    old_view = st.read('a')
+    assert st.needs_compaction()
+    size_before = os.path.getsize(st.log_path)
+    st.compact()
+    assert os.path.getsize(st.log_path) < size_before / 3
+    assert old_view == bytes([5]) * 1000
+    assert st['a'] == (bytes([5]) * 1000, 5) and 'b' not in st and st['c'][0] == b'c' * 10
+    st.close()
+    st = LogStore(str(tmp_path))
+    assert sorted(st.versions()) == [('a', 5), ('c', 1)]
+    st.close()
+
+
+def test_log_store_crash_between_compaction_and_checkpoint(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, 'COMPACT_MIN_BYTES', 0)
+    st = LogStore(str(tmp_path))
+    for i in range(3):
+        st.put(f'o{i}', bytes([i]) * 1000, 1)
+    del st['o0']
+    st.checkpoint()
+    for i in range(3, 23):
+        st.put(f'o{i}', bytes([i]) * 1000, 1)
+
+    def crash():
+        raise OSError('power cut')
+
+    st.checkpoint = crash
+    with pytest.raises(OSError):
+        st.compact()  # the compacted log is in place, the index still describes the old one
+    st._f.close()
+
+    st = LogStore(str(tmp_path))
+    assert len(st) == 22
+    assert all(st[f'o{i}'] == (bytes([i]) * 1000, 1) for i in range(1, 23))
+    st.close()
+
+
+def test_log_store_reads_during_background_compaction(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, 'COMPACT_MIN_BYTES', 0)
+    st = LogStore(str(tmp_path))
+    for i in range(200):
+        st.put('junk%d' % i, os.urandom(2000), 1)
+        del st['junk%d' % i]
+    st.put('obj', b'x' * 3000, 1)
+    done = threading.Event()
+    worker = threading.Thread(target=lambda: (st.compact(), done.set()))
+    worker.start()
+    while not done.is_set():
+        assert st.read('obj', 1000, 1000) == b'x' * 1000
+    worker.join()
+    assert st.read('obj') == b'x' * 3000
+    st.close()
+
+
+def test_node_serves_from_log_store(tmp_path):
+    async def _run():
+        st = LogStore(str(tmp_path / 'a'))
+        st.put('blob', os.urandom(20000), 4)
+        st.close()
+        node_a = SyncNode('127.0.0.1', 12051, node_id='nodeA', storage=LogStore(str(tmp_path / 'a')))
+        node_b = SyncNode('127.0.0.1', 12052, node_id='nodeB', storage=LogStore(str(tmp_path / 'b')))
+        assert node_a.tree.root() != node_b.tree.root()
+        await node_a.start()
+        await node_b.start()
+        node_b.send_hello(('127.0.0.1', 12051))
+        await asyncio.sleep(0.3)
+        assert node_b.storage['blob'] == node_a.storage['blob']
+        node_a.stop()
+        node_b.stop()
+        restarted = SyncNode('127.0.0.1', 12053, node_id='nodeB', storage=LogStore(str(tmp_path / 'b')))
+        assert restarted.tree.root() == node_a.tree.root()
+        restarted.storage.close()
+
+    asyncio.run(_run())
+
+
+def test_node_refuses_chunks_outside_the_object(tmp_path):
+    async def _run():
+        st = LogStore(str(tmp_path))
+        st.put('secret', b's' * 5000, 1)
+        st.put('public', b'p' * 5000, 1)
+        node = SyncNode('127.0.0.1', 12054, node_id='nodeA', storage=st)
+        await node.start()
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(('127.0.0.1', 12055))
+        sock.settimeout(0.5)
+        for chunk in (-1, -5, 99, 0):
+            req = {'type': 'REQUEST', 'from': 'probe', 'id': 'public', 'chunk': chunk}
+            sock.sendto(json.dumps(req).encode(), ('127.0.0.1', 12054))
+        await asyncio.sleep(0.3)
+        replies = []
+        try:
+            while True:
+                replies.append(json.loads(sock.recv(65536)))
+        except socket.timeout:
+            pass
+        sock.close()
+        node.stop()
+        assert [(r['chunk'], base64.b64decode(r['data'])) for r in replies] == [(0, b'p' * 1024)]
+
+    asyncio.run(_run())
+    for st in (MemoryStore(), LogStore(str(tmp_path / 'log'))):
+        st.put('a', b'abc', 1)
+        with pytest.raises(ValueError):
+            st.read('a', -1)
+        st.close()
+
+
+def test_writer_puts_in_pieces_and_checks_the_digest(tmp_path):
+    data = os.urandom(300 * 1024)
+    for st in (MemoryStore(), LogStore(str(tmp_path))):
+        w = st.writer('obj', 3)
+        for i in range(0, len(data), 7000):
+            w.write(memoryview(data)[i:i + 7000])
+        assert w.commit(w.digest) and w.size == len(data)
+        assert st['obj'] == (data, 3) and st.digest('obj') == w.digest
+        bad = st.writer('obj', 4)
+        bad.write(b'tampered')
+        assert not bad.commit('00' * 32) and st.version('obj') == 3
+        st.close()
+    os.remove(os.path.join(str(tmp_path), storage.INDEX_NAME))
+    st = LogStore(str(tmp_path))  # replay checks the CRC the writer computed on the way
+    assert st['obj'] == (data, 3)
+    assert sorted(os.listdir(str(tmp_path))) == [storage.LOG_NAME]
+    st.close()
+
+
+def test_cache_store_spills_least_recently_used(tmp_path):
+    st = storage.CacheStore(str(tmp_path), max_memory=32 * 1024)
+    for i in range(10):
+        st.put(f'o{i}', bytes([i]) * 4096, 1)
+        st.read('o0', 0, 10)  # keep o0 hot
+    st.put('big', b'b' * 5000, 1)  # over max_memory / 8: straight to the log
+    w = st.writer('small', 2)
+    w.write(b'streamed')
+    w.commit()
+    s = st.stats()
+    assert s['hot_bytes'] <= 32 * 1024 and s['spills'] >= 2 and s['hits'] > 0
+    assert 'o0' in st.hot and 'o1' not in st.hot and 'big' in st.log and 'small' in st.hot
+    assert len(st) == 12 and bytes(st.read('o1')) == bytes([1]) * 4096 and st['small'] == (b'streamed', 2)
+    st.put('o1', b'new', 2)  # replaces the spilled copy
+    assert 'o1' not in st.log and st.version('o1') == 2
+    st.close()
+    st = storage.CacheStore(str(tmp_path), max_memory=32 * 1024)
+    assert len(st) == 12 and st['o1'] == (b'new', 2) and not st.hot
+    st.close()
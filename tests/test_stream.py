@@ -0,0 +1,123 @@
+import asyncio
+import os
+from mesh import stream
+from mesh.async_sync import SyncNode
+from mesh.crypto import Session, generate_keypair
+
+
+def test_sealed_records_roundtrip_and_reject_tampering():
+    async def _run():
+        pub_a, priv_a = generate_keypair()
+        pub_b, priv_b = generate_keypair()
+        received = asyncio.Queue()
+
+        async def handle(reader, writer):
+            conn = stream.StreamConnection(reader, writer)
+            await received.put(await conn.recv())  # OPEN, in clear
+            conn.session = Session(priv_b, pub_b, pub_a, aead=True)
+            try:
+                while True:
+                    await received.put(await conn.recv())
+            except (asyncio.IncompleteReadError, stream.StreamError) as e:
+                await received.put(e)
+
+        server = await asyncio.start_server(handle, '127.0.0.1', 12141)
+        conn = await stream.connect('127.0.0.1', 12141, 'a', 9000, Session(priv_a, pub_a, pub_b, aead=True))
+        data = os.urandom(stream.RECORD_SIZE)
+        await conn.send(stream.R_DATA, data)
+        assert (await received.get())[0] == stream.R_OPEN
+        assert await received.get() == (stream.R_DATA, data)
+        # an unsealed record on a secure connection ends it
+        conn.session = None
+        await conn.send(stream.R_DATA, b'forged')
+        assert isinstance(await received.get(), stream.StreamError)
+        conn.close()
+        server.close()
+        await server.wait_closed()
+
+    asyncio.run(_run())
+
+
+async def _pair(port_a, port_b, **kw):
+    node_a = SyncNode('127.0.0.1', port_a, node_id='nodeA', stream_port=0, **kw)
+    node_b = SyncNode('127.0.0.1', port_b, node_id='nodeB', stream_port=0, **kw)
+    await node_a.start()
+    await node_b.start()
+    node_b.send_key_exchange(('127.0.0.1', port_a))
+    await asyncio.sleep(0.05)
+    return node_a, node_b
+
+
+async def _fetch(node_a, node_b, oid, timeout=5.0):
+    node_b.send_hello((node_a.host, node_a.port))
+    for _ in range(int(timeout / 0.02)):
+        await asyncio.sleep(0.02)
+        if oid in node_b.storage:
+            return
+
+
+def _chunks_received(node):
+    return sum(v for (mtype, _), v in node.metrics.metrics['mesh_messages_received_total'].values.items() if mtype == 'CHUNK')
+
+
+def test_large_objects_use_a_pooled_stream_connection():
+    async def _run():
+        node_a, node_b = await _pair(12142, 12143)
+        big = os.urandom(3 * 1024 * 1024 + 100)
+        node_a.add_object('big', big, version=1)
+        await _fetch(node_a, node_b, 'big')
+        assert node_b.storage['big'] == (big, 1)
+        assert _chunks_received(node_b) == 0
+        assert node_b.metrics.metrics['mesh_stream_bytes_total'].values[('received',)] == len(big)
+
+        node_a.add_object('big2', big[::-1], version=1)
+        await _fetch(node_a, node_b, 'big2')
+        assert node_b.storage['big2'] == (big[::-1], 1)
+        assert (node_b.streams.opened, node_b.streams.reused) == (1, 1)
+
+        node_a.add_object('small', b'x' * 5000, version=1)  # below the threshold: datagrams
+        await _fetch(node_a, node_b, 'small')
+        assert node_b.storage['small'] == (b'x' * 5000, 1) and _chunks_received(node_b) == 5
+        node_a.stop()
+        node_b.stop()
+
+    asyncio.run(_run())
+
+
+def test_falls_back_to_datagrams_when_the_stream_fails():
+    async def _run():
+        node_a, node_b = await _pair(12144, 12145, codecs=[])
+        node_a._stream_server.close()  # still advertised, but refuses connections
+        await node_a._stream_server.wait_closed()
+        big = os.urandom(512 * 1024)
+        node_a.add_object('big', big, version=1)
+        await _fetch(node_a, node_b, 'big')
+        assert node_b.storage['big'] == (big, 1)
+        assert _chunks_received(node_b) == 512
+        node_a.stop()
+        node_b.stop()
+
+    asyncio.run(_run())
+
+
+def test_refuses_offsets_outside_the_object():
+    class Conn:
+        def __init__(self):
+            self.sent = []
+
+        async def send(self, rtype, payload):
+            self.sent.append(rtype)
+
+        async def send_json(self, rtype, obj):
+            self.sent.append(rtype)
+
+    async def _run():
+        node = SyncNode('127.0.0.1', 12146, node_id='nodeA')
+        node.add_object('obj', b'x' * 4096, version=1)
+        for offset, expect in ((-1024, [stream.R_ERROR]), (8192, [stream.R_ERROR]), (4096, [stream.R_END]),
+                               (2048, [stream.R_DATA, stream.R_END])):
+            conn = Conn()
+            await node._stream_object(conn, ('127.0.0.1', 1), {'id': 'obj', 'version': 1, 'offset': offset})
+            assert conn.sent == expect
+
+    asyncio.run(_run())
@@ -0,0 +1,94 @@
+import asyncio
+import os
+from mesh.async_sync import SyncNode
+from mesh.transfer import ENDGAME_CHUNKS, IncomingTransfer
+
+
+def test_rarest_first_across_sources():
+    t = IncomingTransfer('o', 1, 'A', size=16, window=4, chunk_size=1)
+    t.add_source('B', [(0, 8)])
+    b = [i for s, c in t.next_batch(0.0, 'B') for i in range(s, s + c)]
+    a = [i for s, c in t.next_batch(0.0, 'A') for i in range(s, s + c)]
+    assert len(b) == 4 and all(i < 8 for i in b)
+    # the full source is asked for chunks no partial holder has
+    assert len(a) == 4 and all(i >= 8 for i in a)
+    t.on_chunk(b[0], b'x', True, 0.1, addr='B')
+    assert b[0] not in t.sources['B'].inflight
+
+
+def test_endgame_and_departed_source():
+    t = IncomingTransfer('o', 1, 'A', size=4, window=8, chunk_size=1)
+    t.add_source('B')
+    assert t.next_batch(0.0, 'A') == [(0, 4)]
+    # everything is in flight at A: B duplicates the outstanding requests
+    assert t.next_batch(0.0, 'B') == [(0, 4)]
+    t.on_chunk(1, b'x', True, 0.1, addr='B')
+    assert 1 not in t.sources['A'].inflight
+    t.remove_source('B')
+    t.remove_source('A')
+    assert not t.inflight and t.peer is None
+    t.add_source('C')
+    assert t.next_batch(0.2, 'C') == [(0, 1), (2, 2)]
+
+
+def test_endgame_waits_for_the_last_chunks():
+    n = ENDGAME_CHUNKS + 4
+    t = IncomingTransfer('o', 1, 'A', size=n, window=n, chunk_size=1)
+    t.add_source('B')
+    assert t.next_batch(0.0, 'A') == [(0, n)]
+    assert t.next_batch(0.0, 'B') == []  # too many missing to duplicate them all
+    for i in range(4):
+        t.on_chunk(i, b'x', True, 0.1, addr='A')
+    assert t.next_batch(0.1, 'B') == [(4, ENDGAME_CHUNKS)]
+    t.add_source('C')
+    assert t.next_batch(0.1, 'C') == []  # each missing chunk is already asked of two sources
+
+
+class SlowTransport:
+    """Delays every datagram, so the origin cannot outrun the swarm on loopback."""
+
+    def __init__(self, transport, delay):
+        self.transport = transport
+        self.delay = delay
+        self.chunks = 0
+
+    def sendto(self, data, addr):
+        if len(data) > 1000:
+            self.chunks += 1
+        asyncio.get_running_loop().call_later(self.delay, self.transport.sendto, data, addr)
+
+
+def test_peers_pull_from_each_other():
+    async def _run():
+        ports = [12091, 12092, 12093, 12094]
+        nodes = [SyncNode('127.0.0.1', p, node_id=f'n{p}', window=16) for p in ports]
+        data = os.urandom(256 * 1024)
+        nodes[0].add_object('set', data, version=1)
+        for n in nodes:
+            await n.start()
+            n.transport = SlowTransport(n.transport, 0.02 if n is nodes[0] else 0.002)
+        for a in nodes:
+            for p in ports:
+                if p != a.port:
+                    a.send_key_exchange(('127.0.0.1', p))
+        await asyncio.sleep(0.1)
+        for a in nodes[1:]:
+            for p in ports[1:]:
+                if p != a.port:
+                    a.send_hello(('127.0.0.1', p))
+        await asyncio.sleep(0.1)
+        for a in nodes[1:]:
+            a.send_hello(('127.0.0.1', ports[0]))
+        for _ in range(100):
+            await asyncio.sleep(0.1)
+            if all('set' in n.storage for n in nodes[1:]):
+                break
+        for n in nodes[1:]:
+            assert n.storage['set'] == (data, 1)
+        # the origin served well under three full copies; the rest came from the other pullers
+        assert nodes[0].transport.chunks < 3 * 256
+        assert sum(n.transport.chunks for n in nodes[1:]) > 0
+        for n in nodes:
+            n.stop()
+
+    asyncio.run(_run())
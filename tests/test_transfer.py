@@ -0,0 +1,62 @@
+import asyncio
+import os
+import random
+from mesh.async_sync import SyncNode
+from mesh.transfer import IncomingTransfer, to_ranges
+
+
+def test_window_and_selective_nack():
+    t = IncomingTransfer('o', 1, None, size=10, window=4, chunk_size=1)
+    assert t.next_batch(0.0) == [(0, 4)]
+    assert t.on_chunk(0, b'a', True, 0.1) is not None
+    t.on_chunk(2, b'c', True, 0.1)
+    assert t.next_batch(0.1) == [(4, 2)]
+    # chunks 1 and 3 were lost: only those (plus the young ones once expired) are re-requested
+    assert t.expired(1.0, 0.5) == [(1, 1), (3, 3)]
+    assert t.on_chunk(1, b'b', True, 1.1) is None  # retransmitted: no RTT sample (Karn)
+    assert t.missing() == [3, 4, 5, 6, 7, 8, 9]
+    assert to_ranges([5, 1, 2, 9]) == [(1, 2), (5, 1), (9, 1)]
+
+
+def test_unsized_transfer_is_sequential():
+    t = IncomingTransfer('o', 1, None, chunk_size=1)
+    assert t.next_batch(0.0) == [(0, 1)]
+    t.on_chunk(0, b'a', True, 0.0)
+    assert t.next_batch(0.0) == [(1, 1)]
+    t.on_chunk(1, b'b', False, 0.0)
+    assert t.complete() and t.assemble() == b'ab'
+
+
+class LossyTransport:
+    def __init__(self, transport, loss, seed=1):
+        self.transport = transport
+        self.loss = loss
+        self.rng = random.Random(seed)
+
+    def sendto(self, data, addr):
+        if self.rng.random() >= self.loss:
+            self.transport.sendto(data, addr)
+
+
+def test_windowed_transfer_over_lossy_link():
+    async def _run():
+        node_a = SyncNode('127.0.0.1', 12021, node_id='nodeA')
+        node_b = SyncNode('127.0.0.1', 12022, node_id='nodeB', window=32)
+        data = os.urandom(300 * 1024)
+        node_a.add_object('big', data, version=1)
+        await node_a.start()
+        await node_b.start()
+        node_a.transport = LossyTransport(node_a.transport, 0.1)
+        node_b.send_key_exchange(('127.0.0.1', 12021))
+        await asyncio.sleep(0.05)
+        node_b.send_hello(('127.0.0.1', 12021))
+        for _ in range(100):
+            await asyncio.sleep(0.1)
+            if 'big' in node_b.storage:
+                break
+        assert node_b.storage['big'] == (data, 1)
+        assert not node_b.pending
+        node_a.stop()
+        node_b.stop()
+
+    asyncio.run(_run())
@@ -0,0 +1,41 @@
+import asyncio
+import json
+from mesh import wire
+from mesh.async_sync import SyncNode
+
+
+def test_chunk_frame_roundtrip():
+    data = bytes(range(256)) * 4
+    frame = wire.decode_frame(wire.encode_chunk('objX', 7, 3, data, more=True))
+    assert frame.type == wire.T_CHUNK
+    assert (frame.oid, frame.index, frame.version, frame.more) == ('objX', 7, 3, True)
+    assert bytes(frame.payload) == data
+    assert len(wire.encode_chunk('objX', 7, 3, data, more=True)) == wire.HEADER_SIZE + 4 + len(data)
+
+
+def test_control_message_roundtrip():
+    msg = {'type': 'DIGESTS', 'from': 'nodeA', 'digests': [{'id': 'o', 'version': 2}]}
+    frame = wire.decode_frame(wire.encode_message(msg))
+    assert frame.to_message('nodeA') == msg
+    assert not wire.is_binary(json.dumps(msg).encode('utf-8'))
+
+
+def test_binary_negotiated_transfer():
+    async def _run():
+        node_a = SyncNode('127.0.0.1', 12011, node_id='nodeA')
+        node_b = SyncNode('127.0.0.1', 12012, node_id='nodeB')
+        data = b'B' * 900
+        node_a.add_object('objY', data, version=2)
+        await node_a.start()
+        await node_b.start()
+        node_b.send_key_exchange(('127.0.0.1', 12011))
+        await asyncio.sleep(0.05)
+        node_b.send_hello(('127.0.0.1', 12011))
+        await asyncio.sleep(0.3)
+        assert node_b.storage['objY'] == (data, 2)
+        assert node_b._uses_binary(('127.0.0.1', 12011))
+        assert node_a._uses_binary(('127.0.0.1', 12012))
+        node_a.stop()
+        node_b.stop()
+
+    asyncio.run(_run())